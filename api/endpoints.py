@@ -1,44 +1,173 @@
 import logging
+import time
+from typing import Optional
 from fastapi import APIRouter, Form, Response
+from fastapi.concurrency import run_in_threadpool
 from core.assistant import WhatsappAssistant
-from services.whatsapp_client import send_message
-from core.tools import rag_manager
+from core.idempotency import WEBHOOK_DEDUPE_ENABLED, WebhookDeduplicator
+from core.intent_router import IntentRouter
+from core.kb_reload import KnowledgeBaseReloader
+from core.llm_governor import governor
+from core.tracing import new_trace_id, set_trace_id, set_user_id, trace_id_var, user_id_var
+from core.pipeline import WEBHOOK_MODE, WEBHOOK_WORKERS, QueueFullError, WebhookPipeline
+from core.scheduler import ConversationLocks, UserScheduler
+from core.streaming import PROGRESSIVE_REPLIES
+from core import metrics, redis_pool
+from core.startup import resource
+from core.tenants import MULTI_TENANT, TenantRegistry, get_tenant, set_tenant, tenant_cache, tenant_var
+from services.whatsapp_client import outbound, send_message
+from core.tools import knowledge_base
 
 router = APIRouter()
-assistant = WhatsappAssistant()
+# El asistente (memoria en Redis e intent router) se construye por worker al arrancar.
+assistant = resource("assistant", WhatsappAssistant)
+deduplicator = WebhookDeduplicator()
+kb_reloader = KnowledgeBaseReloader(knowledge_base)
+# Con MULTI_TENANT cada mensaje se atiende como el local dueño del número `To` (core/tenants.py).
+tenants = TenantRegistry() if MULTI_TENANT else None
 
-@router.post("/webhook")
-async def receive_webhook(From: str = Form(...), Body: str = Form(...)):
+
+def process_message(user_id: str, body: str, received_at: Optional[float] = None):
     """
-    Endpoint que recibe los mensajes de Twilio y los procesa con el agente de LangGraph.
+    Procesa un mensaje entrante: comandos especiales, agente de LangGraph y envío de la respuesta.
+    Es bloqueante; se ejecuta en un hilo (modo sync) o en un worker del pipeline (modo queue).
+    `received_at` (time.time() de recepción del webhook) se usa para medir el tiempo hasta el primer mensaje.
     """
-    logging.info(f"Mensaje recibido de {From}: '{Body}'")
-    user_message = Body.strip().lower()
+    received_at = received_at or time.time()
+    user_message = body.strip().lower()
+    first_sent = False
+
+    def reply(text: str):
+        nonlocal first_sent
+        if not first_sent:
+            first_sent = True
+            metrics.observe("reply_time_to_first_message_seconds", time.time() - received_at,
+                            mode="progressive" if PROGRESSIVE_REPLIES else "batch")
+        send_message(to=user_id, body=text)
 
     try:
         if user_message == 'fin':
-            assistant.clear_memory(From)
-            send_message(to=From, body="✅ Memoria de conversación borrada. Puedes empezar de cero.")
-            return Response(status_code=204)
+            assistant.get().clear_memory(user_id)
+            reply("✅ Memoria de conversación borrada. Puedes empezar de cero.")
+            return
 
         if user_message == 'recargar':
-            logging.info(f"Peticion de recarga de knowledge base recibida de {From}.")
-            # La recarga ahora se hace directamente sobre la instancia del rag_manager
-            success = rag_manager.reload_vector_store()
-            if success:
-                send_message(to=From, body="✅ Base de conocimientos recargada con éxito.")
+            logging.info("Peticion de recarga de knowledge base recibida de %s.", user_id)
+            # La versión nueva se construye en segundo plano y todos los workers la cargan al anunciarse.
+            if kb_reloader.request_rebuild(tenant=get_tenant()):
+                reply("🔄 Actualizando la base de conocimientos en segundo plano. Se usará en todos los workers apenas esté lista.")
             else:
-                send_message(to=From, body="❌ Error: No se pudo recargar la base de conocimientos.")
-            return Response(status_code=204)
+                reply("⏳ Ya hay una actualización de la base de conocimientos en curso.")
+            return
 
-        final_response = assistant.get_response(user_id=From, user_query=Body)
+        if PROGRESSIVE_REPLIES:
+            assistant.get().get_response(user_id=user_id, user_query=body, on_partial=reply)
+            return
+
+        final_response = assistant.get().get_response(user_id=user_id, user_query=body)
 
         if final_response:
-            send_message(to=From, body=final_response)
+            reply(final_response)
 
     except Exception as e:
-        logging.error(f"Ocurrió un error al procesar el mensaje de {From}: {e}", exc_info=True)
+        logging.error("Ocurrió un error al procesar el mensaje de %s: %s", user_id, e, exc_info=True)
         error_message = "Lo siento, ocurrió un error inesperado. Por favor, intenta de nuevo más tarde."
-        send_message(to=From, body=error_message)
+        reply(error_message)
+
+
+def _handle_job(job: dict):
+    """Adaptador entre los trabajos del pipeline y process_message."""
+    token = set_trace_id(job.get("trace_id"))
+    user_token = set_user_id(job["user_id"])
+    tenant = tenants.get(job.get("tenant_id")) if tenants is not None else None
+    tenant_token = set_tenant(tenant)
+    started = time.monotonic()
+    try:
+        process_message(job["user_id"], job["body"], received_at=job.get("enqueued_at"))
+        deduplicator.complete(job.get("message_sids", ()))
+    finally:
+        metrics.observe("tenant_turn_seconds", time.monotonic() - started, tenant=get_tenant().id)
+        tenant_var.reset(tenant_token)
+        user_id_var.reset(user_token)
+        trace_id_var.reset(token)
+
+
+# Los workers del pipeline entregan cada mensaje al scheduler, que procesa en orden
+# los mensajes de un mismo usuario y fusiona ráfagas en un único turno del agente.
+scheduler = UserScheduler(handler=_handle_job, max_concurrency=WEBHOOK_WORKERS)
+pipeline = WebhookPipeline(handler=_handle_job, scheduler=scheduler)
+# En modo sync cada request espera su turno: los mensajes de una misma conversación no se solapan.
+conversation_locks = ConversationLocks()
+
+
+@router.post("/webhook")
+async def receive_webhook(From: str = Form(...), Body: str = Form(...), MessageSid: Optional[str] = Form(None),
+                          To: Optional[str] = Form(None)):
+    """
+    Endpoint que recibe los mensajes de Twilio y los procesa con el agente de LangGraph.
+    En modo 'queue' solo encola el mensaje y responde de inmediato.
+    Las entregas repetidas del mismo `MessageSid` (reintentos de Twilio) se confirman sin procesarse.
+    Con MULTI_TENANT el número `To` elige el local; los mensajes a números desconocidos se descartan.
+    """
+    trace_id = new_trace_id(MessageSid)
+    set_trace_id(trace_id)
+    set_user_id(From)
+    logging.info("Mensaje recibido de %s (%d caracteres).", From, len(Body))
+    logging.debug("Contenido del mensaje de %s: %r", From, Body)
+    metrics.inc("webhook_requests_total", mode=WEBHOOK_MODE)
+
+    tenant_id = None
+    if tenants is not None:
+        tenant = tenants.resolve(To)
+        if tenant is None:
+            logging.warning("Mensaje de %s a un número sin local configurado (%s); se descarta.", From, To)
+            metrics.inc("tenant_unknown_number_total")
+            return Response(status_code=204)
+        tenant_id = tenant.id
+
+    if WEBHOOK_DEDUPE_ENABLED and not await deduplicator.claim(MessageSid):
+        logging.info("Entrega duplicada de %s ignorada (MessageSid %s).", From, MessageSid)
+        return Response(status_code=204)
+    message_sids = [MessageSid] if WEBHOOK_DEDUPE_ENABLED and MessageSid else []
+
+    if WEBHOOK_MODE == "queue":
+        try:
+            await pipeline.enqueue(From, Body, message_sids=message_sids, trace_id=trace_id, tenant_id=tenant_id)
+        except QueueFullError as e:
+            logging.error("No se pudo encolar el mensaje de %s: %s", From, e)
+            await deduplicator.release(MessageSid)
+            # Un 503 hace que Twilio reintente la entrega más tarde.
+            return Response(status_code=503)
+        return Response(status_code=204)
+
+    received_at = time.time()
+    async with conversation_locks.hold((tenant_id, From)):
+        await run_in_threadpool(_handle_job, {
+            "user_id": From, "body": Body, "enqueued_at": received_at, "message_sids": message_sids, "trace_id": trace_id,
+            "tenant_id": tenant_id,
+        })
+    return Response(status_code=204)
+
 
-    return Response(status_code=204)
\ No newline at end of file
+@router.get("/stats")
+async def get_stats():
+    """Expone la profundidad de la cola, la ocupación de los workers y los tiempos por etapa."""
+    stats = {"webhook_mode": WEBHOOK_MODE}
+    if WEBHOOK_MODE == "queue":
+        stats["pipeline"] = await pipeline.stats()
+        stats["scheduler"] = scheduler.stats()
+    else:
+        stats["conversation_locks"] = conversation_locks.stats()
+    stats["redis_pools"] = redis_pool.pool_stats()
+    if knowledge_base.loaded:
+        stats["kb_cache"] = knowledge_base.get().cache.stats()
+    stats["knowledge_base"] = kb_reloader.stats()
+    stats["llm_governor"] = governor.stats()
+    if tenants is not None:
+        stats["tenants"] = tenant_cache.stats(tenants.all())
+    stats["intent_router"] = IntentRouter.stats()
+    stats["webhook_dedupe"] = WebhookDeduplicator.stats()
+    if outbound.loaded and outbound.get():
+        stats["outbound"] = outbound.get().stats()
+    stats["metrics"] = metrics.snapshot()
+    return stats
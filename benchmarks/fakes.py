@@ -0,0 +1,288 @@
+"""
+Dobles locales para medir la aplicación sin servicios externos: un Redis en memoria y un
+modelo de chat con guion que emite llamadas a herramientas deterministas con latencia configurable.
+Twilio y MercadoPago se reemplazan con los transportes falsos de `services/`
+(WHATSAPP_TRANSPORT=fake, PAYMENT_PROVIDER=fake).
+"""
+import asyncio
+import fnmatch
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import redis
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from core.catalog import catalog, normalize_name
+
+
+def _encode(value):
+    """Redis guarda todo como cadena: los números se convierten, los bytes se conservan."""
+    return value if isinstance(value, (bytes, str)) else str(value)
+
+
+class InMemoryRedis:
+    """
+    Subconjunto thread-safe de la API de redis-py que usa la aplicación (strings, listas,
+    hashes, sorted sets, expiraciones y pipelines). No pretende ser completo ni exacto en los bordes.
+    """
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self.commands = 0
+
+    def _alive(self, key: str) -> bool:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def _typed(self, key: str, kind, create: bool = False):
+        if not self._alive(key):
+            if not create:
+                return None
+            self._data[key] = kind()
+        value = self._data[key]
+        if not isinstance(value, kind):
+            raise redis.exceptions.ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _command(self, name: str, *args, **kwargs):
+        with self._lock:
+            self.commands += 1
+            return getattr(self, "_" + name)(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        if name.startswith("_") or not hasattr(type(self), "_" + name):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._command(name, *args, **kwargs)
+
+    def pipeline(self, transaction: bool = True):
+        return _Pipeline(self)
+
+    def close(self):
+        pass
+
+    # --- Comandos ---
+    def _ping(self):
+        return True
+
+    def _get(self, key):
+        return self._typed(key, (str, bytes))
+
+    def _set(self, key, value, ex=None, nx=False):
+        if nx and self._alive(key):
+            return None
+        self._data[key] = _encode(value)
+        self._expires.pop(key, None)
+        if ex:
+            self._expires[key] = time.monotonic() + ex
+        return True
+
+    def _delete(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                removed += 1
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return removed
+
+    def _exists(self, *keys):
+        return sum(1 for key in keys if self._alive(key))
+
+    def _expire(self, key, seconds):
+        if not self._alive(key):
+            return False
+        self._expires[key] = time.monotonic() + seconds
+        return True
+
+    def _keys(self, pattern="*"):
+        return [key for key in list(self._data) if self._alive(key) and fnmatch.fnmatchcase(key, pattern)]
+
+    def _rpush(self, key, *values):
+        items = self._typed(key, list, create=True)
+        items.extend(_encode(v) for v in values)
+        return len(items)
+
+    def _rpop(self, key):
+        items = self._typed(key, list)
+        return items.pop() if items else None
+
+    def _lpop(self, key):
+        items = self._typed(key, list)
+        return items.pop(0) if items else None
+
+    def _llen(self, key):
+        items = self._typed(key, list)
+        return len(items) if items else 0
+
+    def _lrange(self, key, start, end):
+        items = self._typed(key, list) or []
+        end = len(items) if end == -1 else (end + 1 if end >= 0 else len(items) + end + 1)
+        start = max(0, len(items) + start) if start < 0 else start
+        return items[start:end]
+
+    def _ltrim(self, key, start, end):
+        items = self._typed(key, list)
+        if items is not None:
+            items[:] = self._lrange(key, start, end)
+        return True
+
+    def _hgetall(self, key):
+        return dict(self._typed(key, dict) or {})
+
+    def _hget(self, key, field):
+        return (self._typed(key, dict) or {}).get(field)
+
+    def _hset(self, key, field=None, value=None, mapping=None):
+        fields = self._typed(key, dict, create=True)
+        updates = dict(mapping or {})
+        if field is not None:
+            updates[field] = value
+        added = sum(1 for f in updates if f not in fields)
+        fields.update({f: _encode(v) for f, v in updates.items()})
+        return added
+
+    def _hincrby(self, key, field, amount=1):
+        fields = self._typed(key, dict, create=True)
+        fields[field] = str(int(fields.get(field, 0)) + amount)
+        return int(fields[field])
+
+    def _zadd(self, key, mapping):
+        members = self._typed(key, dict, create=True)
+        added = sum(1 for member in mapping if member not in members)
+        members.update({member: float(score) for member, score in mapping.items()})
+        return added
+
+    def _zrank(self, key, member):
+        members = self._typed(key, dict) or {}
+        if member not in members:
+            return None
+        return sorted(members, key=lambda m: (members[m], m)).index(member)
+
+    def _zrem(self, key, *members):
+        existing = self._typed(key, dict) or {}
+        return sum(1 for member in members if existing.pop(member, None) is not None)
+
+    def _zremrangebyscore(self, key, min_score, max_score):
+        members = self._typed(key, dict) or {}
+        low, high = float(min_score), float(max_score)
+        stale = [member for member, score in members.items() if low <= score <= high]
+        for member in stale:
+            del members[member]
+        return len(stale)
+
+    def _zcard(self, key):
+        return len(self._typed(key, dict) or {})
+
+    def _publish(self, channel, message):
+        return 0
+
+
+class _Pipeline:
+    """Acumula comandos y los ejecuta juntos, de forma atómica respecto de los demás hilos."""
+    def __init__(self, redis: InMemoryRedis):
+        self.redis = redis
+        self.calls: List[tuple] = []
+
+    def __getattr__(self, name: str):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.redis._lock:
+            calls, self.calls = self.calls, []
+            return [self.redis._command(name, *args, **kwargs) for name, args, kwargs in calls]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.calls = []
+
+
+class AsyncInMemoryRedis:
+    """Versión asyncio del Redis en memoria; comparte los datos con la instancia síncrona."""
+    def __init__(self, sync: InMemoryRedis):
+        self.sync = sync
+
+    def __getattr__(self, name: str):
+        command = getattr(self.sync, name)
+
+        async def call(*args, **kwargs):
+            return command(*args, **kwargs)
+        return call
+
+    async def blpop(self, keys, timeout: float = 0):
+        deadline = time.monotonic() + (timeout or 0)
+        while True:
+            for key in keys:
+                value = self.sync.lpop(key)
+                if value is not None:
+                    return key, value
+            if timeout and time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(0.01)
+
+    async def aclose(self):
+        pass
+
+
+_calls_lock = threading.Lock()
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Modelo de chat determinista para pruebas de carga. Según el último mensaje del usuario
+    pide herramientas (consulta a la base de conocimientos, agregar productos mencionados del
+    catálogo, ver carrito, pagar) y, tras recibir sus resultados, responde con un texto fijo.
+    Cada llamada duerme `latency` segundos para simular la red y el tiempo de generación.
+    """
+    latency: float = 0.3
+    user_id: str = "whatsapp:+000000000"
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _plan(self, text: str, user_id: str) -> List[dict]:
+        normalized = normalize_name(text)
+        calls = []
+        if "pagar" in normalized or "checkout" in normalized:
+            calls.append(("checkout", {"user_id": user_id}))
+        elif "carrito" in normalized:
+            calls.append(("view_cart", {"user_id": user_id}))
+        mentions = catalog.find_mentions(text)
+        if mentions and any(word in normalized for word in ("agrega", "quiero", "sumame", "dame")):
+            for product in mentions:
+                calls.append(("add_item_to_cart", {"user_id": user_id, "item_name": product.name, "quantity": 1}))
+        if "?" in text or any(word in normalized for word in ("menu", "horario", "precio", "tienen", "envio")):
+            calls.append(("get_knowledge_base_response", {"user_query": text}))
+        return [{"name": name, "args": args, "id": f"call_{self.calls}_{i}"} for i, (name, args) in enumerate(calls)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        with _calls_lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            results = [m.content for m in messages if isinstance(m, ToolMessage)][-3:]
+            message = AIMessage(content="¡Listo! " + " ".join(r[:160] for r in results))
+        else:
+            text = last.content if isinstance(last, HumanMessage) else ""
+            # El asistente pasa el user_id como metadata de la ejecución.
+            user_id = (getattr(run_manager, "metadata", None) or {}).get("user_id", self.user_id)
+            tool_calls = self._plan(text, user_id)
+            message = AIMessage(content="" if tool_calls else "¡Hola! ¿En qué te puedo ayudar?", tool_calls=tool_calls)
+        return ChatResult(generations=[ChatGeneration(message=message)])
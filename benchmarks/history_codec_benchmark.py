@@ -0,0 +1,105 @@
+"""
+Compara los codecs del historial de conversaciones: bytes por mensaje guardado en Redis y
+tiempo de codificación y decodificación por mensaje.
+
+Uso:
+    python -m benchmarks.history_codec_benchmark [--traffic archivo.jsonl] [--repeat 200]
+
+Los mensajes imitan lo que guarda el asistente: las preguntas del archivo de tráfico, las
+respuestas del modelo con los metadatos que agrega OpenAI (id, response_metadata) y, para
+ver el efecto de zlib, llamadas a herramientas con salidas largas de la base de conocimientos.
+No usa Redis ni la red.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from core.history_codec import JsonCodec, MsgpackCodec, decode_message
+from core.rag_manager import KNOWLEDGE_BASE_DIR
+
+DEFAULT_TRAFFIC = os.path.join(os.path.dirname(__file__), "traffic", "sample.jsonl")
+
+
+def _openai_metadata(index: int) -> dict:
+    """Metadatos con la forma de los que agrega langchain-openai a cada respuesta."""
+    return {
+        "id": f"run-{index:08x}-7f3a-4c1e-9d2b-5a6e8f0c1d2e",
+        "response_metadata": {"finish_reason": "stop", "model_name": "gpt-4o-mini-2024-07-18", "system_fingerprint": "fp_0f03d4f0ee"},
+    }
+
+
+def build_messages(traffic_path: str) -> dict:
+    """Dos muestras: el historial típico (pregunta y respuesta) y uno con herramientas."""
+    with open(traffic_path, "r", encoding="utf-8") as f:
+        bodies = [json.loads(line)["body"] for line in f if line.strip()]
+    with open(os.path.join(KNOWLEDGE_BASE_DIR, "knowledge_base.txt"), "r", encoding="utf-8") as f:
+        knowledge = f.read()
+
+    turns = []
+    for index, body in enumerate(bodies):
+        turns.append(HumanMessage(content=body))
+        turns.append(AIMessage(content=f"¡Claro! Sobre '{body}': te cuento que en La Semilla Café podemos ayudarte con eso.", **_openai_metadata(index)))
+
+    tools = []
+    for index, body in enumerate(bodies):
+        call = {"id": f"call_{index:024x}", "name": "get_knowledge_base_response", "args": {"user_query": body}}
+        tools.append(HumanMessage(content=body))
+        tools.append(AIMessage(
+            content="",
+            tool_calls=[call],
+            additional_kwargs={"tool_calls": [{"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": json.dumps(call["args"])}}]},
+            **_openai_metadata(index),
+        ))
+        tools.append(ToolMessage(content=f"Contexto encontrado para la pregunta '{body}':\n{knowledge[:2500]}", tool_call_id=call["id"], name=call["name"]))
+    return {"turns": turns, "with_tools": tools}
+
+
+def measure(codec, messages: list, repeat: int) -> dict:
+    encoded = [codec.encode(message) for message in messages]
+    sizes = [len(entry.encode("utf-8") if isinstance(entry, str) else entry) for entry in encoded]
+
+    encode_times, decode_times = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message in messages:
+            codec.encode(message)
+        encode_times.append((time.perf_counter() - started) / len(messages))
+        started = time.perf_counter()
+        for entry in encoded:
+            decode_message(entry)
+        decode_times.append((time.perf_counter() - started) / len(messages))
+    return {
+        "bytes_per_message": round(statistics.mean(sizes), 1),
+        "total_bytes": sum(sizes),
+        "encode_us_per_message": round(statistics.median(encode_times) * 1e6, 2),
+        "decode_us_per_message": round(statistics.median(decode_times) * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--traffic", default=DEFAULT_TRAFFIC)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    codecs = {
+        "json (actual)": JsonCodec(),
+        "msgpack": MsgpackCodec(compress_min_bytes=0),
+        "msgpack+zlib": MsgpackCodec(),
+    }
+    results = {}
+    for sample, messages in build_messages(args.traffic).items():
+        rows = {name: measure(codec, messages, args.repeat) for name, codec in codecs.items()}
+        baseline = rows["json (actual)"]["total_bytes"]
+        for row in rows.values():
+            row["size_vs_json"] = round(row["total_bytes"] / baseline, 3)
+        results[sample] = {"messages": len(messages), "codecs": rows}
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Prueba de carga offline de la aplicación completa (`main.app`): reproduce tráfico de webhooks
+desde un archivo JSONL y reporta throughput, latencias por etapa y llamadas al LLM por mensaje.
+
+OpenAI, Redis, Twilio y MercadoPago se reemplazan por dobles locales: un modelo con guion
+(latencia configurable), un Redis en memoria, el transporte falso de WhatsApp y el proveedor
+de pagos falso. Los embeddings son locales (hashing). El índice, la caché de embeddings y el
+archivo de log se escriben en un directorio temporal que se borra al terminar, así que la prueba
+no toca la red ni los datos de la aplicación.
+
+Uso:
+    python -m benchmarks.load_test [--traffic archivo.jsonl] [--repeat 10] [--concurrency 20]
+                                   [--llm-latency 0.3] [--mode sync|queue]
+                                   [--llm-concurrency 8] [--llm-global-concurrency 0] [--llm-queue 32]
+                                   [--output reporte.json]
+
+Cada línea del archivo de tráfico es {"from": "whatsapp:+54...", "body": "..."}. Los mensajes
+de un mismo remitente se envían en orden; `--repeat` multiplica los remitentes para generar
+más conversaciones simultáneas.
+
+Con `--llm-concurrency`/`--llm-queue` bajos y un `--llm-latency` alto se puede ver el governor
+del modelo en acción: la profundidad de su cola y cuántos turnos se descartaron por carga.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+DEFAULT_TRAFFIC = os.path.join(os.path.dirname(__file__), "traffic", "sample.jsonl")
+STAGE_SERIES = (
+    "stage_seconds", "webhook_stage_seconds", "tool_call_seconds",
+    "assistant_turn_seconds", "reply_time_to_first_message_seconds", "llm_queue_wait_seconds",
+)
+
+
+def load_traffic(path: str, repeat: int) -> dict:
+    """Agrupa los mensajes por remitente; cada repetición usa remitentes distintos."""
+    with open(path, "r", encoding="utf-8") as f:
+        messages = [json.loads(line) for line in f if line.strip()]
+    conversations = defaultdict(list)
+    for copy in range(repeat):
+        for message in messages:
+            conversations[f"{message['from']}-{copy}"].append(message["body"])
+    return conversations
+
+
+def percentiles(samples: list) -> dict:
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] if ordered else 0.0
+    return {f"p{int(q * 100)}_ms": round(pick(q) * 1000, 2) for q in (0.5, 0.95, 0.99)}
+
+
+def configure_environment(args, work_dir: str):
+    """Las variables deben fijarse antes de importar la aplicación (se leen al importar)."""
+    os.environ["EMBEDDING_CACHE_DIR"] = os.path.join(work_dir, "embedding_cache")
+    os.environ["LOG_FILE"] = os.path.join(work_dir, "app.log")
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    os.environ.setdefault("WHATSAPP_TRANSPORT", "fake")
+    os.environ.setdefault("TWILIO_WHATSAPP_NUMBER", "whatsapp:+10000000000")
+    os.environ.setdefault("PAYMENT_PROVIDER", "fake")
+    os.environ.setdefault("HISTORY_SUMMARIZER", "truncate")
+    os.environ.setdefault("OUTBOUND_RATE_PER_SECOND", "1000")
+    os.environ.setdefault("OUTBOUND_BURST", "1000")
+    os.environ["RAG_EMBEDDINGS"] = "hashing"
+    os.environ["RAG_VECTOR_BACKEND"] = "numpy"
+    os.environ["WEBHOOK_MODE"] = args.mode
+    os.environ["LLM_MAX_CONCURRENCY"] = str(args.llm_concurrency)
+    os.environ["LLM_GLOBAL_MAX_CONCURRENCY"] = str(args.llm_global_concurrency)
+    os.environ["LLM_MAX_QUEUE"] = str(args.llm_queue)
+
+
+async def drive(client, conversations: dict, concurrency: int) -> list:
+    """Envía cada conversación en orden, con hasta `concurrency` conversaciones a la vez."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def conversation(user_id: str, bodies: list):
+        async with semaphore:
+            for index, body in enumerate(bodies):
+                started = time.perf_counter()
+                response = await client.post("/api/v1/webhook", data={
+                    "From": user_id, "Body": body, "MessageSid": f"SM{abs(hash(user_id))}{index}",
+                })
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+    await asyncio.gather(*(conversation(user_id, bodies) for user_id, bodies in conversations.items()))
+    return latencies
+
+
+async def wait_for_pipeline(pipeline):
+    """En modo 'queue' el webhook responde antes de procesar: se espera a que se vacíe la cola."""
+    while True:
+        stats = await pipeline.stats()
+        if not stats["queue_depth"] and not stats["workers_busy"]:
+            break
+        await asyncio.sleep(0.05)
+    # stop() espera además a que el scheduler termine los turnos en curso.
+    await pipeline.stop()
+
+
+async def run(args, work_dir: str) -> dict:
+    import httpx
+
+    from benchmarks.fakes import AsyncInMemoryRedis, InMemoryRedis, ScriptedChatModel
+    from core import redis_pool
+
+    fake_redis = InMemoryRedis()
+    redis_pool.use_clients(fake_redis, AsyncInMemoryRedis(fake_redis))
+
+    import core.graph
+    import core.tools
+    from api import endpoints
+    from core import metrics
+    from core.llm_governor import governor
+    from core.rag_manager import RAGManager
+    from services import whatsapp_client
+
+    model = ScriptedChatModel(latency=args.llm_latency)
+    core.graph.llm.set(model)
+
+    index_dir = os.path.join(work_dir, "index")
+    manager = RAGManager(embeddings_kind="hashing", backend_kind="numpy", index_dir=index_dir)
+    manager.create_and_save_vector_store()
+    manager.load_vector_store()
+    core.tools.knowledge_base.set(manager)
+
+    import main
+    # La aplicación configura logging a INFO; durante la medición solo interesan los problemas.
+    logging.getLogger().setLevel(args.log_level)
+    conversations = load_traffic(args.traffic, args.repeat)
+    total = sum(len(bodies) for bodies in conversations.values())
+    metrics.registry.reset()
+
+    # ASGITransport no ejecuta el lifespan: los recursos restantes se construyen en el primer uso.
+    dispatcher = whatsapp_client.outbound.get()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as client:
+        if args.mode == "queue":
+            await endpoints.pipeline.start()
+        started = time.perf_counter()
+        latencies = await drive(client, conversations, args.concurrency)
+        if args.mode == "queue":
+            await wait_for_pipeline(endpoints.pipeline)
+        await asyncio.to_thread(dispatcher.stop)
+        elapsed = time.perf_counter() - started
+
+    snapshot = metrics.snapshot()
+    stages = {
+        name: {k: v for k, v in stats.items() if k in ("count", "p50_ms", "p95_ms", "p99_ms")}
+        for name, stats in sorted(snapshot["latencies"].items())
+        if name.split("{")[0] in STAGE_SERIES
+    }
+    return {
+        "mode": args.mode,
+        "messages": total,
+        "conversations": len(conversations),
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 2),
+        "webhook_latency": percentiles(latencies),
+        "llm_calls": model.calls,
+        "llm_calls_per_message": round(model.calls / total, 3),
+        "messages_sent": len(dispatcher.transport.sent),
+        "llm_shed": {
+            reason: count for reason, count in governor.stats()["shed"].items() if count
+        },
+        "redis_commands": fake_redis.commands,
+        "stages": stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--traffic", default=DEFAULT_TRAFFIC)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="segundos por llamada al modelo con guion")
+    parser.add_argument("--mode", choices=("sync", "queue"), default="sync")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="llamadas simultáneas al modelo por worker")
+    parser.add_argument("--llm-global-concurrency", type=int, default=0, help="límite global vía Redis (0 = sin límite)")
+    parser.add_argument("--llm-queue", type=int, default=32, help="turnos que pueden esperar un lugar en el governor")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="además de imprimirlo, guarda el reporte JSON en este archivo")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="load-test-") as work_dir:
+        configure_environment(args, work_dir)
+        report = asyncio.run(run(args, work_dir))
+        # Los handlers de logging tienen abierto el archivo del directorio temporal.
+        from core.logging_config import stop_logging
+        stop_logging()
+        logging.shutdown()
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
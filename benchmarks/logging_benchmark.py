@@ -0,0 +1,110 @@
+"""
+Mide cuánto tarda el código de una request en loguear, con el logging sincrónico original y
+con el logging en cola, sobre un disco simulado lento.
+
+Uso:
+    python -m benchmarks.logging_benchmark [--requests 500] [--records-per-request 8]
+                                           [--disk-latency-ms 2] [--format text|json]
+                                           [--info-rate 0]
+
+Cada "request" emite `--records-per-request` registros INFO con los mismos mensajes que el
+camino del webhook (formato perezoso, trace ID y usuario en el contexto). Cada escritura al
+archivo duerme `--disk-latency-ms`. El reporte muestra el tiempo de logging por request visto
+por el código de la aplicación (p50/p99) y cuántos registros se escribieron, descartaron
+(cola llena) o suprimieron (rate limit). Los logs van a un directorio temporal.
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+from core import metrics
+from core.logging_config import configure_logging, output_handlers, stop_logging
+from core.tracing import set_trace_id, set_user_id
+
+MESSAGES = [
+    ("Mensaje recibido de %s (%d caracteres).", lambda user: (user, 42)),
+    ("Procesando mensaje de %s con LangGraph y memoria Redis.", lambda user: (user,)),
+    ("Ejecutando get_knowledge_base_response (%d caracteres).", lambda user: (42,)),
+    ("Añadiendo %s de '%s' al carrito de %s", lambda user: (2, "Capuchino", user)),
+    ("Mostrando carrito para %s", lambda user: (user,)),
+    ("Iniciando checkout para %s", lambda user: (user,)),
+    ("Link de pago generado para %s: %s", lambda user: (user, "https://pago.local/abc")),
+    ("Mensaje enviado a %s con SID: %s", lambda user: (user, "SM0123456789")),
+]
+
+
+class SlowStream:
+    """Envuelve el archivo de log y demora cada escritura, como un disco saturado o de red."""
+    def __init__(self, stream, latency: float):
+        self.stream = stream
+        self.latency = latency
+        self.writes = 0
+
+    def write(self, data):
+        time.sleep(self.latency)
+        self.writes += 1
+        return self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def run(mode: str, args, directory: str) -> dict:
+    configure_logging(mode=mode, log_format=args.format, log_file=os.path.join(directory, f"{mode}.log"), info_rate=args.info_rate)
+    slow = None
+    for handler in output_handlers():
+        if isinstance(handler, logging.FileHandler):
+            slow = handler.stream = SlowStream(handler.stream, args.disk_latency_ms / 1000)
+        else:
+            handler.setStream(open(os.devnull, "w"))
+    metrics.registry.reset()
+
+    logger = logging.getLogger("benchmark")
+    per_request = []
+    for index in range(args.requests):
+        user = f"whatsapp:+54911{index % 50:08d}"
+        set_trace_id(f"SM{index:016x}")
+        set_user_id(user)
+        started = time.perf_counter()
+        for _ in range(args.records_per_request // len(MESSAGES) or 1):
+            for message, make_args in MESSAGES[:args.records_per_request]:
+                logger.info(message, *make_args(user))
+        per_request.append(time.perf_counter() - started)
+
+    flush_started = time.perf_counter()
+    stop_logging()
+    flush_seconds = time.perf_counter() - flush_started
+    ordered = sorted(per_request)
+    snapshot = metrics.snapshot()["counters"]
+    return {
+        "mode": mode,
+        "logging_us_per_request": {
+            "p50": round(ordered[len(ordered) // 2] * 1e6, 1),
+            "p99": round(ordered[int(0.99 * (len(ordered) - 1))] * 1e6, 1),
+        },
+        "records_written": slow.writes if slow else 0,
+        "records_dropped": sum(v for k, v in snapshot.items() if k.startswith("log_records_dropped_total")),
+        "records_suppressed": sum(v for k, v in snapshot.items() if k.startswith("log_records_suppressed_total")),
+        "flush_seconds_at_shutdown": round(flush_seconds, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--records-per-request", type=int, default=8)
+    parser.add_argument("--disk-latency-ms", type=float, default=2.0)
+    parser.add_argument("--format", choices=("text", "json"), default="text")
+    parser.add_argument("--info-rate", type=float, default=0.0, help="registros INFO por segundo por mensaje (0 = sin límite)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [run(mode, args, directory) for mode in ("sync", "queue")]
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
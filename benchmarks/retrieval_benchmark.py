@@ -0,0 +1,80 @@
+"""
+Compara la recuperación puramente vectorial con la híbrida (BM25 + vectorial) sobre un
+conjunto fijo de consultas: latencia, embeddings de consulta evitados y recall@k.
+
+Uso:
+    python -m benchmarks.retrieval_benchmark [--embeddings hashing] [--backend chroma] [--queries archivo.jsonl]
+
+Con `--embeddings hashing` corre completamente offline. Los índices se construyen en un
+directorio temporal, así que no se modifica el índice de la aplicación.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from core.rag_manager import KNOWLEDGE_BASE_DIR, RAG_TOP_K, RAGManager
+
+DEFAULT_QUERIES = os.path.join(os.path.dirname(__file__), "retrieval_queries.jsonl")
+
+
+def load_queries(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run(manager: RAGManager, queries: list, repeat: int) -> dict:
+    """Ejecuta las consultas (sin caché) y mide latencias, embeddings y aciertos."""
+    manager.cache.max_entries = 0
+    latencies = []
+    hits = 0
+    queries_before = manager.counting_embeddings.embedded_queries
+    for _ in range(repeat):
+        for item in queries:
+            started = time.perf_counter()
+            documents = manager.search(item["query"])
+            latencies.append(time.perf_counter() - started)
+            if any(item["expected"] in document.page_content for document in documents[:RAG_TOP_K]):
+                hits += 1
+    total = len(queries) * repeat
+    ordered = sorted(latencies)
+    return {
+        "mode": manager.retrieval_mode,
+        "avg_ms": round(statistics.mean(latencies) * 1000, 3),
+        "p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))] * 1000, 3),
+        f"recall@{RAG_TOP_K}": round(hits / total, 3),
+        "query_embeddings": manager.counting_embeddings.embedded_queries - queries_before,
+        "queries": total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", default=os.getenv("RAG_EMBEDDINGS", "openai"))
+    parser.add_argument("--backend", default="chroma")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES)
+    parser.add_argument("--knowledge-base", default=KNOWLEDGE_BASE_DIR)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    with tempfile.TemporaryDirectory() as index_dir:
+        results = []
+        for mode in ("vector", "hybrid"):
+            manager = RAGManager(
+                embeddings_kind=args.embeddings,
+                backend_kind=args.backend,
+                retrieval_mode=mode,
+                knowledge_base_dir=args.knowledge_base,
+                index_dir=index_dir,
+            )
+            manager.create_and_save_vector_store()
+            results.append(run(manager, queries, args.repeat))
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
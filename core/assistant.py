@@ -1,7 +1,22 @@
 import logging
-from langchain_core.messages import HumanMessage
+import os
+import time
+from typing import Callable, Optional
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from core import metrics
 from core.graph import app, system_message
+from core.intent_router import INTENT_ROUTER_ENABLED, IntentRouter
+from core.llm_governor import LLMOverloaded, TurnBudget
 from core.memory import ConversationManager
+from core.streaming import ProgressiveReplyHandler
+from core.tenants import get_tenant
+from core.tools import current_knowledge_base
+from services.whatsapp_client import split_message
+
+# Qué responder cuando no hay capacidad para llamar al modelo: "canned" (mensaje fijo) o
+# "knowledge" (el fragmento más relevante de la base de conocimientos, sin LLM).
+LLM_SHED_MODE = os.getenv("LLM_SHED_MODE", "canned").lower()
+SHED_REPLY = "⏳ Estamos recibiendo muchos mensajes en este momento. Por favor, intenta de nuevo en unos minutos."
 
 class WhatsappAssistant:
     """
@@ -11,34 +26,118 @@ class WhatsappAssistant:
     def __init__(self):
         """Inicializa el asistente y el gestor de memoria."""
         self.memory = ConversationManager()
+        self.router = IntentRouter() if INTENT_ROUTER_ENABLED else None
         logging.info("WhatsappAssistant inicializado.")
 
-    def get_response(self, user_id: str, user_query: str) -> str:
-        """Obtiene una respuesta del agente de LangGraph para un usuario y una consulta dados."""
-        logging.info(f"Procesando mensaje de {user_id} con LangGraph y memoria Redis.")
+    def _try_fast_path(self, user_id: str, user_query: str, started: float):
+        """Intenta resolver el mensaje con el pre-router determinista, sin llamar al LLM."""
+        if self.router is None:
+            return None
+        routed = self.router.route(user_id, user_query)
+        if routed is None:
+            return None
+
+        self.memory.add_messages(user_id, [HumanMessage(content=user_query), AIMessage(content=routed.reply)])
+        elapsed = time.monotonic() - started
+        metrics.observe("assistant_turn_seconds", elapsed, path="fast")
+        # Ahorro estimado: latencia media de los turnos que sí pasaron por el agente.
+        agent_latency = metrics.registry.get_latency("assistant_turn_seconds", path="agent")
+        if agent_latency is not None and agent_latency.count:
+            saved = agent_latency.total / agent_latency.count - elapsed
+            metrics.inc("intent_router_latency_saved_seconds_total", max(0.0, saved))
+        return routed.reply
+
+    def _shed_reply(self, user_query: str, reason: str) -> str:
+        """Respuesta rápida sin LLM para un turno descartado por carga. No se guarda en el historial."""
+        metrics.inc("assistant_shed_replies_total", mode=LLM_SHED_MODE, reason=reason)
+        if LLM_SHED_MODE == "knowledge":
+            try:
+                documents = current_knowledge_base().search(user_query)
+                if documents:
+                    return f"{SHED_REPLY}\n\nMientras tanto, esto es lo que encontré:\n{documents[0].page_content[:800]}"
+            except Exception as e:
+                logging.warning(f"No se pudo armar la respuesta desde la base de conocimientos: {e}")
+        return SHED_REPLY
+
+    @staticmethod
+    def _system_message() -> SystemMessage:
+        """Prompt de sistema del local en curso; sin prompt propio se usa el de core/graph.py."""
+        prompt = get_tenant().system_prompt
+        return SystemMessage(content=prompt) if prompt else system_message
+
+    def get_response(self, user_id: str, user_query: str, on_partial: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Obtiene una respuesta del agente de LangGraph para un usuario y una consulta dados.
+        Si se indica `on_partial`, la respuesta se entrega progresivamente a través de esa función
+        (acuses de herramientas y partes del texto a medida que se genera) y el llamador no debe
+        volver a enviar el texto devuelto.
+        """
+        started = time.monotonic()
+        fast_reply = self._try_fast_path(user_id, user_query, started)
+        if fast_reply is not None:
+            if on_partial is not None:
+                for part in split_message(fast_reply):
+                    on_partial(part)
+            return fast_reply
+
+        logging.info("Procesando mensaje de %s con LangGraph y memoria Redis.", user_id)
+
+        stored_history = self.memory.get_history(user_id)
+        if not stored_history:
+            logging.info("Nuevo hilo de conversación para %s en Redis.", user_id)
+        # El prompt de sistema no se guarda en Redis: se antepone en cada turno.
+        conversation_history = [self._system_message(), *stored_history]
 
-        conversation_history = self.memory.get_history(user_id)
-        if not conversation_history:
-            conversation_history = [system_message]
-            logging.info(f"Nuevo hilo de conversación para {user_id} en Redis.")
-        
         current_message = HumanMessage(content=user_query)
-        self.memory.add_message(user_id, current_message)
         conversation_history.append(current_message)
 
         graph_input = {"messages": conversation_history}
+        # El user_id viaja como metadata de la ejecución (visible para callbacks y trazas).
+        budget = TurnBudget()
+        config = {
+            "metadata": {"user_id": user_id},
+            "configurable": {"turn_budget": budget},
+            # Red de seguridad: cada vuelta son dos pasos (agente y herramientas) más el cierre.
+            "recursion_limit": 2 * budget.max_iterations + 3,
+        }
+        progressive = None
+        if on_partial is not None:
+            progressive = ProgressiveReplyHandler(on_partial)
+            config["callbacks"] = [progressive]
+
         final_response = None
-        for event in app.stream(graph_input):
-            if "agent" in event:
-                final_response = event["agent"]["messages"][-1]
-            elif "__end__" in event:
-                final_response = event["__end__"]["messages"][-1]
+        try:
+            for event in app.stream(graph_input, config):
+                if "agent" in event:
+                    final_response = event["agent"]["messages"][-1]
+                elif "__end__" in event:
+                    final_response = event["__end__"]["messages"][-1]
+        except LLMOverloaded as e:
+            reply = self._shed_reply(user_query, e.reason)
+            metrics.observe("assistant_turn_seconds", time.monotonic() - started, path="shed")
+            if on_partial is not None:
+                for part in split_message(reply):
+                    on_partial(part)
+            return reply
+        finally:
+            metrics.observe("agent_loop_iterations", budget.iterations)
 
         if not final_response:
             logging.error("El grafo de LangGraph no produjo una respuesta final.")
-            return "Lo siento, tuve un problema para procesar tu mensaje."
+            fallback = "Lo siento, tuve un problema para procesar tu mensaje."
+            if on_partial is not None:
+                on_partial(fallback)
+            return fallback
 
-        self.memory.add_message(user_id, final_response)
+        # La pregunta y la respuesta del turno se guardan juntas en un único round trip.
+        self.memory.add_messages(user_id, [current_message, final_response])
+        metrics.observe("assistant_turn_seconds", time.monotonic() - started, path="agent")
+        if progressive is not None and final_response.content and (budget.exhausted or not progressive.streamed_text):
+            # Sin tokens en streaming (p. ej. un modelo sin soporte) se envía la respuesta completa.
+            # El aviso de presupuesto agotado no sale del modelo: se envía aunque ya se haya enviado
+            # texto de vueltas anteriores, para que el turno no quede cortado sin explicación.
+            for part in split_message(final_response.content):
+                on_partial(part)
         return final_response.content
 
     def clear_memory(self, user_id: str):
@@ -0,0 +1,236 @@
+import bisect
+import difflib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_FILE = "data/products.json"
+# Cada cuánto (segundos) se comprueba el mtime del archivo para recargar el catálogo.
+CATALOG_RELOAD_CHECK_SECONDS = float(os.getenv("CATALOG_RELOAD_CHECK_SECONDS", "2"))
+# Similitud mínima (0-1) para aceptar una coincidencia aproximada.
+CATALOG_FUZZY_CUTOFF = float(os.getenv("CATALOG_FUZZY_CUTOFF", "0.8"))
+# Coincidencias aproximadas de productos distintos a menos de este margen de la mejor son ambiguas.
+CATALOG_FUZZY_AMBIGUITY_MARGIN = float(os.getenv("CATALOG_FUZZY_AMBIGUITY_MARGIN", "0.05"))
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_name(text: str) -> str:
+    """Normaliza un nombre de producto: sin acentos, en minúsculas y sin puntuación."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(" ", without_accents.lower()).strip()
+
+
+def singularize(normalized: str) -> str:
+    """Forma singular aproximada de un nombre ya normalizado ('capuchinos' -> 'capuchino')."""
+    words = []
+    for word in normalized.split():
+        # "-es" solo tras l, n, r, d, z o j ("panes", "alfajores"); "cafes" pierde solo la "s".
+        if len(word) > 4 and word.endswith("es") and word[-3] in "lnrdzj":
+            word = word[:-2]
+        elif len(word) > 3 and word.endswith("s"):
+            word = word[:-1]
+        words.append(word)
+    return " ".join(words)
+
+
+@dataclass(frozen=True)
+class Product:
+    name: str
+    price: int
+    aliases: Tuple[str, ...] = ()
+
+
+class _CatalogIndex:
+    """Índice inmutable construido a partir de una versión del archivo de productos."""
+    def __init__(self, products: List[Product]):
+        self.products = products
+        self.exact: Dict[str, List[Product]] = {}
+        self.singular: Dict[str, List[Product]] = {}
+        self.by_token: Dict[str, set] = {}
+        # Primero los nombres oficiales, luego los alias: ante un alias repetido gana el primer producto.
+        for product in products:
+            self._add(normalize_name(product.name), product)
+        for product in products:
+            for alias in product.aliases:
+                self._add(normalize_name(alias), product)
+        self.sorted_keys = sorted(self.exact)
+        self.max_words = max((len(k.split()) for k in self.exact), default=0)
+        # Claves ordenadas por largo, para acotar por bisección las candidatas a similitud.
+        self.by_length = sorted((len(k), k) for k in self.exact)
+
+    def _add(self, key: str, product: Product):
+        if not key:
+            return
+        for mapping, mapping_key in ((self.exact, key), (self.singular, singularize(key))):
+            candidates = mapping.setdefault(mapping_key, [])
+            if product not in candidates:
+                candidates.append(product)
+        for token in key.split():
+            self.by_token.setdefault(token, set()).add(key)
+
+    def fuzzy_pool(self, key: str, cutoff: float) -> List[str]:
+        """
+        Claves que pueden superar `cutoff` de similitud con `key`: las que comparten alguna palabra
+        con la consulta o, si no hay, todas; en ambos casos solo las de largo compatible. Como
+        difflib mide 2 * coincidencias / (largo total), una clave con largo fuera de
+        [n * c / (2 - c), n * (2 - c) / c] nunca llega al umbral y no vale la pena compararla.
+        """
+        low = math.ceil(len(key) * cutoff / (2 - cutoff))
+        high = math.floor(len(key) * (2 - cutoff) / cutoff)
+        start = bisect.bisect_left(self.by_length, (low, ""))
+        end = bisect.bisect_right(self.by_length, (high, "\uffff"))
+        pool = set()
+        for token in key.split():
+            pool.update(self.by_token.get(token, ()))
+        if pool:
+            return [k for k in pool if low <= len(k) <= high]
+        return [k for _, k in self.by_length[start:end]]
+
+
+class ProductCatalog:
+    """
+    Catálogo de productos en memoria con búsqueda O(1) por nombre oficial o alias.
+    Tolera acentos, mayúsculas y plurales, ofrece coincidencias por prefijo y aproximadas,
+    y se recarga automáticamente cuando cambia el mtime del archivo.
+    """
+    def __init__(self, path: str = PRODUCTS_FILE, reload_check_seconds: float = CATALOG_RELOAD_CHECK_SECONDS):
+        self.path = path
+        self.reload_check_seconds = reload_check_seconds
+        self._index: Optional[_CatalogIndex] = None
+        self._mtime: Optional[float] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, mtime: float):
+        """Lee el archivo y reemplaza el índice de forma atómica."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            products = [
+                Product(name=p['nombre_oficial'], price=p['precio'], aliases=tuple(p.get('alias', [])))
+                for p in data['productos']
+            ]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
+            logger.error(f"Error al leer o procesar {self.path}: {e}")
+            if self._index is None:
+                self._index = _CatalogIndex([])
+            return
+        self._index = _CatalogIndex(products)
+        self._mtime = mtime
+        logger.info(f"Catálogo cargado desde '{self.path}' con {len(products)} productos.")
+
+    def _current(self) -> _CatalogIndex:
+        """Devuelve el índice vigente, recargándolo si el archivo cambió."""
+        now = time.monotonic()
+        if self._index is not None and now - self._last_check < self.reload_check_seconds:
+            return self._index
+        with self._lock:
+            if self._index is None or now - self._last_check >= self.reload_check_seconds:
+                self._last_check = now
+                try:
+                    mtime = os.stat(self.path).st_mtime
+                except OSError:
+                    mtime = None
+                if self._index is None or mtime != self._mtime:
+                    self._load(mtime)
+        return self._index
+
+    def products(self) -> List[Product]:
+        return list(self._current().products)
+
+    def candidates(self, name: str) -> List[Product]:
+        """Productos cuyo nombre oficial o alias coincide exactamente (tras normalizar) con `name`."""
+        index = self._current()
+        key = normalize_name(name)
+        return index.exact.get(key) or index.singular.get(singularize(key)) or []
+
+    def is_ambiguous(self, name: str) -> bool:
+        """True si el nombre corresponde a más de un producto (p. ej. 'medialuna')."""
+        return len(self.candidates(name)) > 1
+
+    def matches(self, name: str, fuzzy: bool = True) -> List[Product]:
+        """
+        Productos que pueden corresponder a `name`: los que coinciden exactamente y, si no hay
+        ninguno y `fuzzy` es True, los que empiezan así o, por último, los más parecidos.
+        Una lista vacía significa que no se encontró; más de un producto, que el nombre es
+        ambiguo y hay que preguntarle al cliente cuál quiso decir.
+        """
+        exact = self.candidates(name)
+        if exact or not fuzzy:
+            return exact
+
+        index = self._current()
+        key = normalize_name(name)
+        if len(key) < 3:
+            return []
+
+        found: List[Product] = []
+        start = bisect.bisect_left(index.sorted_keys, key)
+        for candidate_key in index.sorted_keys[start:]:
+            if not candidate_key.startswith(key):
+                break
+            found.extend(p for p in index.exact[candidate_key] if p not in found)
+        if found:
+            return found
+
+        # Similitud: se devuelven todos los productos tan parecidos como el mejor (salvo el margen).
+        scored = []
+        matcher = difflib.SequenceMatcher(b=key)
+        for candidate_key in index.fuzzy_pool(key, CATALOG_FUZZY_CUTOFF):
+            matcher.set_seq1(candidate_key)
+            if matcher.real_quick_ratio() >= CATALOG_FUZZY_CUTOFF and matcher.quick_ratio() >= CATALOG_FUZZY_CUTOFF:
+                score = matcher.ratio()
+                if score >= CATALOG_FUZZY_CUTOFF:
+                    scored.append((score, candidate_key))
+        if not scored:
+            return []
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        best = scored[0][0]
+        for score, candidate_key in scored:
+            if score < best - CATALOG_FUZZY_AMBIGUITY_MARGIN:
+                break
+            found.extend(p for p in index.exact[candidate_key] if p not in found)
+        return found
+
+    def lookup(self, name: str, fuzzy: bool = True) -> Optional[Product]:
+        """
+        Busca un producto por nombre o alias (ver `matches`). Devuelve None si no encuentra
+        nada confiable o si el nombre corresponde a más de un producto.
+        """
+        found = self.matches(name, fuzzy)
+        return found[0] if len(found) == 1 else None
+
+    def find_mentions(self, text: str) -> List[Product]:
+        """Productos mencionados textualmente (nombre o alias) dentro de un texto libre."""
+        index = self._current()
+        words = normalize_name(text).split()
+        found: List[Product] = []
+        i = 0
+        while i < len(words):
+            # Se prefiere la coincidencia más larga que empieza en la palabra i.
+            for size in range(min(index.max_words, len(words) - i), 0, -1):
+                phrase = " ".join(words[i:i + size])
+                products = index.exact.get(phrase) or index.singular.get(singularize(phrase))
+                if products:
+                    for product in products:
+                        if product not in found:
+                            found.append(product)
+                    i += size
+                    break
+            else:
+                i += 1
+        return found
+
+
+catalog = ProductCatalog()
@@ -0,0 +1,65 @@
+import hashlib
+import logging
+import math
+import os
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from core.catalog import normalize_name
+
+logger = logging.getLogger(__name__)
+
+# "openai" (OpenAIEmbeddings, requiere red) o "hashing" (vectorizador local, sin red).
+RAG_EMBEDDINGS = os.getenv("RAG_EMBEDDINGS", "openai").lower()
+HASHING_EMBEDDINGS_DIM = int(os.getenv("HASHING_EMBEDDINGS_DIM", "1024"))
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Vectorizador local basado en el "hashing trick": cada palabra normalizada y cada
+    trigrama de caracteres se proyecta a una dimensión fija con signo. Es determinista,
+    no necesita red ni entrenamiento y alcanza para bases de conocimiento pequeñas.
+    """
+    def __init__(self, dim: int = HASHING_EMBEDDINGS_DIM):
+        self.dim = dim
+        self.model = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for word in normalize_name(text).split():
+            features.append(word)
+            padded = f" {word} "
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def _embed(self, text: str) -> List[float]:
+        counts = {}
+        for feature in self._features(text):
+            counts[feature] = counts.get(feature, 0) + 1
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in counts.items():
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            sign = 1.0 if digest & 1 else -1.0
+            vector[(digest >> 1) % self.dim] += sign * (1.0 + math.log(count))
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def build_embeddings(kind: str = RAG_EMBEDDINGS) -> Embeddings:
+    """Construye el modelo de embeddings configurado."""
+    if kind == "hashing":
+        return HashingEmbeddings()
+    if kind != "openai":
+        logger.warning(f"Backend de embeddings desconocido '{kind}'. Se usará OpenAI.")
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings()
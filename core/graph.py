@@ -1,16 +1,23 @@
 import logging
+import os
 from typing import TypedDict, Annotated
-from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, ToolMessage
+from langchain_core.messages import AIMessage, AnyMessage, SystemMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode
 from core.tools import (
     get_knowledge_base_response,
     add_item_to_cart,
+    add_items_to_cart,
     view_cart,
     checkout,
     talk_to_human
 )
+from core import metrics
+from core.llm_governor import governor
+from core.memory import estimate_tokens
+from core.startup import resource
+from core.tool_node import ParallelToolNode
 
 
 class AgentState(TypedDict):
@@ -19,15 +26,33 @@ class AgentState(TypedDict):
 tools = [
     get_knowledge_base_response, 
     add_item_to_cart, 
+    add_items_to_cart, 
     view_cart, 
     checkout, 
     talk_to_human
 ]
 
-tool_node = ToolNode(tools)
+# Las llamadas independientes de un mismo paso corren en paralelo; las que tocan el
+# carrito se serializan por usuario.
+tool_node = ParallelToolNode(
+    tools,
+    serialized_tools=[add_item_to_cart.name, add_items_to_cart.name, view_cart.name, checkout.name],
+)
+
+# Tiempo máximo de cada request a OpenAI (incluidos sus reintentos internos).
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+
+# Respuesta cuando el turno agota sus vueltas o su deadline antes de que el modelo termine.
+BUDGET_EXCEEDED_REPLY = (
+    "Perdón, tu consulta me está llevando más de lo esperado. "
+    "¿Podrías escribirla de otra forma o en partes más cortas?"
+)
 
-model = ChatOpenAI(model="gpt-4o-mini", temperature=0, streaming=True)
-model_with_tools = model.bind_tools(tools)
+# El cliente de OpenAI se crea por worker al arrancar (o en la primera llamada), no al importar.
+llm = resource(
+    "llm",
+    lambda: ChatOpenAI(model="gpt-4o-mini", temperature=0, streaming=True, timeout=LLM_TIMEOUT_SECONDS).bind_tools(tools),
+)
 
 def should_continue(state: AgentState) -> str:
     """Decide si continuar llamando herramientas o finalizar el flujo."""
@@ -36,10 +61,41 @@ def should_continue(state: AgentState) -> str:
         return "end"
     return "continue"
 
-def call_model(state: AgentState) -> dict:
-    """El nodo principal del agente: llama al LLM para decidir el próximo paso."""
+def _record_token_usage(messages: list, response: AnyMessage):
+    """
+    Suma los tokens de la llamada al modelo. En modo streaming la API no devuelve el uso,
+    así que se estima con la misma heurística que el historial (~4 caracteres por token).
+    """
+    usage = (response.response_metadata or {}).get("token_usage") or {}
+    if usage:
+        metrics.inc("llm_tokens_total", usage.get("prompt_tokens", 0), kind="prompt", source="api")
+        metrics.inc("llm_tokens_total", usage.get("completion_tokens", 0), kind="completion", source="api")
+        return
+    completion = estimate_tokens(response) + sum(len(str(call["args"])) // 4 for call in response.tool_calls)
+    metrics.inc("llm_tokens_total", sum(estimate_tokens(m) for m in messages), kind="prompt", source="estimated")
+    metrics.inc("llm_tokens_total", completion, kind="completion", source="estimated")
+
+def call_model(state: AgentState, config: RunnableConfig) -> dict:
+    """
+    El nodo principal del agente: llama al LLM para decidir el próximo paso.
+    Cada llamada pasa por el governor (lanza LLMOverloaded sin capacidad) y respeta el
+    presupuesto del turno (`configurable.turn_budget`): al agotarlo se termina con un mensaje fijo.
+    """
     messages = state['messages']
-    response = model_with_tools.invoke(messages)
+    budget = (config.get("configurable") or {}).get("turn_budget")
+    if budget is not None:
+        exceeded = budget.exceeded()
+        if exceeded:
+            budget.exhausted = exceeded
+            metrics.inc("agent_budget_exceeded_total", reason=exceeded)
+            logging.warning(f"Turno del agente cortado por presupuesto ({exceeded}) tras {budget.iterations} llamadas al modelo.")
+            return {"messages": [AIMessage(content=BUDGET_EXCEEDED_REPLY)]}
+        budget.iterations += 1
+    # Se propaga la config para que los callbacks (p. ej. respuestas progresivas) reciban los tokens.
+    with governor.slot(timeout=budget.remaining() if budget is not None else None):
+        with metrics.span("llm"):
+            response = llm.get().invoke(messages, config)
+    _record_token_usage(messages, response)
     return {"messages": [response]}
 
 
@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import zlib
+from typing import Protocol, Union
+
+import msgpack
+from langchain_core.messages import (
+    AIMessage,
+    AnyMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+
+logger = logging.getLogger(__name__)
+
+# "msgpack" (binario compacto, con zlib para mensajes largos) o "json" (formato original).
+HISTORY_CODEC = os.getenv("HISTORY_CODEC", "msgpack").lower()
+# Los mensajes que al empaquetarse superan este tamaño se comprimen con zlib (0 = nunca).
+HISTORY_COMPRESS_MIN_BYTES = int(os.getenv("HISTORY_COMPRESS_MIN_BYTES", "512"))
+
+# Primer byte de cada entrada binaria: versión del esquema en el nibble alto, flags en el bajo.
+# Nunca coincide con "{", el primer carácter de las entradas JSON del formato original.
+SCHEMA_VERSION = 1
+FLAG_ZLIB = 0x01
+
+StoredEntry = Union[bytes, str]
+
+_ROLES = {"human": "h", "ai": "a", "system": "s", "tool": "t"}
+_CLASSES = {"h": HumanMessage, "a": AIMessage, "s": SystemMessage, "t": ToolMessage}
+
+
+class HistoryCodec(Protocol):
+    name: str
+
+    def encode(self, message: AnyMessage) -> StoredEntry:
+        """Serializa un mensaje para guardarlo en la lista de Redis."""
+
+    def decode(self, raw: StoredEntry) -> AnyMessage:
+        """Reconstruye un mensaje guardado con este codec."""
+
+
+class JsonCodec:
+    """Formato original: `messages_to_dict` serializado como JSON, con todos los metadatos."""
+    name = "json"
+
+    def encode(self, message: AnyMessage) -> str:
+        return json.dumps(message_to_dict(message))
+
+    def decode(self, raw: StoredEntry) -> AnyMessage:
+        return messages_from_dict([json.loads(raw)])[0]
+
+
+class MsgpackCodec:
+    """
+    Guarda solo lo necesario para reconstruir la conversación: rol, contenido y, si los hay,
+    las llamadas a herramientas, el tool_call_id y el nombre. Se descartan `id`,
+    `response_metadata`, `additional_kwargs` (en OpenAI repite las tool calls), `example` y
+    los campos vacíos. Los tipos de mensaje sin forma compacta se guardan con `message_to_dict`.
+    """
+    name = "msgpack"
+
+    def __init__(self, compress_min_bytes: int = HISTORY_COMPRESS_MIN_BYTES):
+        self.compress_min_bytes = compress_min_bytes
+
+    @staticmethod
+    def _compact(message: AnyMessage) -> dict:
+        role = _ROLES.get(message.type)
+        if role is None:
+            return {"r": "x", "d": message_to_dict(message)}
+        fields = {"r": role, "c": message.content}
+        if getattr(message, "tool_calls", None):
+            fields["tc"] = [[call["id"], call["name"], call["args"]] for call in message.tool_calls]
+        if isinstance(message, ToolMessage):
+            fields["id"] = message.tool_call_id
+        if message.name:
+            fields["n"] = message.name
+        return fields
+
+    @staticmethod
+    def _expand(fields: dict) -> AnyMessage:
+        if fields["r"] == "x":
+            return messages_from_dict([fields["d"]])[0]
+        kwargs = {"content": fields["c"]}
+        if "tc" in fields:
+            kwargs["tool_calls"] = [{"id": id_, "name": name, "args": args} for id_, name, args in fields["tc"]]
+        if "id" in fields:
+            kwargs["tool_call_id"] = fields["id"]
+        if "n" in fields:
+            kwargs["name"] = fields["n"]
+        return _CLASSES[fields["r"]](**kwargs)
+
+    def encode(self, message: AnyMessage) -> bytes:
+        payload = msgpack.packb(self._compact(message), use_bin_type=True)
+        flags = 0
+        if self.compress_min_bytes and len(payload) >= self.compress_min_bytes:
+            compressed = zlib.compress(payload)
+            if len(compressed) < len(payload):
+                payload, flags = compressed, FLAG_ZLIB
+        return bytes([SCHEMA_VERSION << 4 | flags]) + payload
+
+    def decode(self, raw: StoredEntry) -> AnyMessage:
+        header, payload = raw[0], raw[1:]
+        if header >> 4 != SCHEMA_VERSION:
+            raise ValueError(f"Versión de esquema del historial desconocida: {header >> 4}")
+        if header & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return self._expand(msgpack.unpackb(payload, raw=False))
+
+
+_json = JsonCodec()
+_msgpack = MsgpackCodec()
+
+
+def is_legacy(raw: StoredEntry) -> bool:
+    """True si la entrada está en el formato JSON original."""
+    return isinstance(raw, str) or raw[:1] == b"{"
+
+
+def decode_message(raw: StoredEntry) -> AnyMessage:
+    """Decodifica una entrada de cualquier formato conocido, sin importar el codec configurado."""
+    if is_legacy(raw):
+        return _json.decode(raw)
+    return _msgpack.decode(raw)
+
+
+def build_codec(kind: str = HISTORY_CODEC) -> HistoryCodec:
+    """Construye el codec con el que se escriben las entradas nuevas."""
+    if kind == "json":
+        return _json
+    if kind != "msgpack":
+        logger.warning(f"Codec de historial desconocido '{kind}'. Se usará msgpack.")
+    return MsgpackCodec()
@@ -0,0 +1,85 @@
+import logging
+import os
+from typing import Iterable, Optional
+
+from core import metrics
+from core.redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_DEDUPE_ENABLED = os.getenv("WEBHOOK_DEDUPE_ENABLED", "true").lower() == "true"
+# Mientras un mensaje se procesa, su reclamo expira a los N segundos (por si el proceso muere).
+WEBHOOK_DEDUPE_PROCESSING_TTL = int(os.getenv("WEBHOOK_DEDUPE_PROCESSING_TTL", "300"))
+# Una vez respondido, se recuerda el MessageSid durante este tiempo para ignorar reintentos tardíos.
+WEBHOOK_DEDUPE_TTL = int(os.getenv("WEBHOOK_DEDUPE_TTL", "86400"))
+
+PROCESSING = "processing"
+DONE = "done"
+RESULTS = ("new", "duplicate_processing", "duplicate_done", "unavailable")
+
+
+class WebhookDeduplicator:
+    """
+    Evita procesar dos veces una misma entrega de Twilio. El primer webhook con un `MessageSid`
+    lo reclama de forma atómica (SET NX con expiración); los reintentos que llegan mientras el
+    original se procesa o después de responderlo se confirman sin volver a ejecutar el agente.
+    Si Redis no está disponible, el mensaje se procesa igual (se prefiere duplicar a perderlo).
+    """
+    def __init__(self, prefix: str = "webhook:sid", processing_ttl: int = WEBHOOK_DEDUPE_PROCESSING_TTL, ttl: int = WEBHOOK_DEDUPE_TTL):
+        self.prefix = prefix
+        self.processing_ttl = processing_ttl
+        self.ttl = ttl
+
+    def _key(self, message_sid: str) -> str:
+        return f"{self.prefix}:{message_sid}"
+
+    async def claim(self, message_sid: Optional[str]) -> bool:
+        """True si este webhook debe procesarse; False si es un duplicado."""
+        if not message_sid:
+            return True
+        client = get_async_redis()
+        try:
+            if await client.set(self._key(message_sid), PROCESSING, nx=True, ex=self.processing_ttl):
+                result = "new"
+            else:
+                state = await client.get(self._key(message_sid))
+                result = "duplicate_done" if state == DONE else "duplicate_processing"
+        except Exception as e:
+            logger.warning(f"No se pudo verificar el MessageSid {message_sid} en Redis: {e}")
+            result = "unavailable"
+        metrics.inc("webhook_dedupe_total", result=result)
+        return result in ("new", "unavailable")
+
+    async def release(self, message_sid: Optional[str]):
+        """Libera un reclamo cuando el mensaje no se pudo aceptar, para que el reintento se procese."""
+        if not message_sid:
+            return
+        try:
+            await get_async_redis().delete(self._key(message_sid))
+        except Exception as e:
+            logger.warning(f"No se pudo liberar el MessageSid {message_sid}: {e}")
+
+    def complete(self, message_sids: Iterable[str]):
+        """Marca como respondidos los mensajes procesados. Es síncrono: se llama desde los hilos de trabajo."""
+        message_sids = [sid for sid in message_sids if sid]
+        if not message_sids:
+            return
+        try:
+            with get_redis().pipeline(transaction=False) as pipe:
+                for sid in message_sids:
+                    pipe.set(self._key(sid), DONE, ex=self.ttl)
+                pipe.execute()
+        except Exception as e:
+            logger.warning(f"No se pudieron marcar como procesados los mensajes {message_sids}: {e}")
+
+    @staticmethod
+    def stats() -> dict:
+        """Cuántas entregas duplicadas se descartaron sin repetir trabajo."""
+        counts = {result: metrics.registry.get_counter("webhook_dedupe_total", result=result) for result in RESULTS}
+        duplicates = counts["duplicate_processing"] + counts["duplicate_done"]
+        total = sum(counts.values())
+        return {
+            **counts,
+            "duplicates_suppressed": duplicates,
+            "duplicate_share": round(duplicates / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,96 @@
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Versiones del índice que se conservan en disco (la activa nunca se borra).
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+# Índice guardado directamente en la raíz, con el formato anterior a las versiones.
+LEGACY_VERSION = "legacy"
+
+
+class IndexStore:
+    """
+    Directorio raíz del índice vectorial con versiones inmutables:
+
+        <raíz>/versions/<versión>/   un índice completo por cada build
+        <raíz>/CURRENT               nombre de la versión activa
+
+    Un build escribe una versión nueva y recién al terminar cambia CURRENT con un rename
+    atómico, así que ningún lector ve un índice a medio escribir. Si no hay CURRENT pero la
+    raíz contiene un índice del formato anterior, esa raíz es la versión "legacy".
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    @property
+    def _current_path(self) -> str:
+        return os.path.join(self.root, CURRENT_FILE)
+
+    def current(self) -> Optional[str]:
+        """Versión a la que apunta CURRENT, o None si todavía no se publicó ninguna."""
+        try:
+            with open(self._current_path, "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def path(self, version: str) -> str:
+        if version == LEGACY_VERSION:
+            return self.root
+        return os.path.join(self.root, VERSIONS_DIR, version)
+
+    def versions(self) -> List[str]:
+        """Versiones en disco, de la más antigua a la más nueva (los nombres empiezan con la fecha)."""
+        directory = os.path.join(self.root, VERSIONS_DIR)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+    def new_version(self) -> str:
+        """Nombre de una versión nueva: la fecha UTC con microsegundos, así el orden alfabético es el cronológico."""
+        now = time.time()
+        return f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now))}.{int(now % 1 * 1e6):06d}-{uuid.uuid4().hex[:6]}"
+
+    def prepare(self, version: str, base: Optional[str] = None) -> str:
+        """Crea el directorio de una versión nueva, partiendo de una copia de `base` si se indica."""
+        directory = self.path(version)
+        if base is not None and os.path.isdir(self.path(base)):
+            shutil.copytree(self.path(base), directory, ignore=shutil.ignore_patterns(VERSIONS_DIR, CURRENT_FILE + "*"))
+        else:
+            os.makedirs(directory)
+        return directory
+
+    def publish(self, version: str):
+        """Apunta CURRENT a `version` de forma atómica y borra las versiones viejas."""
+        tmp_path = f"{self._current_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._current_path)
+        logger.info(f"Índice '{self.root}': versión activa {version}.")
+        self.prune()
+
+    def discard(self, version: str):
+        """Borra una versión que no llegó a publicarse (p. ej. un build fallido)."""
+        if version != LEGACY_VERSION:
+            shutil.rmtree(self.path(version), ignore_errors=True)
+
+    def prune(self, keep: int = INDEX_KEEP_VERSIONS):
+        """
+        Conserva las `keep` versiones más nuevas y la activa. Las anteriores pueden seguir abiertas
+        en otro worker durante unos segundos; por eso se guarda más de una.
+        """
+        current = self.current()
+        stale = [version for version in self.versions()[:-max(1, keep)] if version != current]
+        for version in stale:
+            self.discard(version)
+        if stale:
+            logger.info(f"Índice '{self.root}': versiones antiguas eliminadas: {stale}")
@@ -0,0 +1,138 @@
+import logging
+import os
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+from core import metrics
+from core.catalog import ProductCatalog, normalize_name
+from core.tools import add_item_to_cart, add_items_to_cart, checkout, current_catalog, talk_to_human, view_cart
+
+logger = logging.getLogger(__name__)
+
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+
+# Los patrones se aplican sobre el texto normalizado (sin acentos, minúsculas, sin puntuación).
+_POLITE_SUFFIX = re.compile(r"\s+(por favor|porfa|porfavor|gracias)$")
+_VIEW_CART = re.compile(
+    r"^((quiero |puedo )?(ver|mostrar|mostrame|muestrame|revisar)( el| mi)? carrito"
+    r"|(mi )?carrito"
+    r"|que (tengo|hay) en (el|mi) carrito"
+    # "cuanto es" a secas suele ser una pregunta de precio: se exige "total" o "carrito".
+    r"|cuanto (es|llevo|va)( en)? (el total|(el|mi) carrito))$"
+)
+_CHECKOUT = re.compile(
+    r"^((quiero |voy a |me gustaria )?(pagar|finalizar( el| mi)? pedido|cerrar( el| mi)? pedido|hacer el checkout)"
+    r"|checkout|(pasame |mandame |enviame )?(el )?link de pago)$"
+)
+_HUMAN = re.compile(
+    r"^(quiero |necesito |puedo )?(hablar|comunicarme) con (un |una |alguien|el )?"
+    r"(humano|persona|agente|asesor|encargado|alguien)?$"
+)
+_ADD = re.compile(
+    r"^(agrega|agregame|agregale|agregar|anade|anademe|anadir|suma|sumame|sumale|pone|poneme|dame|quiero|me das|mandame)"
+    r"\s+(?P<items>.+?)(\s+(al|a mi|en el|en mi) (carrito|pedido))?$"
+)
+_ITEM = re.compile(r"^(?P<quantity>\d+|un|una|uno|dos|tres|cuatro|cinco|seis|siete|ocho|nueve|diez)\s+(?P<name>.+)$")
+_ITEM_SEPARATOR = re.compile(r"\s+y\s+|\s+mas\s+")
+_NUMBER_WORDS = {
+    "un": 1, "una": 1, "uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10,
+}
+_MAX_QUANTITY = 50
+INTENTS = ("view_cart", "checkout", "talk_to_human", "add_to_cart")
+
+
+class IntentMatch(NamedTuple):
+    intent: str
+    reply: str
+
+
+class IntentRouter:
+    """
+    Etapa previa al agente que reconoce intenciones de alta confianza (ver carrito, agregar
+    N unidades de un producto del catálogo, pagar, hablar con un humano) y ejecuta directamente
+    las herramientas de core/tools.py, sin llamar al LLM. Todo lo ambiguo devuelve None y sigue
+    por el agente de LangGraph. Sin `catalog` se usa el catálogo del local en curso.
+    """
+    def __init__(self, catalog: Optional[ProductCatalog] = None):
+        self._catalog = catalog
+
+    @property
+    def catalog(self) -> ProductCatalog:
+        return self._catalog or current_catalog()
+
+    def _parse_items(self, text: str) -> Optional[List[Tuple[str, int]]]:
+        """Interpreta 'dos capuchinos y un brownie'. Devuelve None si algún producto no es inequívoco."""
+        items = []
+        catalog = self.catalog
+        for part in _ITEM_SEPARATOR.split(text):
+            match = _ITEM.match(part.strip())
+            if not match:
+                return None
+            raw_quantity = match.group("quantity")
+            quantity = int(raw_quantity) if raw_quantity.isdigit() else _NUMBER_WORDS[raw_quantity]
+            candidates = catalog.candidates(match.group("name"))
+            if len(candidates) != 1 or not 0 < quantity <= _MAX_QUANTITY:
+                return None
+            items.append((candidates[0].name, quantity))
+        return items or None
+
+    def match(self, text: str) -> Optional[Tuple[str, object]]:
+        """Clasifica el mensaje. Devuelve (intención, argumentos) o None si no hay certeza."""
+        if "\n" in text.strip():
+            return None
+        normalized = _POLITE_SUFFIX.sub("", normalize_name(text))
+        if not normalized:
+            return None
+        if _VIEW_CART.match(normalized):
+            return "view_cart", None
+        if _CHECKOUT.match(normalized):
+            return "checkout", None
+        if _HUMAN.match(normalized):
+            return "talk_to_human", None
+        add = _ADD.match(normalized)
+        if add:
+            items = self._parse_items(add.group("items"))
+            if items:
+                return "add_to_cart", items
+        return None
+
+    def route(self, user_id: str, text: str) -> Optional[IntentMatch]:
+        """Ejecuta la intención reconocida y devuelve la respuesta para el usuario, o None."""
+        matched = self.match(text)
+        if matched is None:
+            metrics.inc("intent_router_total", intent="fallback")
+            return None
+
+        intent, items = matched
+        if intent == "view_cart":
+            reply = view_cart.invoke({"user_id": user_id})
+        elif intent == "checkout":
+            reply = checkout.invoke({"user_id": user_id})
+        elif intent == "talk_to_human":
+            reply = talk_to_human.invoke({"user_id": user_id, "reason": "El cliente pidió hablar con una persona."})
+        elif len(items) == 1:
+            item_name, quantity = items[0]
+            reply = add_item_to_cart.invoke({"user_id": user_id, "item_name": item_name, "quantity": quantity})
+        else:
+            reply = add_items_to_cart.invoke({
+                "user_id": user_id,
+                "items": [{"item_name": name, "quantity": quantity} for name, quantity in items],
+            })
+
+        metrics.inc("intent_router_total", intent=intent)
+        logger.info("Mensaje de %s resuelto sin LLM (intención: %s).", user_id, intent)
+        return IntentMatch(intent, reply)
+
+    @staticmethod
+    def stats() -> dict:
+        """Proporción de mensajes atendidos sin LLM y latencia ahorrada estimada."""
+        served = {intent: metrics.registry.get_counter("intent_router_total", intent=intent) for intent in INTENTS}
+        fallback = metrics.registry.get_counter("intent_router_total", intent="fallback")
+        total = sum(served.values()) + fallback
+        return {
+            "served_without_llm": served,
+            "fallback_to_agent": fallback,
+            "fast_path_share": round(sum(served.values()) / total, 3) if total else 0.0,
+            "latency_saved_seconds": round(metrics.registry.get_counter("intent_router_latency_saved_seconds_total"), 3),
+        }
@@ -0,0 +1,147 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from core import metrics
+from core.catalog import normalize_name
+
+logger = logging.getLogger(__name__)
+
+# Entradas máximas en la caché (0 la desactiva) y su tiempo de vida en segundos.
+KB_CACHE_MAX_ENTRIES = int(os.getenv("KB_CACHE_MAX_ENTRIES", "256"))
+KB_CACHE_TTL_SECONDS = float(os.getenv("KB_CACHE_TTL_SECONDS", "3600"))
+# Similitud coseno mínima para reutilizar el resultado de una consulta casi idéntica.
+KB_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("KB_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+
+
+class _Entry:
+    def __init__(self, documents: List[Document], embedding: Optional[np.ndarray]):
+        self.documents = documents
+        self.embedding = embedding
+        self.created = time.monotonic()
+
+
+class KnowledgeCache:
+    """
+    Caché de resultados de búsqueda de la base de conocimientos, en dos niveles:
+    exacto (por la consulta normalizada, sin costo de embedding) y semántico
+    (por similitud coseno del embedding de la consulta). Desaloja por LRU y TTL,
+    y se vacía sola cuando cambia la versión del índice vectorial.
+    """
+    def __init__(
+        self,
+        max_entries: int = KB_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = KB_CACHE_TTL_SECONDS,
+        similarity_threshold: float = KB_CACHE_SIMILARITY_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _sync_version(self, version):
+        """Vacía la caché si el índice cambió desde la última operación."""
+        if version != self._version:
+            if self._entries:
+                logger.info(f"Índice de conocimiento en versión {version}: se invalida la caché.")
+            self._entries.clear()
+            self._version = version
+            metrics.set_gauge("kb_cache_entries", 0)
+
+    def _expired(self, entry: _Entry) -> bool:
+        return self.ttl_seconds > 0 and time.monotonic() - entry.created > self.ttl_seconds
+
+    def get_exact(self, query: str, version) -> Optional[List[Document]]:
+        """Busca por la consulta normalizada. No requiere calcular el embedding."""
+        if not self.enabled:
+            return None
+        key = normalize_name(query)
+        with self._lock:
+            self._sync_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                metrics.inc("kb_cache_requests_total", result="exact_hit")
+                return entry.documents
+        return None
+
+    def get_similar(self, embedding: List[float], version) -> Optional[List[Document]]:
+        """Busca una consulta previa cuyo embedding supere el umbral de similitud."""
+        if not self.enabled:
+            return None
+        query_vector = _normalize(embedding)
+        with self._lock:
+            self._sync_version(version)
+            keys = [k for k, e in self._entries.items() if e.embedding is not None and not self._expired(e)]
+            if keys:
+                matrix = np.stack([self._entries[k].embedding for k in keys])
+                scores = matrix @ query_vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    self._entries.move_to_end(keys[best])
+                    metrics.inc("kb_cache_requests_total", result="similar_hit")
+                    return self._entries[keys[best]].documents
+        return None
+
+    def record_miss(self):
+        """
+        Cuenta una consulta que no se resolvió con ninguno de los dos niveles. La registra quien
+        busca, una vez por consulta, porque el camino léxico no llega a consultar el nivel semántico.
+        """
+        if self.enabled:
+            metrics.inc("kb_cache_requests_total", result="miss")
+
+    def put(self, query: str, documents: List[Document], embedding: Optional[List[float]], version):
+        """Guarda el resultado de una búsqueda, desalojando la entrada menos usada si hace falta."""
+        if not self.enabled:
+            return
+        vector = _normalize(embedding) if embedding is not None else None
+        key = normalize_name(query)
+        with self._lock:
+            self._sync_version(version)
+            self._entries[key] = _Entry(documents, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.inc("kb_cache_evictions_total")
+            metrics.set_gauge("kb_cache_entries", len(self._entries))
+
+    def invalidate(self):
+        """Vacía la caché por completo."""
+        with self._lock:
+            self._entries.clear()
+            metrics.set_gauge("kb_cache_entries", 0)
+
+    def stats(self) -> dict:
+        exact = metrics.registry.get_counter("kb_cache_requests_total", result="exact_hit")
+        similar = metrics.registry.get_counter("kb_cache_requests_total", result="similar_hit")
+        misses = metrics.registry.get_counter("kb_cache_requests_total", result="miss")
+        total = exact + similar + misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": exact,
+            "similar_hits": similar,
+            "misses": misses,
+            "hit_rate": round((exact + similar) / total, 3) if total else 0.0,
+        }
+
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,202 @@
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Optional
+
+from core import metrics
+from core.rag_manager import RAGManager
+from core.redis_pool import get_redis
+from core.startup import Resource
+from core.tenants import DEFAULT_TENANT, Tenant, tenant_cache, tenant_manager
+
+logger = logging.getLogger(__name__)
+
+# Canal de Redis por el que se anuncia cada versión nueva del índice a todos los workers.
+KB_RELOAD_CHANNEL = os.getenv("KB_RELOAD_CHANNEL", "kb:reload")
+KB_REBUILD_LOCK_KEY = "kb:rebuild:lock"
+KB_REBUILD_LOCK_TTL = int(os.getenv("KB_REBUILD_LOCK_TTL", "600"))
+# Borra el lock solo si sigue siendo de quien lo tomó, en una sola operación: si expiró durante
+# un build largo y otro worker lo tomó, un GET seguido de DELETE podría borrar el lock ajeno.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# Cada cuántos segundos se revisa CURRENT por si se perdió un anuncio (pub/sub no guarda mensajes).
+KB_RELOAD_POLL_SECONDS = float(os.getenv("KB_RELOAD_POLL_SECONDS", "30"))
+
+
+def broadcast_reload(version: str, redis_client=None, tenant: Tenant = DEFAULT_TENANT) -> int:
+    """
+    Anuncia una versión nueva del índice. Devuelve cuántos workers recibieron el mensaje.
+    Para el local por defecto el mensaje es la versión; para los demás, "<local>/<versión>".
+    """
+    message = version if tenant.is_default else f"{tenant.id}/{version}"
+    try:
+        return (redis_client or get_redis()).publish(KB_RELOAD_CHANNEL, message)
+    except Exception as e:
+        logger.warning(f"No se pudo anunciar la versión {version} del índice en '{KB_RELOAD_CHANNEL}': {e}")
+        return 0
+
+
+class KnowledgeBaseReloader:
+    """
+    Mantiene a todos los workers usando la misma versión del índice sin cortar el servicio.
+    `request_rebuild` construye una versión nueva en segundo plano (un solo build a la vez en
+    todo el despliegue, con un lock en Redis) y la anuncia por pub/sub. Cada worker escucha el
+    canal en un hilo propio y carga la versión anunciada; mientras tanto sigue respondiendo con
+    la anterior. Además revisa CURRENT periódicamente por si un anuncio se perdió.
+    Los índices de los demás locales (core/tenants.py) siguen el mismo camino, con su propio
+    lock y solo en los workers que los tienen cargados.
+    """
+    def __init__(self, knowledge_base: Resource, channel: str = KB_RELOAD_CHANNEL,
+                 poll_seconds: float = KB_RELOAD_POLL_SECONDS):
+        self.knowledge_base = knowledge_base
+        self.channel = channel
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._rebuild_thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def rebuilding(self) -> bool:
+        return self._rebuild_thread is not None and self._rebuild_thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        # Los locales que se cargan sin índice publicado lo construyen en segundo plano.
+        tenant_cache.on_missing_index = self._build_missing_index
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="kb-reload", daemon=True)
+        self._thread.start()
+        logger.info(f"Escuchando anuncios de versiones del índice en '{self.channel}'.")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def request_rebuild(self, full_rebuild: bool = False, tenant: Tenant = DEFAULT_TENANT) -> bool:
+        """Lanza un build en segundo plano. Devuelve False si ya hay uno en curso en algún worker."""
+        redis_client = get_redis()
+        token = f"{socket.gethostname()}:{os.getpid()}:{time.time()}"
+        lock_key = KB_REBUILD_LOCK_KEY if tenant.is_default else f"{KB_REBUILD_LOCK_KEY}:{tenant.id}"
+        if not redis_client.set(lock_key, token, nx=True, ex=KB_REBUILD_LOCK_TTL):
+            return False
+        self._rebuild_thread = threading.Thread(
+            target=self._rebuild, args=(token, lock_key, full_rebuild, tenant), name="kb-rebuild", daemon=True,
+        )
+        self._rebuild_thread.start()
+        return True
+
+    def _build_missing_index(self, tenant: Tenant):
+        if self.request_rebuild(tenant=tenant):
+            logger.info(f"El local '{tenant.id}' no tiene índice publicado: se construye en segundo plano.")
+
+    def _manager_for(self, tenant: Tenant) -> RAGManager:
+        # Si el índice nunca se pudo cargar (p. ej. no existía), el build lo crea desde cero.
+        if tenant.is_default:
+            return self.knowledge_base.get() if self.knowledge_base.loaded else RAGManager()
+        loaded = tenant_cache.peek(tenant.id)
+        return loaded.knowledge_base if loaded else tenant_manager(tenant)
+
+    @staticmethod
+    def release_lock(redis_client, lock_key: str, token: str) -> bool:
+        """Libera el lock de reconstrucción si `token` sigue siendo su dueño."""
+        return bool(redis_client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token))
+
+    def _rebuild(self, token: str, lock_key: str, full_rebuild: bool, tenant: Tenant):
+        redis_client = get_redis()
+        try:
+            manager = self._manager_for(tenant)
+            with metrics.span("kb_rebuild"):
+                report = manager.create_and_save_vector_store(full_rebuild=full_rebuild)
+            if not report:
+                metrics.inc("kb_rebuilds_total", result="empty")
+                return
+            if tenant.is_default and not self.knowledge_base.loaded:
+                self.knowledge_base.set(manager)
+            metrics.inc("kb_rebuilds_total", result="ok")
+            receivers = broadcast_reload(report["version"], redis_client, tenant)
+            logger.info(f"Versión {report['version']} del índice de '{tenant.id}' publicada y anunciada a {receivers} workers: {report}")
+        except Exception as e:
+            metrics.inc("kb_rebuilds_total", result="error")
+            logger.error(f"Falló la reconstrucción de la base de conocimientos de '{tenant.id}': {e}", exc_info=True)
+        finally:
+            try:
+                if not self.release_lock(redis_client, lock_key, token):
+                    logger.warning(f"El lock de reconstrucción de '{tenant.id}' expiró antes de terminar el build.")
+            except Exception as e:
+                logger.warning(f"No se pudo liberar el lock de reconstrucción del índice: {e}")
+
+    def refresh(self, version: Optional[str] = None) -> bool:
+        """
+        Carga `version` (o la que apunta CURRENT) si no es la que está en uso.
+        En modo lazy, si el índice todavía no se cargó no hace nada: el primer uso tomará CURRENT.
+        """
+        if not self.knowledge_base.loaded and self.knowledge_base.error is None:
+            return False
+        manager = self.knowledge_base.get()
+        target = version or manager.stored_version()
+        if not target or target == manager.active_version:
+            return False
+        with metrics.span("kb_reload"):
+            loaded = manager.load_vector_store(target)
+        metrics.inc("kb_reloads_total", result="ok" if loaded else "missing")
+        if loaded:
+            logger.info(f"Base de conocimientos actualizada a la versión {target}.")
+        else:
+            logger.warning(f"La versión {target} del índice no está disponible en este worker.")
+        return loaded
+
+    def _safe_refresh(self, version: Optional[str] = None):
+        try:
+            if version and "/" in version:
+                tenant_id, version = version.split("/", 1)
+                tenant_cache.refresh(tenant_id, version)
+                return
+            self.refresh(version)
+        except Exception as e:
+            logger.error(f"No se pudo cargar la versión {version or 'publicada'} del índice: {e}", exc_info=True)
+
+    def _listen(self):
+        pubsub = None
+        last_poll = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                if pubsub is None:
+                    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(self.channel)
+                message = pubsub.get_message(timeout=1.0)
+                if message and message["type"] == "message":
+                    self._safe_refresh(message["data"])
+            except Exception as e:
+                logger.warning(f"Error en la suscripción a '{self.channel}': {e}. Reintentando...")
+                if pubsub is not None:
+                    pubsub.close()
+                    pubsub = None
+                self._stop.wait(1.0)
+            if time.monotonic() - last_poll >= self.poll_seconds:
+                last_poll = time.monotonic()
+                self._safe_refresh()
+                tenant_cache.refresh_all()
+        if pubsub is not None:
+            pubsub.close()
+
+    def stats(self) -> dict:
+        manager = self.knowledge_base.get() if self.knowledge_base.loaded else None
+        return {
+            "active_version": manager.active_version if manager else None,
+            "stored_version": manager.stored_version() if manager else None,
+            "listening": self.running,
+            "rebuilding": self.rebuilding,
+        }
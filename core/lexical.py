@@ -0,0 +1,86 @@
+import math
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from core.catalog import normalize_name, singularize
+
+# Palabras vacías frecuentes en las consultas de los clientes; no aportan al ranking.
+STOPWORDS = {
+    "a", "al", "algo", "como", "con", "cual", "cuales", "cuando", "de", "del", "donde", "el", "en",
+    "es", "esta", "estan", "hay", "la", "las", "lo", "los", "me", "mi", "para", "por", "que",
+    "se", "si", "su", "sus", "tienen", "tiene", "un", "una", "uno", "unos", "y", "ya", "yo",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Normaliza (sin acentos, minúsculas, singular) y descarta palabras vacías."""
+    return [singularize(word) for word in normalize_name(text).split() if word not in STOPWORDS]
+
+
+def document_key(document: Document) -> Tuple[str, str]:
+    """Identidad de un chunk para fusionar rankings de distintos retrievers."""
+    return document.metadata.get("source", ""), document.page_content
+
+
+class BM25Index:
+    """Índice invertido con ranking BM25 sobre los mismos chunks que el índice vectorial."""
+    def __init__(self, documents: List[Document], k1: float = 1.5, b: float = 0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths: List[int] = []
+        for doc_id, document in enumerate(documents):
+            tokens = tokenize(document.page_content)
+            self.lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                self.postings.setdefault(token, []).append((doc_id, count))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def _idf(self, token: str) -> float:
+        n = len(self.documents)
+        df = len(self.postings.get(token, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        """Devuelve hasta `k` chunks con score BM25 positivo, de mayor a menor."""
+        scores: Dict[int, float] = {}
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = self._idf(token)
+            for doc_id, tf in postings:
+                norm = 1 - self.b + self.b * self.lengths[doc_id] / (self.avg_length or 1)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[doc_id], score) for doc_id, score in ranked]
+
+
+def is_decisive(results: List[Tuple[Document, float]], min_score: float, margin: float) -> bool:
+    """
+    True si el ranking léxico es lo bastante claro como para no consultar el índice vectorial:
+    el mejor score supera `min_score` y le saca al segundo una ventaja de al menos `margin` veces.
+    """
+    if not results or results[0][1] < min_score:
+        return False
+    if len(results) == 1:
+        return True
+    return results[0][1] >= margin * results[1][1]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, constant: int = 60) -> List[Document]:
+    """Fusiona varios rankings sumando 1 / (constant + posición) por documento."""
+    scores: Dict[Tuple[str, str], float] = {}
+    by_key: Dict[Tuple[str, str], Document] = {}
+    for ranking in rankings:
+        for position, document in enumerate(ranking):
+            key = document_key(document)
+            by_key.setdefault(key, document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (constant + position + 1)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [by_key[key] for key in ranked]
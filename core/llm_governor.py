@@ -0,0 +1,221 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+from core import metrics
+from core.redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Llamadas simultáneas al modelo por worker y en todo el despliegue (0 = sin límite global).
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_GLOBAL_MAX_CONCURRENCY = int(os.getenv("LLM_GLOBAL_MAX_CONCURRENCY", "0"))
+# Turnos que pueden esperar un lugar por worker; con la cola llena se descarta carga de inmediato.
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+# Un lugar global se libera solo si su dueño murió sin devolverlo. Mientras la llamada sigue
+# en curso, el worker renueva el lease cada tercio de este tiempo.
+LLM_GLOBAL_LEASE_SECONDS = float(os.getenv("LLM_GLOBAL_LEASE_SECONDS", "120"))
+LLM_GLOBAL_KEY = "llm:in_flight"
+
+# Las horas de los leases salen del reloj de Redis (TIME dentro del script) y no del de cada
+# host: un worker con el reloj adelantado no puede expirar los lugares de los demás.
+_ACQUIRE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - tonumber(ARGV[2]))
+redis.call('ZADD', KEYS[1], now, ARGV[1])
+if redis.call('ZRANK', KEYS[1], ARGV[1]) < tonumber(ARGV[3]) then
+    return 1
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+return 0
+"""
+_REFRESH_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+for _, token in ipairs(ARGV) do
+    redis.call('ZADD', KEYS[1], 'XX', now, token)
+end
+return #ARGV
+"""
+AGENT_MAX_ITERATIONS = int(os.getenv("AGENT_MAX_ITERATIONS", "6"))
+AGENT_TURN_DEADLINE_SECONDS = float(os.getenv("AGENT_TURN_DEADLINE_SECONDS", "45"))
+
+
+class LLMOverloaded(Exception):
+    """No hay capacidad para llamar al modelo: la cola de espera está llena o se agotó la espera."""
+    def __init__(self, reason: str):
+        super().__init__(f"Sin capacidad para llamar al modelo ({reason}).")
+        self.reason = reason
+
+
+class TurnBudget:
+    """Presupuesto de un turno del agente: máximo de llamadas al modelo y un deadline."""
+    def __init__(self, max_iterations: int = AGENT_MAX_ITERATIONS, deadline_seconds: float = AGENT_TURN_DEADLINE_SECONDS):
+        self.max_iterations = max_iterations
+        self.deadline = time.monotonic() + deadline_seconds
+        self.iterations = 0
+        # Motivo por el que el turno se cortó ("iterations" o "deadline"), o None si terminó normalmente.
+        self.exhausted: Optional[str] = None
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def exceeded(self) -> Optional[str]:
+        """Motivo por el que el turno ya no puede llamar al modelo, o None."""
+        if self.iterations >= self.max_iterations:
+            return "iterations"
+        if not self.remaining():
+            return "deadline"
+        return None
+
+
+class LLMGovernor:
+    """
+    Limita las llamadas simultáneas al modelo para que un pico de tráfico no se convierta en
+    cientos de requests a OpenAI y una ola de 429. Cada llamada toma un lugar del worker
+    (semáforo local) y, si está configurado, uno global compartido por Redis. Los turnos sin
+    lugar esperan en una cola acotada; si la cola está llena o la espera supera el límite se
+    lanza LLMOverloaded y el asistente responde con un mensaje de carga alta.
+    """
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        global_max_concurrency: int = LLM_GLOBAL_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+        lease_seconds: float = LLM_GLOBAL_LEASE_SECONDS,
+        key: str = LLM_GLOBAL_KEY,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.global_max_concurrency = global_max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.lease_seconds = lease_seconds
+        self.key = key
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        # Lugares globales tomados por este worker, cuyos leases renueva el hilo de heartbeat.
+        self._held = set()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+
+    def _shed(self, reason: str) -> LLMOverloaded:
+        metrics.inc("llm_shed_total", reason=reason)
+        logger.warning("Llamada al modelo descartada por carga (%s): %s en espera, %s en curso.", reason, self.waiting, self.in_flight)
+        return LLMOverloaded(reason)
+
+    def _acquire_local(self, timeout: float) -> bool:
+        if self._slots.acquire(blocking=False):
+            return True
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                raise self._shed("queue_full")
+            self.waiting += 1
+            metrics.set_gauge("llm_queue_depth", self.waiting)
+        try:
+            return self._slots.acquire(timeout=timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                metrics.set_gauge("llm_queue_depth", self.waiting)
+
+    def _acquire_global(self, deadline: float) -> Optional[str]:
+        """
+        Semáforo distribuido sobre un sorted set: cada lugar es un token con su hora de ingreso (la
+        de Redis) y se obtiene si su posición es menor que el límite. Devuelve el token, "" si Redis
+        no está disponible (se sigue solo con el límite local) o None si no hubo lugar antes del deadline.
+        """
+        client = get_redis()
+        acquire = client.register_script(_ACQUIRE_SCRIPT)
+        token = uuid.uuid4().hex
+        delay = 0.01
+        while True:
+            try:
+                if acquire(keys=[self.key], args=[token, self.lease_seconds, self.global_max_concurrency]):
+                    self._track(token)
+                    return token
+            except Exception as e:
+                logger.warning("Semáforo global del modelo no disponible (%s); se usa solo el límite del worker.", e)
+                return ""
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+    def _track(self, token: str):
+        with self._lock:
+            self._held.add(token)
+            if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+                self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="llm-lease", daemon=True)
+                self._heartbeat_thread.start()
+
+    def _heartbeat(self):
+        """Renueva los leases de las llamadas en curso para que una respuesta lenta no pierda su lugar."""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._lock:
+                tokens = list(self._held)
+            if not tokens:
+                continue
+            try:
+                get_redis().register_script(_REFRESH_SCRIPT)(keys=[self.key], args=tokens)
+            except Exception as e:
+                logger.warning("No se pudieron renovar los lugares globales del modelo: %s", e)
+
+    def _release_global(self, token: str):
+        with self._lock:
+            self._held.discard(token)
+        try:
+            get_redis().zrem(self.key, token)
+        except Exception as e:
+            logger.warning("No se pudo liberar el lugar global del modelo: %s", e)
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None):
+        """Reserva un lugar para una llamada al modelo. Lanza LLMOverloaded si no lo consigue a tiempo."""
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        started = time.monotonic()
+        if not self._acquire_local(timeout):
+            raise self._shed("timeout")
+        token = ""
+        if self.global_max_concurrency:
+            token = self._acquire_global(started + timeout)
+            if token is None:
+                self._slots.release()
+                raise self._shed("global_timeout")
+        metrics.observe("llm_queue_wait_seconds", time.monotonic() - started)
+        with self._lock:
+            self.in_flight += 1
+            metrics.set_gauge("llm_in_flight", self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                metrics.set_gauge("llm_in_flight", self.in_flight)
+            if token:
+                self._release_global(token)
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "global_max_concurrency": self.global_max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "max_queue": self.max_queue,
+            "shed": {
+                reason: metrics.registry.get_counter("llm_shed_total", reason=reason)
+                for reason in ("queue_full", "timeout", "global_timeout")
+            },
+        }
+
+
+governor = LLMGovernor()
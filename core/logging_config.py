@@ -1,31 +1,197 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
 
-def configure_logging():
+from core import metrics
+from core.tracing import TraceIdFilter
+
+# "queue": los handlers escriben en un hilo aparte y el código solo encola el registro.
+# "sync": cada llamada escribe en consola y archivo en el mismo hilo (comportamiento original).
+LOG_MODE = os.getenv("LOG_MODE", "queue").lower()
+# "text" (formato legible) o "json" (un objeto por línea, con trace_id y user_id).
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+# "size" (LOG_MAX_BYTES), "time" (LOG_ROTATE_WHEN, p. ej. "midnight") o "none".
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size").lower()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Registros en espera; si el disco no da abasto se descartan en lugar de frenar las requests.
+LOG_QUEUE_MAXSIZE = int(os.getenv("LOG_QUEUE_MAXSIZE", "10000"))
+# Registros INFO/DEBUG por segundo permitidos para cada mensaje (0 = sin límite).
+LOG_INFO_RATE_PER_SECOND = float(os.getenv("LOG_INFO_RATE_PER_SECOND", "0"))
+LOG_INFO_BURST = int(os.getenv("LOG_INFO_BURST", "20"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(module)s.%(funcName)s - %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por registro, con los IDs de correlación y el traceback si lo hay."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "trace_id": getattr(record, "trace_id", "-"),
+            "user_id": getattr(record, "user_id", "-"),
+            "where": f"{record.module}.{record.funcName}",
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class InfoRateLimitFilter(logging.Filter):
+    """
+    Limita los registros INFO y DEBUG repetidos: cada mensaje (logger y plantilla, sin los
+    argumentos) tiene un token bucket de `rate` por segundo y ráfaga `burst`. Las advertencias
+    y errores pasan siempre. Funciona bien con formato perezoso (`logger.info("... %s", x)`):
+    con f-strings cada registro es una plantilla distinta.
+    """
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.clear()
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+        if not allowed:
+            metrics.inc("log_records_suppressed_total", logger=record.name)
+        return allowed
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que no bloquea ni formatea en el hilo que loguea: el mensaje se arma en el
+    hilo de escritura. Con la cola llena el registro se descarta y se cuenta.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+
+
+def _file_handler(path: str) -> logging.Handler:
+    if LOG_ROTATION == "time":
+        return logging.handlers.TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    if LOG_ROTATION == "size":
+        return logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    return logging.FileHandler(path, mode='a', encoding='utf-8')
+
+
+def _start_listener(handlers: list):
+    """Crea la cola, el QueueHandler del lado de la aplicación y el hilo que escribe."""
+    global _listener, _queue_handler
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _queue_handler
+
+
+def stop_logging():
+    """Escribe los registros pendientes y detiene el hilo de escritura (al apagar el proceso)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork():
+    """El hilo de escritura no sobrevive a un fork: el proceso hijo arranca uno nuevo con su propia cola."""
+    global _listener
+    if _listener is None or _queue_handler is None:
+        return
+    handlers = _listener.handlers
+    _queue_handler.queue = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def output_handlers() -> list:
+    """Handlers que escriben de verdad (los del hilo de escritura en modo "queue")."""
+    if _listener is not None:
+        return list(_listener.handlers)
+    return [h for h in logging.getLogger().handlers if not isinstance(h, logging.handlers.QueueHandler)]
+
+
+def queue_depth() -> int:
+    """Registros esperando al hilo de escritura (también se publica como gauge)."""
+    depth = _queue_handler.queue.qsize() if _queue_handler is not None and _listener is not None else 0
+    metrics.set_gauge("log_queue_depth", depth)
+    return depth
+
+
+def configure_logging(mode: str = LOG_MODE, log_format: str = LOG_FORMAT, log_file: str = LOG_FILE,
+                      info_rate: float = LOG_INFO_RATE_PER_SECOND):
     """
     Configura el sistema de logging para toda la aplicación.
     - Registra en la consola con un formato simple.
-    - Registra en un archivo (app.log) con un formato detallado.
+    - Registra en un archivo (LOG_FILE, con rotación) con un formato detallado o JSON.
+    - En modo "queue" ambos handlers corren en un hilo aparte detrás de una cola acotada.
     """
     logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
+    logger.setLevel(LOG_LEVEL)
 
+    stop_logging()
     if logger.hasHandlers():
         logger.handlers.clear()
 
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(module)s.%(funcName)s - %(message)s'
-    )
+    file_formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
     console_formatter = logging.Formatter('%(levelname)s: %(message)s')
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(console_formatter)
 
-    file_handler = logging.FileHandler('app.log', mode='a', encoding='utf-8')
+    file_handler = _file_handler(log_file)
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(file_formatter)
 
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    if mode == "queue":
+        handlers = [_start_listener([console_handler, file_handler])]
+    else:
+        handlers = [console_handler, file_handler]
+    for handler in handlers:
+        # Los filtros corren en el hilo que loguea, antes de encolar: el trace ID y el usuario
+        # del mensaje en curso se agregan a cada registro (ver core/tracing.py).
+        if info_rate:
+            handler.addFilter(InfoRateLimitFilter(info_rate, LOG_INFO_BURST))
+        handler.addFilter(TraceIdFilter())
+        logger.addHandler(handler)
+
+    print(f"Sistema de logging configurado (modo {mode}, formato {log_format}).")
+
 
-    print("Sistema de logging configurado.")
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
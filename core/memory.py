@@ -1,60 +1,302 @@
 import redis
+import contextvars
 import logging
 import os
-from typing import List
-from langchain_core.messages import AnyMessage, messages_from_dict, messages_to_dict
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+from langchain_core.messages import AnyMessage, SystemMessage
+from core import metrics
+from core.history_codec import HistoryCodec, build_codec, decode_message, is_legacy
+from core.llm_governor import governor
+from core.redis_pool import REDIS_URL, get_redis
+from core.tenants import get_tenant, tenant_key
 
 logger = logging.getLogger(__name__)
 
+# Ventana acotada del historial. Con 0 en ambos límites se conserva la conversación completa.
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "0"))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "0"))
+# Cuántos mensajes por encima del límite se toleran antes de resumir (evita resumir en cada turno).
+HISTORY_SUMMARY_BATCH = int(os.getenv("HISTORY_SUMMARY_BATCH", "10"))
+# "llm" (resumen con OpenAI), "truncate" (extracto local, sin red) o "none" (descarta lo antiguo).
+HISTORY_SUMMARIZER = os.getenv("HISTORY_SUMMARIZER", "llm").lower()
+# "true": el resumen se hace en un hilo de fondo, después de responder; "false": dentro de add_messages.
+HISTORY_FOLD_BACKGROUND = os.getenv("HISTORY_FOLD_BACKGROUND", "true").lower() == "true"
+# Tiempo máximo de la llamada al modelo que resume (incluida la espera de un lugar en el governor).
+HISTORY_SUMMARY_TIMEOUT_SECONDS = float(os.getenv("HISTORY_SUMMARY_TIMEOUT_SECONDS", "20"))
+
+Summarizer = Callable[[str, List[AnyMessage]], str]
+
+
+def estimate_tokens(message: AnyMessage) -> int:
+    """Estimación barata de tokens (~4 caracteres por token más el overhead del rol)."""
+    return len(str(message.content)) // 4 + 4
+
+
+def _render(messages: List[AnyMessage]) -> str:
+    """Convierte mensajes a texto plano 'rol: contenido' para resumirlos."""
+    return "\n".join(f"{m.type}: {m.content}" for m in messages if m.content)
+
+
+class TruncatingSummarizer:
+    """
+    Resumidor local y determinista: agrega un extracto de cada mensaje al resumen previo
+    y conserva solo los últimos `max_chars` caracteres. Útil en pruebas y sin acceso a la red.
+    """
+    def __init__(self, max_chars: int = 2000, excerpt_chars: int = 200):
+        self.max_chars = max_chars
+        self.excerpt_chars = excerpt_chars
+
+    def __call__(self, previous_summary: str, messages: List[AnyMessage]) -> str:
+        excerpts = [f"{m.type}: {str(m.content)[:self.excerpt_chars]}" for m in messages if m.content]
+        summary = "\n".join(filter(None, [previous_summary, *excerpts]))
+        return summary[-self.max_chars:]
+
+
+class LLMSummarizer:
+    """
+    Resume los turnos antiguos con un modelo de chat, incorporando el resumen previo.
+    La llamada pasa por el governor como las del agente, así que con el modelo saturado se
+    descarta (LLMOverloaded) y el resumen se reintenta con el próximo mensaje.
+    """
+    def __init__(self, model=None, timeout: float = HISTORY_SUMMARY_TIMEOUT_SECONDS):
+        self._model = model
+        self.timeout = timeout
+
+    @property
+    def model(self):
+        if self._model is None:
+            from langchain_openai import ChatOpenAI
+            self._model = ChatOpenAI(model=os.getenv("OPENAI_SUMMARY_MODEL", "gpt-4o-mini"), temperature=0, timeout=self.timeout)
+        return self._model
+
+    def __call__(self, previous_summary: str, messages: List[AnyMessage]) -> str:
+        prompt = (
+            f"Resume de forma breve la conversación entre un cliente y el asistente de {get_tenant().name}. "
+            "Conserva los datos útiles para continuar la atención: productos pedidos, preferencias, "
+            "dudas pendientes y datos de contacto mencionados.\n\n"
+            f"Resumen previo:\n{previous_summary or '(sin resumen previo)'}\n\n"
+            f"Mensajes nuevos:\n{_render(messages)}"
+        )
+        with governor.slot(timeout=self.timeout):
+            with metrics.span("llm_summary"):
+                return self.model.invoke(prompt).content
+
+
+def build_summarizer(kind: str = HISTORY_SUMMARIZER) -> Optional[Summarizer]:
+    """Construye el resumidor configurado, o None si los turnos antiguos solo se descartan."""
+    if kind == "none":
+        return None
+    if kind == "truncate":
+        return TruncatingSummarizer()
+    if kind != "llm":
+        logger.warning(f"Resumidor desconocido '{kind}'. Se usará el resumidor con LLM.")
+    return LLMSummarizer()
+
+
 class ConversationManager:
     """
     Gestiona el historial de conversaciones utilizando Redis para persistencia.
+    Si se configura un límite de mensajes o de tokens, solo conserva una ventana reciente
+    en la lista de Redis y pliega los turnos más antiguos en un resumen acumulado. Con
+    `background` el resumen se hace en un hilo aparte, sin demorar la respuesta del turno.
     """
-    def __init__(self):
-        """Inicializa el cliente de Redis."""
-        redis_url = os.getenv("REDIS_URL", "redis://redis:6379")
+    def __init__(
+        self,
+        max_messages: int = HISTORY_MAX_MESSAGES,
+        max_tokens: int = HISTORY_MAX_TOKENS,
+        summary_batch: int = HISTORY_SUMMARY_BATCH,
+        summarizer: Optional[Summarizer] = None,
+        codec: Optional[HistoryCodec] = None,
+        background: bool = HISTORY_FOLD_BACKGROUND,
+    ):
+        """Inicializa el cliente de Redis (pool compartido) y la política de ventana del historial."""
         try:
-            self.redis_client = redis.from_url(redis_url, decode_responses=True)
+            # Cliente binario: las entradas del historial no son texto.
+            self.redis_client = get_redis(decode_responses=False)
             self.redis_client.ping()
-            logger.info(f"Conectado exitosamente a Redis en {redis_url}")
+            logger.info(f"Conectado exitosamente a Redis en {REDIS_URL}")
         except redis.exceptions.ConnectionError as e:
             logger.error(f"No se pudo conectar a Redis: {e}")
             raise
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.summary_batch = max(1, summary_batch)
+        self.summarizer = summarizer if summarizer is not None else build_summarizer()
+        self.codec = codec if codec is not None else build_codec()
+        self._fold_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-fold") if background else None
+        # Resumen en curso por conversación (clave del local y usuario): no se resume dos veces a la vez.
+        self._folding: Dict[str, Future] = {}
+        self._folding_lock = threading.Lock()
+
+    @property
+    def bounded(self) -> bool:
+        return bool(self.max_messages or self.max_tokens)
 
     def _get_key(self, user_id: str) -> str:
-        """Genera la clave de Redis para un ID de usuario dado."""
-        return f"conversation:{user_id}"
+        """Genera la clave de Redis para un ID de usuario dado, dentro del espacio del local en curso."""
+        return tenant_key(f"conversation:{user_id}")
+
+    def _get_summary_key(self, user_id: str) -> str:
+        """Clave del resumen acumulado de los turnos ya plegados."""
+        return tenant_key(f"conversation:{user_id}:summary")
+
+    @staticmethod
+    def _deserialize(serialized_messages: list) -> List[AnyMessage]:
+        return [decode_message(m) for m in serialized_messages]
+
+    @staticmethod
+    def _text(value) -> str:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def _migrate_legacy(self, user_id: str):
+        """
+        Reescribe con el codec actual las entradas del historial que siguen en el formato JSON
+        original. Se hace una sola vez por conversación, dentro de un WATCH/MULTI: si la lista
+        cambia mientras tanto, redis-py reintenta con los datos nuevos.
+        """
+        key = self._get_key(user_id)
+        migrated = 0
+
+        def rewrite(pipe):
+            nonlocal migrated
+            entries = pipe.lrange(key, 0, -1)
+            updates = [(index, self.codec.encode(decode_message(entry))) for index, entry in enumerate(entries) if is_legacy(entry)]
+            pipe.multi()
+            for index, value in updates:
+                pipe.lset(key, index, value)
+            migrated = len(updates)
+
+        self.redis_client.transaction(rewrite, key)
+        if migrated:
+            metrics.inc("history_migrated_entries_total", migrated)
+            logger.info("Historial de %s: %d mensajes migrados al codec '%s'.", user_id, migrated, self.codec.name)
 
     def get_history(self, user_id: str) -> List[AnyMessage]:
-        """Recupera el historial de conversación para un usuario."""
+        """
+        Recupera el historial de conversación para un usuario.
+        Si existe un resumen de turnos antiguos, se devuelve primero como SystemMessage.
+        """
         key = self._get_key(user_id)
         try:
-            serialized_messages = self.redis_client.lrange(key, 0, -1)
-            if not serialized_messages:
-                return []
-            
-            import json
-            deserialized_messages = [json.loads(m) for m in serialized_messages]
-            return messages_from_dict(deserialized_messages)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(self._get_summary_key(user_id))
+            if self.max_messages:
+                pipe.lrange(key, -(self.max_messages + self.summary_batch), -1)
+            else:
+                pipe.lrange(key, 0, -1)
+            with metrics.span("redis_history", op="read"):
+                summary, serialized_messages = pipe.execute()
+
+            history = self._deserialize(serialized_messages) if serialized_messages else []
+            if self.codec.name != "json" and any(is_legacy(m) for m in serialized_messages):
+                try:
+                    self._migrate_legacy(user_id)
+                except Exception as e:
+                    logger.warning(f"No se pudo migrar el historial de {user_id} al codec '{self.codec.name}': {e}")
+            if summary:
+                history.insert(0, SystemMessage(content=f"Resumen de la conversación anterior con este cliente:\n{self._text(summary)}"))
+            return history
         except Exception as e:
             logger.error(f"Error al recuperar el historial para {user_id}: {e}")
             return []
 
     def add_message(self, user_id: str, message: AnyMessage):
         """Añade un mensaje al historial de conversación de un usuario."""
+        self.add_messages(user_id, [message])
+
+    def add_messages(self, user_id: str, messages: List[AnyMessage]):
+        """Añade varios mensajes (p. ej. la pregunta y la respuesta de un turno) con un único RPUSH."""
+        if not messages:
+            return
         key = self._get_key(user_id)
         try:
-            serialized_message = messages_to_dict([message])
-            import json
-            self.redis_client.rpush(key, json.dumps(serialized_message[0]))
+            serialized_messages = [self.codec.encode(m) for m in messages]
+            with metrics.span("redis_history", op="write"):
+                length = self.redis_client.rpush(key, *serialized_messages)
+            if self.bounded:
+                self._schedule_fold(user_id, length)
         except Exception as e:
-            logger.error(f"Error al añadir mensaje para {user_id}: {e}")
+            logger.error(f"Error al añadir mensajes para {user_id}: {e}")
+
+    def _schedule_fold(self, user_id: str, length: int):
+        """Pliega el historial ahora o, con `background`, en el pool de fondo (con el local en curso)."""
+        if self._fold_executor is None:
+            self._maybe_fold(user_id, length)
+            return
+        key = self._get_key(user_id)
+        context = contextvars.copy_context()
+
+        def fold():
+            try:
+                context.run(self._maybe_fold, user_id, length)
+            except Exception as e:
+                logger.error(f"Error al plegar el historial de {user_id}: {e}")
+            finally:
+                with self._folding_lock:
+                    self._folding.pop(key, None)
+
+        with self._folding_lock:
+            if key in self._folding:
+                return
+            self._folding[key] = self._fold_executor.submit(fold)
+
+    def wait_for_folds(self, timeout: Optional[float] = None):
+        """Espera los resúmenes en curso (pruebas y apagado)."""
+        with self._folding_lock:
+            pending = list(self._folding.values())
+        wait(pending, timeout=timeout)
+
+    def _count_to_fold(self, user_id: str, length: int) -> int:
+        """Cuántos mensajes del inicio de la lista deben plegarse en el resumen."""
+        if self.max_messages and length > self.max_messages + self.summary_batch:
+            return length - self.max_messages
+        if not self.max_tokens:
+            return 0
+
+        messages = self._deserialize(self.redis_client.lrange(self._get_key(user_id), 0, -1))
+        total = sum(estimate_tokens(m) for m in messages)
+        if total <= self.max_tokens:
+            return 0
+        # Se pliega hasta quedar en 3/4 del presupuesto para no resumir en cada turno.
+        target = self.max_tokens * 3 // 4
+        fold = 0
+        # Siempre se conservan al menos los dos últimos mensajes (la última pregunta y su respuesta).
+        while total > target and fold < len(messages) - 2:
+            total -= estimate_tokens(messages[fold])
+            fold += 1
+        return fold
+
+    def _maybe_fold(self, user_id: str, length: int):
+        """Pliega los mensajes más antiguos en el resumen y recorta la lista en Redis."""
+        fold = self._count_to_fold(user_id, length)
+        if fold <= 0:
+            return
+
+        key = self._get_key(user_id)
+        summary_key = self._get_summary_key(user_id)
+        pipe = self.redis_client.pipeline(transaction=True)
+        if self.summarizer is not None:
+            old_messages = self._deserialize(self.redis_client.lrange(key, 0, fold - 1))
+            previous_summary = self._text(self.redis_client.get(summary_key) or "")
+            try:
+                summary = self.summarizer(previous_summary, old_messages)
+            except Exception as e:
+                # Sin resumen no se descarta nada; se reintentará en el próximo mensaje.
+                logger.error(f"Error al resumir el historial de {user_id}: {e}")
+                return
+            pipe.set(summary_key, summary)
+        # Recortar por el inicio es seguro aunque lleguen mensajes nuevos al final de la lista.
+        pipe.ltrim(key, fold, -1)
+        pipe.execute()
+        logger.info("%d mensajes antiguos de %s plegados en el resumen.", fold, user_id)
 
     def clear_history(self, user_id: str):
         """Borra el historial de conversación para un usuario."""
         key = self._get_key(user_id)
         try:
-            self.redis_client.delete(key)
-            logger.info(f"Historial de conversación para {user_id} borrado.")
+            self.redis_client.delete(key, self._get_summary_key(user_id))
+            logger.info("Historial de conversación para %s borrado.", user_id)
         except Exception as e:
             logger.error(f"Error al borrar el historial para {user_id}: {e}")
@@ -0,0 +1,199 @@
+import math
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Sequence, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Límites (en segundos) de los buckets de los histogramas exportados a Prometheus.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels: dict) -> LabelKey:
+    """Normaliza las etiquetas de una métrica a una tupla ordenada y hashable."""
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _prometheus_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def _prometheus_labels(key: LabelKey, le: Optional[str] = None) -> str:
+    pairs = list(key) + ([("le", le)] if le is not None else [])
+    if not pairs:
+        return ""
+    escaped = []
+    for k, v in pairs:
+        v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{_prometheus_name(k)}="{v}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _prometheus_value(value: float) -> str:
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_name(name: str, key: LabelKey) -> str:
+    """Devuelve el nombre legible de una serie, p. ej. 'stage_seconds{stage=agent}'."""
+    if not key:
+        return name
+    labels = ",".join(f"{k}={v}" for k, v in key)
+    return f"{name}{{{labels}}}"
+
+
+class LatencyStats:
+    """
+    Acumula observaciones de latencia (en segundos) para una serie.
+    Guarda una ventana de las últimas muestras para estimar percentiles.
+    """
+    def __init__(self, window: int = 1024, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=window)
+        self.bounds = tuple(buckets)
+        self.bucket_counts = [0] * len(self.bounds)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+        for i, bound in enumerate(self.bounds):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def percentile(self, q: float) -> float:
+        """Percentil aproximado (0-100) sobre la ventana de muestras recientes."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> dict:
+        avg = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "avg_ms": round(avg * 1000, 2),
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p95_ms": round(self.percentile(95) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class MetricsRegistry:
+    """
+    Registro en memoria de contadores, gauges y latencias del proceso.
+    Es thread-safe: se usa tanto desde el event loop como desde los hilos de trabajo.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        self._latencies: Dict[Tuple[str, LabelKey], LatencyStats] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+
+    def configure_buckets(self, name: str, buckets: Sequence[float]):
+        """Define buckets propios para un histograma que no mide segundos (p. ej. iteraciones)."""
+        with self._lock:
+            self._buckets[name] = tuple(sorted(buckets))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Incrementa un contador."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """Fija el valor actual de un gauge."""
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Registra una observación de latencia en segundos."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            stats = self._latencies.get(key)
+            if stats is None:
+                stats = self._latencies[key] = LatencyStats(buckets=self._buckets.get(name, DEFAULT_BUCKETS))
+            stats.observe(seconds)
+
+    def get_latency(self, name: str, **labels):
+        """Devuelve las estadísticas de latencia de una serie, o None si aún no tiene observaciones."""
+        with self._lock:
+            return self._latencies.get((name, _label_key(labels)))
+
+    def get_counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def snapshot(self) -> dict:
+        """Devuelve una copia serializable de todas las series registradas."""
+        with self._lock:
+            return {
+                "counters": {_format_name(n, k): v for (n, k), v in self._counters.items()},
+                "gauges": {_format_name(n, k): v for (n, k), v in self._gauges.items()},
+                "latencies": {_format_name(n, k): s.snapshot() for (n, k), s in self._latencies.items()},
+            }
+
+    def render_prometheus(self) -> str:
+        """Exporta todas las series en el formato de texto de Prometheus (0.0.4)."""
+        lines = []
+        with self._lock:
+            for kind, series in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({n for n, _ in series}):
+                    metric = _prometheus_name(name)
+                    lines.append(f"# TYPE {metric} {kind}")
+                    for (n, key), value in series.items():
+                        if n == name:
+                            lines.append(f"{metric}{_prometheus_labels(key)} {_prometheus_value(value)}")
+            for name in sorted({n for n, _ in self._latencies}):
+                metric = _prometheus_name(name)
+                lines.append(f"# TYPE {metric} histogram")
+                for (n, key), stats in self._latencies.items():
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(stats.bounds, stats.bucket_counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_prometheus_labels(key, le=_prometheus_value(bound))} {cumulative}")
+                    lines.append(f"{metric}_bucket{_prometheus_labels(key, le='+Inf')} {stats.count}")
+                    lines.append(f"{metric}_sum{_prometheus_labels(key)} {_prometheus_value(stats.total)}")
+                    lines.append(f"{metric}_count{_prometheus_labels(key)} {stats.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._latencies.clear()
+
+
+registry = MetricsRegistry()
+
+inc = registry.inc
+set_gauge = registry.set_gauge
+observe = registry.observe
+snapshot = registry.snapshot
+render_prometheus = registry.render_prometheus
+
+# Histogramas que no miden segundos.
+registry.configure_buckets("agent_loop_iterations", (1, 2, 3, 4, 5, 6, 8, 10, 15, 25))
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Mide la duración de una etapa del procesamiento en `stage_seconds{stage=...}`, falle o no."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        registry.observe("stage_seconds", time.monotonic() - started, stage=stage, **labels)
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+from core import metrics
+from core.redis_pool import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# "sync": el webhook procesa el mensaje antes de responder (comportamiento original).
+# "queue": el webhook encola el mensaje y responde 204 de inmediato; los workers lo procesan.
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "sync").lower()
+WEBHOOK_QUEUE_BACKEND = os.getenv("WEBHOOK_QUEUE_BACKEND", "memory").lower()
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_MAXSIZE = int(os.getenv("WEBHOOK_QUEUE_MAXSIZE", "1000"))
+WEBHOOK_QUEUE_KEY = "webhook:queue"
+
+
+class QueueFullError(Exception):
+    """Se lanza cuando la cola de mensajes entrantes alcanzó su capacidad máxima."""
+
+
+class InMemoryQueue:
+    """Cola en proceso basada en asyncio.Queue. Solo reparte trabajo dentro del mismo worker de uvicorn."""
+    def __init__(self, maxsize: int = WEBHOOK_QUEUE_MAXSIZE):
+        self._queue = asyncio.Queue(maxsize=maxsize)
+
+    async def put(self, job: dict):
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"La cola en memoria alcanzó su límite de {self._queue.maxsize} mensajes.")
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def size(self) -> int:
+        return self._queue.qsize()
+
+
+class RedisQueue:
+    """
+    Cola respaldada por una lista de Redis. Permite que varios procesos o contenedores
+    consuman los mensajes recibidos por cualquiera de ellos.
+    """
+    def __init__(self, key: str = WEBHOOK_QUEUE_KEY, maxsize: int = WEBHOOK_QUEUE_MAXSIZE):
+        self.key = key
+        self.maxsize = maxsize
+        self.client = get_async_redis()
+
+    async def put(self, job: dict):
+        length = await self.client.rpush(self.key, json.dumps(job))
+        if self.maxsize and length > self.maxsize:
+            await self.client.rpop(self.key)
+            raise QueueFullError(f"La cola '{self.key}' en Redis alcanzó su límite de {self.maxsize} mensajes.")
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        item = await self.client.blpop([self.key], timeout=timeout)
+        if not item:
+            return None
+        return json.loads(item[1])
+
+    async def size(self) -> int:
+        return await self.client.llen(self.key)
+
+
+def create_queue(backend: str = WEBHOOK_QUEUE_BACKEND):
+    """Construye la cola configurada ('memory' o 'redis')."""
+    if backend == "redis":
+        return RedisQueue()
+    if backend != "memory":
+        logger.warning(f"Backend de cola desconocido '{backend}'. Se usará la cola en memoria.")
+    return InMemoryQueue()
+
+
+class WebhookPipeline:
+    """
+    Desacopla la recepción del webhook del procesamiento del mensaje.
+    El endpoint solo encola; un pool de workers ejecuta el handler (bloqueante)
+    en hilos para no frenar el event loop, y registra tiempos por etapa.
+    Si se indica un `scheduler` (ver core.scheduler.UserScheduler), los workers le
+    entregan cada trabajo y es él quien serializa por usuario y limita la concurrencia.
+    Antes de sacar un trabajo de la cola esperan a que el scheduler tenga lugar: así la
+    cola sigue acotando el total y los mensajes no salen de Redis antes de poder atenderse.
+    """
+    def __init__(self, handler: Callable[[dict], None], queue=None, num_workers: int = WEBHOOK_WORKERS, scheduler=None):
+        self.handler = handler
+        self.queue = queue if queue is not None else create_queue()
+        self.num_workers = max(1, num_workers)
+        self.scheduler = scheduler
+        self._tasks: list[asyncio.Task] = []
+        self._busy = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        """Lanza los workers. Debe llamarse desde el event loop de la aplicación."""
+        if self.running:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.num_workers)]
+        logger.info("Pipeline de webhooks iniciado con %s workers (%s).", self.num_workers, type(self.queue).__name__)
+
+    async def stop(self):
+        """Detiene los workers. Los trabajos en curso se cancelan en su próximo punto de espera."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.scheduler is not None:
+            await self.scheduler.wait_idle()
+        logger.info("Pipeline de webhooks detenido.")
+
+    async def enqueue(self, user_id: str, body: str, **extra):
+        """Encola un mensaje entrante para ser procesado por los workers."""
+        job = {"user_id": user_id, "body": body, "enqueued_at": time.time(), **extra}
+        await self.queue.put(job)
+        metrics.inc("webhook_jobs_enqueued_total")
+
+    async def _worker(self, worker_id: int):
+        while True:
+            if self.scheduler is not None:
+                await self.scheduler.acquire_slot()
+            try:
+                job = await self.queue.get(timeout=1.0)
+            except BaseException:
+                if self.scheduler is not None:
+                    self.scheduler.release_slot()
+                raise
+            if job is None:
+                if self.scheduler is not None:
+                    self.scheduler.release_slot()
+                continue
+            started = time.time()
+            metrics.observe("webhook_stage_seconds", started - job["enqueued_at"], stage="queue_wait")
+            if self.scheduler is not None:
+                await self.scheduler.submit(job)
+                continue
+            self._busy += 1
+            try:
+                await asyncio.to_thread(self.handler, job)
+                metrics.inc("webhook_jobs_processed_total")
+            except Exception as e:
+                metrics.inc("webhook_jobs_failed_total")
+                logger.error("Worker %s: error al procesar el mensaje de %s: %s", worker_id, job.get('user_id'), e, exc_info=True)
+            finally:
+                self._busy -= 1
+                finished = time.time()
+                metrics.observe("webhook_stage_seconds", finished - started, stage="processing")
+                metrics.observe("webhook_stage_seconds", finished - job["enqueued_at"], stage="total")
+
+    async def stats(self) -> dict:
+        """Profundidad de la cola y ocupación de los workers."""
+        depth = await self.queue.size()
+        # Con scheduler los workers solo reparten: la ocupación real son los turnos en ejecución.
+        busy = self.scheduler.running if self.scheduler is not None else self._busy
+        metrics.set_gauge("webhook_queue_depth", depth)
+        metrics.set_gauge("webhook_workers_busy", busy)
+        return {
+            "backend": type(self.queue).__name__,
+            "queue_depth": depth,
+            "workers": self.num_workers,
+            "workers_busy": busy,
+        }
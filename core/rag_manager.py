@@ -1,27 +1,164 @@
 import os
+import sys
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, List, NamedTuple, Optional
 from dotenv import load_dotenv
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
 from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
+from core.embeddings import RAG_EMBEDDINGS, build_embeddings
+from core import metrics
+from core.index_versions import LEGACY_VERSION, IndexStore
+from core.kb_cache import KnowledgeCache
+from core.lexical import BM25Index, is_decisive, reciprocal_rank_fusion
+from core.vector_backends import RAG_VECTOR_BACKEND, create_backend, default_directory
 
 load_dotenv()
 
 KNOWLEDGE_BASE_DIR = "data/knowledge_base"
-VECTOR_STORE_DIR = "data/chroma_db"
+# Caché persistente de embeddings, indexada por el hash del texto de cada chunk.
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "data/embedding_cache")
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "3"))
+# "vector" (solo embeddings) o "hybrid" (BM25 + vectorial fusionados por rango recíproco).
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "vector").lower()
+# Umbrales para considerar decisivo el ranking léxico y omitir el embedding de la consulta.
+RAG_LEXICAL_MIN_SCORE = float(os.getenv("RAG_LEXICAL_MIN_SCORE", "3.0"))
+RAG_LEXICAL_MARGIN = float(os.getenv("RAG_LEXICAL_MARGIN", "1.5"))
+
+
+class CachedRetriever(BaseRetriever):
+    """Retriever de LangChain que delega en RAGManager.search (con caché)."""
+    manager: Any
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with metrics.span("retrieval"):
+            return self.manager.search(query)
+
+
+class CountingEmbeddings(Embeddings):
+    """Envuelve un modelo de embeddings y cuenta cuántos textos y consultas se enviaron a embeber."""
+    def __init__(self, underlying: Embeddings):
+        self.underlying = underlying
+        self.embedded_texts = 0
+        self.embedded_queries = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded_texts += len(texts)
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.embedded_queries += 1
+        return self.underlying.embed_query(text)
+
+
+class ActiveIndex(NamedTuple):
+    """
+    Índice en uso. Se reemplaza completo al cambiar de versión, así que una búsqueda en curso
+    sigue usando el backend y el índice léxico que tomó al empezar.
+    """
+    backend: Any
+    lexical_index: Optional[BM25Index]
+    # Contador local que invalida la caché de búsquedas en cada cambio.
+    version: int
+    # Versión en disco (directorio) de la que se cargó.
+    label: Optional[str]
+
+
+def assign_chunk_ids(chunks: List[Document]) -> List[str]:
+    """
+    Calcula un ID estable para cada chunk a partir del hash de su archivo de origen y su contenido.
+    Los chunks idénticos dentro del mismo archivo se distinguen por su número de aparición.
+    """
+    seen = {}
+    ids = []
+    for chunk in chunks:
+        source = chunk.metadata.get("source", "")
+        digest = hashlib.sha256(f"{source}\x00{chunk.page_content}".encode("utf-8")).hexdigest()[:32]
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        ids.append(digest if occurrence == 0 else f"{digest}-{occurrence}")
+    return ids
+
 
 class RAGManager:
     """
     Gestiona la creación y carga de la base de conocimientos vectorial.
     """
-    def __init__(self):
-        self.embeddings_model = OpenAIEmbeddings()
-        self.vector_store = None
+    def __init__(
+        self,
+        embeddings_kind: str = RAG_EMBEDDINGS,
+        backend_kind: str = RAG_VECTOR_BACKEND,
+        retrieval_mode: str = RAG_RETRIEVAL_MODE,
+        knowledge_base_dir: str = KNOWLEDGE_BASE_DIR,
+        index_dir: Optional[str] = None,
+    ):
+        self.knowledge_base_dir = knowledge_base_dir
+        base_embeddings = build_embeddings(embeddings_kind)
+        self.counting_embeddings = CountingEmbeddings(base_embeddings)
+        # Los chunks ya embebidos alguna vez se leen de disco en lugar de volver a la API.
+        self.embeddings_model = CacheBackedEmbeddings.from_bytes_store(
+            self.counting_embeddings,
+            LocalFileStore(EMBEDDING_CACHE_DIR),
+            namespace=base_embeddings.model,
+        )
+        self.backend_kind = backend_kind
+        self.store = IndexStore(index_dir or default_directory(backend_kind))
+        self.retrieval_mode = retrieval_mode
+        self.active = ActiveIndex(None, None, 0, None)
+        self._swap_lock = threading.Lock()
+        self.cache = KnowledgeCache()
+
+    @property
+    def backend(self):
+        return self.active.backend
+
+    @property
+    def index_version(self) -> int:
+        return self.active.version
+
+    @property
+    def active_version(self) -> Optional[str]:
+        """Versión en disco del índice que se está usando (None si aún no se cargó)."""
+        return self.active.label
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.active.backend is not None and self.active.backend.is_loaded
+
+    def stored_version(self) -> Optional[str]:
+        """Versión publicada en disco: la de CURRENT, "legacy" para un índice sin versiones, o None."""
+        current = self.store.current()
+        if current:
+            return current
+        if self._open_backend(LEGACY_VERSION).exists():
+            return LEGACY_VERSION
+        return None
+
+    def _open_backend(self, version: str):
+        return create_backend(self.embeddings_model, self.backend_kind, self.store.path(version))
+
+    def _activate(self, backend, label: str):
+        """
+        Pone en uso un backend ya cargado. El índice léxico se construye antes del cambio, que es
+        una sola asignación: las búsquedas nunca ven una mezcla de versiones.
+        """
+        lexical_index = BM25Index(backend.documents()) if self.retrieval_mode == "hybrid" else None
+        with self._swap_lock:
+            self.active = ActiveIndex(backend, lexical_index, self.active.version + 1, label)
+        self.cache.invalidate()
 
     def _load_documents(self):
         """Carga los documentos desde el directorio especificado."""
-        print(f"Cargando documentos desde '{KNOWLEDGE_BASE_DIR}'...")
-        loader = DirectoryLoader(KNOWLEDGE_BASE_DIR, glob="**/*.txt", loader_cls=TextLoader, loader_kwargs={"encoding": "utf-8"})
+        print(f"Cargando documentos desde '{self.knowledge_base_dir}'...")
+        loader = DirectoryLoader(self.knowledge_base_dir, glob="**/*.txt", loader_cls=TextLoader, loader_kwargs={"encoding": "utf-8"})
         return loader.load()
 
     def _split_documents(self, documents):
@@ -34,41 +171,70 @@ class RAGManager:
         )
         return text_splitter.split_documents(documents)
 
-    def create_and_save_vector_store(self):
+    def create_and_save_vector_store(self, full_rebuild: bool = False) -> dict:
         """
-        Crea la base de datos de vectores a partir de los documentos
-        y la guarda de forma persistente con ChromaDB.
+        Construye una versión nueva del índice sincronizando de forma incremental una copia de la
+        versión publicada con los documentos, la publica (CURRENT) y la pone en uso.
+        Solo se embeben los chunks nuevos o modificados (y de ellos, solo los que no estén
+        en la caché de embeddings); los chunks de archivos editados o eliminados se borran.
+        Con `full_rebuild` la versión nueva parte vacía. Devuelve un resumen de los cambios.
         """
+        started = time.monotonic()
         documents = self._load_documents()
         if not documents:
             print("No se encontraron documentos para procesar.")
-            return
+            return {}
 
         chunks = self._split_documents(documents)
-        
-        print("Creando y guardando el vector store con ChromaDB...")
-        self.vector_store = Chroma.from_documents(
-            documents=chunks, 
-            embedding=self.embeddings_model,
-            persist_directory=VECTOR_STORE_DIR
-        )
-        print(f"Vector store guardado en '{VECTOR_STORE_DIR}'.")
+        chunk_ids = assign_chunk_ids(chunks)
+        desired = dict(zip(chunk_ids, chunks))
+
+        version = self.store.new_version()
+        self.store.prepare(version, base=None if full_rebuild else self.stored_version())
+        backend = self._open_backend(version)
+        print(f"Sincronizando el índice vectorial ({type(backend).__name__}, versión {version})...")
+        embedded_before = self.counting_embeddings.embedded_texts
+        try:
+            existing_sources = backend.existing()
+            to_remove = [chunk_id for chunk_id in existing_sources if chunk_id not in desired]
+            to_add = [chunk_id for chunk_id in desired if chunk_id not in existing_sources]
+            backend.apply(to_add, [desired[chunk_id] for chunk_id in to_add], to_remove)
+        except Exception:
+            self.store.discard(version)
+            raise
+        self.store.publish(version)
+        self._activate(backend, version)
+
+        changed_files = {existing_sources[chunk_id] for chunk_id in to_remove}
+        changed_files.update(desired[chunk_id].metadata.get("source", "") for chunk_id in to_add)
+        report = {
+            "added": len(to_add),
+            "removed": len(to_remove),
+            "unchanged": len(desired) - len(to_add),
+            "embedded": self.counting_embeddings.embedded_texts - embedded_before,
+            "changed_files": sorted(changed_files),
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+            "version": version,
+        }
+        print(f"Índice vectorial sincronizado en '{backend.directory}': {report}")
+        return report
 
-    def load_vector_store(self):
+    def load_vector_store(self, version: Optional[str] = None):
         """
-        Carga la base de datos de vectores persistente de ChromaDB.
+        Carga el índice vectorial persistente del backend configurado: la versión indicada o la
+        publicada en CURRENT. Las búsquedas en curso terminan con el índice anterior.
         Retorna True si se cargó correctamente, False en caso contrario.
         """
-        if not os.path.exists(VECTOR_STORE_DIR):
-            print(f"El directorio del vector store '{VECTOR_STORE_DIR}' no existe.")
+        version = version or self.stored_version()
+        backend = self._open_backend(version) if version else None
+        if backend is None or not backend.exists():
+            print(f"No hay un vector store publicado en '{self.store.root}' (versión {version}).")
             return False
-        
-        print(f"Cargando vector store desde '{VECTOR_STORE_DIR}'...")
-        self.vector_store = Chroma(
-            persist_directory=VECTOR_STORE_DIR, 
-            embedding_function=self.embeddings_model
-        )
-        print("Vector store cargado.")
+
+        print(f"Cargando vector store desde '{backend.directory}'...")
+        backend.load()
+        self._activate(backend, version)
+        print(f"Vector store cargado (versión {version}).")
         return True
 
     def reload_vector_store(self):
@@ -76,18 +242,72 @@ class RAGManager:
         logging.info("Recargando el vector store desde el disco...")
         return self.load_vector_store()
 
+    def search(self, query: str) -> List[Document]:
+        """
+        Busca los chunks más relevantes para una consulta.
+        Primero consulta la caché exacta (sin embedding). En modo híbrido, si el ranking
+        BM25 es decisivo se devuelve sin calcular el embedding; si no, se consulta la caché
+        semántica y el índice vectorial (reutilizando el embedding) y se fusionan ambos rankings.
+        """
+        active = self.active
+        if active.backend is None or not active.backend.is_loaded:
+            raise ValueError("El vector store no ha sido cargado. Ejecuta load_vector_store() primero.")
+        version = active.version
+        lexical_index = active.lexical_index
+
+        documents = self.cache.get_exact(query, version)
+        if documents is not None:
+            return documents
+
+        lexical = []
+        if lexical_index is not None:
+            scored = lexical_index.search(query, k=RAG_TOP_K * 2)
+            lexical = [document for document, _ in scored]
+            if is_decisive(scored, RAG_LEXICAL_MIN_SCORE, RAG_LEXICAL_MARGIN):
+                metrics.inc("kb_retrieval_total", path="lexical")
+                documents = lexical[:RAG_TOP_K]
+                self.cache.record_miss()
+                self.cache.put(query, documents, None, version)
+                return documents
+
+        embedding = self.embeddings_model.embed_query(query)
+        documents = self.cache.get_similar(embedding, version)
+        if documents is None:
+            self.cache.record_miss()
+            if lexical_index is not None:
+                metrics.inc("kb_retrieval_total", path="hybrid")
+                vector = active.backend.search_by_vector(embedding, k=RAG_TOP_K * 2)
+                documents = reciprocal_rank_fusion([vector, lexical], k=RAG_TOP_K)
+            else:
+                metrics.inc("kb_retrieval_total", path="vector")
+                documents = active.backend.search_by_vector(embedding, k=RAG_TOP_K)
+        self.cache.put(query, documents, embedding, version)
+        return documents
+
     def get_retriever(self):
         """Devuelve un retriever para realizar búsquedas."""
-        if self.vector_store is None:
+        if not self.is_loaded:
             raise ValueError("El vector store no ha sido cargado. Ejecuta load_vector_store() primero.")
-        return self.vector_store.as_retriever(search_kwargs={"k": 3})
+        return CachedRetriever(manager=self)
 
 if __name__ == "__main__":
     print("Ejecutando el gestor de RAG para crear el índice inicial...")
     
-    if not os.getenv("OPENAI_API_KEY"):
+    if RAG_EMBEDDINGS == "openai" and not os.getenv("OPENAI_API_KEY"):
         print("Error: La variable de entorno OPENAI_API_KEY no está configurada.")
         print("Por favor, crea un archivo .env y añade tu clave de API de OpenAI.")
     else:
-        manager = RAGManager()
-        manager.create_and_save_vector_store()
+        # Con --tenant <id> se construye el índice de un local de TENANTS_FILE (ver core/tenants.py).
+        from core.tenants import DEFAULT_TENANT, TenantRegistry, tenant_manager
+        tenant = DEFAULT_TENANT
+        if "--tenant" in sys.argv:
+            tenant_id = sys.argv[sys.argv.index("--tenant") + 1]
+            tenant = TenantRegistry().get(tenant_id)
+            if tenant is None:
+                sys.exit(f"Error: el local '{tenant_id}' no está en el archivo de locales.")
+        manager = RAGManager() if tenant.is_default else tenant_manager(tenant)
+        report = manager.create_and_save_vector_store(full_rebuild="--full" in sys.argv)
+        # Con --broadcast los workers en ejecución cargan la versión nueva sin esperar su revisión periódica.
+        if report and "--broadcast" in sys.argv:
+            from core.kb_reload import broadcast_reload
+            print(f"Versión anunciada a {broadcast_reload(report['version'], tenant=tenant)} workers.")
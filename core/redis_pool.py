@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+
+import redis
+import redis.asyncio as aioredis
+
+from core import metrics
+from core.startup import resource
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
+# Conexiones máximas por pool y por proceso. Al agotarse, los clientes esperan hasta REDIS_POOL_TIMEOUT segundos.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+
+_lock = threading.Lock()
+_pools: dict = {}
+_async_pools: dict = {}
+# Clientes que reemplazan a Redis en todo el proceso (benchmarks y pruebas locales).
+_override = None
+_async_override = None
+
+
+def use_clients(sync_client, async_client=None):
+    """
+    Hace que get_redis() y get_async_redis() devuelvan estos clientes en lugar de conectarse a
+    REDIS_URL. Debe llamarse antes de importar los módulos que crean clientes al importarse.
+    """
+    global _override, _async_override
+    _override, _async_override = sync_client, async_client
+
+
+def _get_pool(decode_responses: bool) -> redis.BlockingConnectionPool:
+    """Devuelve (creándolo la primera vez) el pool síncrono del proceso para el modo de decodificación dado."""
+    pool = _pools.get(decode_responses)
+    if pool is None:
+        with _lock:
+            pool = _pools.get(decode_responses)
+            if pool is None:
+                pool = redis.BlockingConnectionPool.from_url(
+                    REDIS_URL,
+                    max_connections=REDIS_MAX_CONNECTIONS,
+                    timeout=REDIS_POOL_TIMEOUT,
+                    decode_responses=decode_responses,
+                )
+                _pools[decode_responses] = pool
+                logger.info(f"Pool de Redis creado para {REDIS_URL} (decode_responses={decode_responses}).")
+    return pool
+
+
+def get_redis(decode_responses: bool = True) -> redis.Redis:
+    """
+    Cliente de Redis síncrono que comparte el pool de conexiones del proceso.
+    Crear el cliente no abre sockets: las conexiones se establecen al primer comando.
+    """
+    if _override is not None:
+        return _override
+    return redis.Redis(connection_pool=_get_pool(decode_responses))
+
+
+def get_async_redis(decode_responses: bool = True) -> aioredis.Redis:
+    """Cliente de redis.asyncio para el camino asíncrono del webhook (un pool por proceso)."""
+    if _async_override is not None:
+        return _async_override
+    pool = _async_pools.get(decode_responses)
+    if pool is None:
+        pool = aioredis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            decode_responses=decode_responses,
+        )
+        _async_pools[decode_responses] = pool
+        logger.info(f"Pool asíncrono de Redis creado para {REDIS_URL} (decode_responses={decode_responses}).")
+    return aioredis.Redis(connection_pool=pool)
+
+
+# Dependencia para el arranque y /ready: comprueba que Redis responda.
+redis_resource = resource("redis", get_redis, check=lambda client: client.ping())
+
+
+def _pool_usage(pool) -> dict:
+    """Conexiones creadas, en uso y ociosas de un pool (síncrono o asíncrono)."""
+    if hasattr(pool, "_in_use_connections"):
+        in_use = len(pool._in_use_connections)
+        idle = len(pool._available_connections)
+        created = in_use + idle
+    else:
+        created = len(pool._connections)
+        idle = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+        in_use = created - idle
+    return {"max": pool.max_connections, "created": created, "in_use": in_use, "idle": idle}
+
+
+def pool_stats() -> dict:
+    """Utilización de los pools de Redis del proceso; también se publica como gauges."""
+    stats = {}
+    for kind, pools in (("sync", _pools), ("async", _async_pools)):
+        for decode_responses, pool in list(pools.items()):
+            name = f"{kind}_{'text' if decode_responses else 'binary'}"
+            usage = _pool_usage(pool)
+            for field in ("created", "in_use", "idle"):
+                metrics.set_gauge("redis_pool_connections", usage[field], pool=name, state=field)
+            stats[name] = usage
+    return stats
+
+
+def close_pools():
+    """Cierra los pools síncronos (p. ej. al apagar el proceso)."""
+    with _lock:
+        for pool in _pools.values():
+            pool.disconnect()
+        _pools.clear()
+
+
+async def aclose_pools():
+    """Cierra los pools asíncronos."""
+    for pool in _async_pools.values():
+        await pool.disconnect()
+    _async_pools.clear()
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ventana de "debounce": los mensajes de un mismo usuario que llegan dentro de ella se
+# fusionan en un único turno del agente. Con 0 solo se serializa el trabajo por usuario.
+COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", "1.5"))
+# Tiempo máximo que un mensaje puede esperar a que el usuario deje de escribir.
+COALESCE_MAX_WAIT_SECONDS = float(os.getenv("COALESCE_MAX_WAIT_SECONDS", "5"))
+# Mensajes aceptados por el scheduler (en buzones o en proceso) entre todos los usuarios. Al
+# llegar al límite los workers dejan de sacar trabajos de la cola, que así puede llenarse y
+# devolver 503 (Twilio reintenta) en lugar de acumular mensajes en memoria.
+SCHEDULER_MAX_PENDING = int(os.getenv("SCHEDULER_MAX_PENDING", "100"))
+
+# Comandos que nunca se fusionan con otros mensajes.
+COMMANDS = {"fin", "recargar"}
+
+
+def is_command(body: str) -> bool:
+    """Indica si el mensaje es un comando especial del webhook."""
+    return body.strip().lower() in COMMANDS
+
+
+class _Mailbox:
+    """Mensajes pendientes de un usuario y la tarea que los drena."""
+    def __init__(self):
+        self.pending: list[tuple[float, dict]] = []
+        self.last_arrival = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+
+class ConversationLocks:
+    """
+    Un asyncio.Lock por conversación ((local, usuario)) para el modo sync, donde cada webhook
+    procesa su mensaje antes de responder: dos mensajes seguidos del mismo usuario se atienden
+    uno después del otro, sin leer ni escribir el mismo historial y carrito a la vez.
+    Los locks sin uso se descartan.
+    """
+    def __init__(self):
+        self._locks: dict[tuple, list] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: tuple):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        if entry[0].locked():
+            metrics.inc("conversation_lock_waits_total")
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "active_conversations": len(self._locks),
+            "waiting_turns": sum(max(0, users - 1) for _, users in self._locks.values()),
+        }
+
+
+class UserScheduler:
+    """
+    Serializa el procesamiento por usuario (campos 'tenant_id' y 'user_id' del trabajo) y ejecuta
+    usuarios distintos en paralelo, con un máximo de `max_concurrency` turnos simultáneos.
+    Los mensajes consecutivos que llegan dentro de la ventana de debounce se fusionan
+    en un solo trabajo cuyo 'body' une los textos con saltos de línea.
+    Como máximo acepta `max_pending` mensajes a la vez: quien entrega trabajos debe esperar
+    un lugar con `acquire_slot()` antes de tomar el siguiente.
+    """
+    def __init__(
+        self,
+        handler: Callable[[dict], None],
+        max_concurrency: int,
+        window: float = COALESCE_WINDOW_SECONDS,
+        max_wait: float = COALESCE_MAX_WAIT_SECONDS,
+        max_pending: int = SCHEDULER_MAX_PENDING,
+    ):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_pending = max(1, max_pending)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._mailboxes: dict[tuple, _Mailbox] = {}
+        self._running = 0
+        self._accepted = 0
+
+    @property
+    def running(self) -> int:
+        """Turnos ejecutándose en este momento."""
+        return self._running
+
+    async def acquire_slot(self):
+        """Espera hasta que haya lugar para un mensaje más. Cada `submit` consume el lugar tomado."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if self._slots.locked():
+            metrics.inc("scheduler_backpressure_waits_total")
+        await self._slots.acquire()
+
+    def release_slot(self, count: int = 1):
+        """Devuelve lugares sin usar (p. ej. si la cola no tenía trabajos)."""
+        for _ in range(count):
+            self._slots.release()
+
+    async def submit(self, job: dict):
+        """
+        Agrega un mensaje al buzón del usuario. Retorna sin esperar a que se procese.
+        Usa el lugar tomado con `acquire_slot()`, que se libera cuando termina el turno.
+        """
+        self._accepted += 1
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Un mismo cliente puede escribirle a varios locales: cada conversación tiene su buzón.
+        key = (job.get("tenant_id"), job["user_id"])
+        now = time.monotonic()
+        mailbox = self._mailboxes.get(key)
+        if mailbox is None:
+            mailbox = self._mailboxes[key] = _Mailbox()
+        mailbox.pending.append((now, job))
+        mailbox.last_arrival = now
+        if mailbox.task is None:
+            mailbox.task = asyncio.create_task(self._drain(key, mailbox))
+
+    async def _debounce(self, mailbox: _Mailbox):
+        """Espera a que el usuario deje de escribir o a que se agote la espera máxima."""
+        while True:
+            first_arrival = mailbox.pending[0][0]
+            deadline = min(mailbox.last_arrival + self.window, first_arrival + self.max_wait)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining)
+
+    def _take_batch(self, mailbox: _Mailbox) -> list[tuple[float, dict]]:
+        """Toma el próximo lote: un comando solo, o todos los mensajes normales consecutivos."""
+        if is_command(mailbox.pending[0][1]["body"]):
+            return [mailbox.pending.pop(0)]
+        batch = []
+        while mailbox.pending and not is_command(mailbox.pending[0][1]["body"]):
+            batch.append(mailbox.pending.pop(0))
+        return batch
+
+    @staticmethod
+    def _merge(batch: list[tuple[float, dict]]) -> dict:
+        """Fusiona los trabajos de un lote conservando los metadatos del primero."""
+        jobs = [job for _, job in batch]
+        merged = dict(jobs[0])
+        merged["body"] = "\n".join(job["body"] for job in jobs)
+        merged["coalesced"] = len(jobs)
+        merged["message_sids"] = [sid for job in jobs for sid in job.get("message_sids", ())]
+        return merged
+
+    async def _drain(self, key: tuple, mailbox: _Mailbox):
+        try:
+            while mailbox.pending:
+                if not is_command(mailbox.pending[0][1]["body"]):
+                    await self._debounce(mailbox)
+                batch = self._take_batch(mailbox)
+                job = self._merge(batch)
+                if len(batch) > 1:
+                    metrics.inc("webhook_messages_coalesced_total", len(batch) - 1)
+                    logger.info("%d mensajes de %s fusionados en un solo turno.", len(batch), job["user_id"])
+                async with self._semaphore:
+                    await self._run(job, batch[0][0])
+        finally:
+            mailbox.task = None
+            if not mailbox.pending:
+                self._mailboxes.pop(key, None)
+
+    async def _run(self, job: dict, first_arrival: float):
+        started = time.monotonic()
+        metrics.observe("webhook_stage_seconds", started - first_arrival, stage="coalesce_wait")
+        self._running += 1
+        try:
+            await asyncio.to_thread(self.handler, job)
+            metrics.inc("webhook_jobs_processed_total")
+        except Exception as e:
+            metrics.inc("webhook_jobs_failed_total")
+            logger.error("Error al procesar el turno de %s: %s", job.get('user_id'), e, exc_info=True)
+        finally:
+            self._running -= 1
+            coalesced = job.get("coalesced", 1)
+            self._accepted -= coalesced
+            self.release_slot(coalesced)
+            metrics.inc("agent_turns_total")
+            metrics.observe("webhook_stage_seconds", time.monotonic() - started, stage="processing")
+            if "enqueued_at" in job:
+                metrics.observe("webhook_stage_seconds", time.time() - job["enqueued_at"], stage="total")
+
+    async def wait_idle(self):
+        """Espera a que se drenen todos los buzones (útil al apagar el proceso)."""
+        tasks = [m.task for m in self._mailboxes.values() if m.task is not None]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        pending = sum(len(m.pending) for m in self._mailboxes.values())
+        metrics.set_gauge("scheduler_active_users", len(self._mailboxes))
+        metrics.set_gauge("scheduler_pending_messages", pending)
+        metrics.set_gauge("scheduler_accepted_messages", self._accepted)
+        return {
+            "active_users": len(self._mailboxes),
+            "pending_messages": pending,
+            "accepted_messages": self._accepted,
+            "max_pending": self.max_pending,
+            "running_turns": self._running,
+            "max_concurrency": self.max_concurrency,
+            "coalesce_window_seconds": self.window,
+        }
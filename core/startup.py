@@ -0,0 +1,169 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# "eager": los recursos se construyen en paralelo al iniciar cada worker (lifespan de FastAPI).
+# "lazy": se construyen recién en el primer uso.
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager").lower()
+READINESS_CHECK_TIMEOUT = float(os.getenv("READINESS_CHECK_TIMEOUT", "2"))
+
+_resources: Dict[str, "Resource"] = {}
+_timings: Dict[str, float] = {}
+
+
+class Resource:
+    """
+    Recurso pesado del proceso (cliente, índice, modelo) que se construye una sola vez por
+    worker, en el primer `get()` o durante el arranque. Registra cuánto tardó en construirse
+    y el error si falló, para el reporte de arranque y el endpoint de readiness.
+    `required=False` marca dependencias opcionales (p. ej. Twilio sin credenciales).
+    """
+    def __init__(self, name: str, factory: Callable[[], Any], required: bool = True,
+                 check: Optional[Callable[[Any], Any]] = None):
+        self.name = name
+        self.factory = factory
+        self.required = required
+        self.check = check
+        self.init_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                started = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                finally:
+                    self.init_seconds = time.perf_counter() - started
+                self.error = None
+                self._loaded = True
+        return self._value
+
+    def set(self, value):
+        """Reemplaza la instancia (benchmarks, pruebas o una recarga)."""
+        with self._lock:
+            self._value = value
+            self._loaded = True
+            self.error = None
+
+    def reset(self):
+        """Descarta la instancia; el próximo `get()` la vuelve a construir."""
+        with self._lock:
+            self._value = None
+            self._loaded = False
+
+    def status(self) -> dict:
+        if self.error:
+            state = "error"
+        elif not self._loaded:
+            state = "pending"
+        elif self._value is None:
+            state = "disabled"
+        else:
+            state = "ready"
+        status = {"state": state, "required": self.required}
+        if self.init_seconds is not None:
+            status["init_ms"] = round(self.init_seconds * 1000, 1)
+        if self.error:
+            status["error"] = self.error
+        if state == "ready" and self.check is not None:
+            try:
+                self.check(self._value)
+                status["check"] = "ok"
+            except Exception as e:
+                status["state"] = "error"
+                status["check"] = f"falló: {e}"
+        return status
+
+
+def resource(name: str, factory: Callable[[], Any], required: bool = True,
+             check: Optional[Callable[[Any], Any]] = None) -> Resource:
+    """Declara un recurso del proceso. Construirlo no tiene efectos hasta el primer `get()`."""
+    _resources[name] = Resource(name, factory, required, check)
+    return _resources[name]
+
+
+def get_resource(name: str) -> Resource:
+    return _resources[name]
+
+
+def record_timing(stage: str, seconds: float):
+    """Registra una etapa del arranque que no es un recurso (p. ej. los imports)."""
+    _timings[stage] = seconds
+
+
+def warm_up(names: Optional[Iterable[str]] = None, max_workers: int = 8) -> Dict[str, dict]:
+    """
+    Construye en paralelo los recursos indicados (todos por defecto) y devuelve su estado.
+    Los errores no se propagan: quedan en el estado del recurso y los reporta /ready.
+    """
+    selected = [_resources[name] for name in (names or list(_resources))]
+    started = time.perf_counter()
+
+    def build(item: Resource):
+        try:
+            item.get()
+        except Exception as e:
+            logger.error(f"No se pudo inicializar '{item.name}': {e}", exc_info=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="warm-up") as executor:
+        list(executor.map(build, selected))
+    record_timing("resources", time.perf_counter() - started)
+    return {item.name: item.status() for item in selected}
+
+
+def readiness() -> dict:
+    """Estado de cada dependencia. En modo lazy, un recurso aún no construido no bloquea."""
+    executor = ThreadPoolExecutor(max_workers=max(1, len(_resources)), thread_name_prefix="readiness")
+    futures = {name: executor.submit(item.status) for name, item in _resources.items()}
+    deadline = time.monotonic() + READINESS_CHECK_TIMEOUT
+    dependencies = {}
+    for name, future in futures.items():
+        try:
+            dependencies[name] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception:
+            dependencies[name] = {"state": "error", "required": _resources[name].required, "check": "timeout"}
+    # Un chequeo colgado no debe retener la respuesta.
+    executor.shutdown(wait=False, cancel_futures=True)
+    acceptable = {"ready", "disabled"} | ({"pending"} if STARTUP_MODE == "lazy" else set())
+    ready = all(status["state"] in acceptable for status in dependencies.values() if status["required"])
+    return {"ready": ready, "startup_mode": STARTUP_MODE, "dependencies": dependencies, "cold_start": cold_start_report()}
+
+
+def cold_start_report() -> Dict[str, float]:
+    """Milisegundos de cada etapa del arranque: imports, cada recurso y el total en paralelo."""
+    report = {stage: round(seconds * 1000, 1) for stage, seconds in _timings.items()}
+    for name, item in _resources.items():
+        if item.init_seconds is not None:
+            report[name] = round(item.init_seconds * 1000, 1)
+    return report
+
+
+def reset_after_fork():
+    """Descarta los recursos heredados del proceso padre: sockets y clientes no deben compartirse."""
+    for item in _resources.values():
+        # El lock pudo quedar tomado por un hilo del padre que no existe en el hijo.
+        item._lock = threading.Lock()
+        item._value = None
+        item._loaded = False
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
@@ -0,0 +1,101 @@
+import logging
+import os
+import re
+import threading
+from typing import Any, Callable, Dict
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from services.whatsapp_client import WHATSAPP_MAX_LENGTH, split_message
+
+logger = logging.getLogger(__name__)
+
+# Envía la respuesta del agente en partes a medida que se generan los tokens.
+PROGRESSIVE_REPLIES = os.getenv("PROGRESSIVE_REPLIES", "false").lower() == "true"
+# Tamaño mínimo de cada parte: evita mandar una ráfaga de mensajes muy cortos.
+PROGRESSIVE_MIN_CHARS = int(os.getenv("PROGRESSIVE_MIN_CHARS", "200"))
+
+# Aviso inmediato que se envía la primera vez que el agente usa cada herramienta en un turno.
+TOOL_ACKNOWLEDGEMENTS = {
+    "get_knowledge_base_response": "🔎 Buscando en el menú…",
+    "add_item_to_cart": "🛒 Agregando a tu carrito…",
+    "add_items_to_cart": "🛒 Agregando a tu carrito…",
+    "view_cart": "🛒 Revisando tu carrito…",
+    "checkout": "💳 Generando tu link de pago…",
+    "talk_to_human": "👤 Contactando a una persona del equipo…",
+}
+
+_SENTENCE_END = re.compile(r"[.!?…](\s|$)|\n")
+
+
+class ProgressiveReplyHandler(BaseCallbackHandler):
+    """
+    Callback de LangChain que convierte la ejecución del grafo en mensajes progresivos:
+    un acuse al iniciar cada herramienta y el texto del modelo en partes del tamaño de
+    oraciones a medida que llegan los tokens. Cada parte respeta el límite de WhatsApp.
+    """
+    def __init__(self, send: Callable[[str], None], min_chars: int = PROGRESSIVE_MIN_CHARS, max_chars: int = WHATSAPP_MAX_LENGTH):
+        self.send = send
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.sent_any = False
+        self.streamed_text = False
+        self._buffer = ""
+        self._acknowledged = set()
+        # Las herramientas pueden ejecutarse en hilos distintos al del modelo.
+        self._lock = threading.Lock()
+
+    def _emit(self, text: str, from_model: bool = True):
+        text = text.strip()
+        if not text:
+            return
+        for part in split_message(text, self.max_chars):
+            self.send(part)
+            self.sent_any = True
+        if from_model:
+            self.streamed_text = True
+
+    def _flush(self, final: bool):
+        """Envía las oraciones completas acumuladas; con `final` envía todo lo pendiente."""
+        if final:
+            text, self._buffer = self._buffer, ""
+            self._emit(text)
+            return
+        if len(self._buffer) < self.min_chars:
+            return
+        boundary = None
+        for match in _SENTENCE_END.finditer(self._buffer):
+            if match.end() >= self.min_chars:
+                boundary = match.end()
+                break
+        if boundary is None and len(self._buffer) >= self.max_chars:
+            boundary = self.max_chars
+        if boundary is not None:
+            text, self._buffer = self._buffer[:boundary], self._buffer[boundary:]
+            self._emit(text)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts, **kwargs: Any):
+        with self._lock:
+            self._buffer = ""
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, **kwargs: Any):
+        with self._lock:
+            self._buffer = ""
+
+    def on_llm_new_token(self, token: str, **kwargs: Any):
+        if not token:
+            return
+        with self._lock:
+            self._buffer += token
+            self._flush(final=False)
+
+    def on_llm_end(self, response, **kwargs: Any):
+        with self._lock:
+            self._flush(final=True)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any):
+        acknowledgement = TOOL_ACKNOWLEDGEMENTS.get((serialized or {}).get("name"))
+        with self._lock:
+            if acknowledgement and acknowledgement not in self._acknowledged:
+                self._acknowledged.add(acknowledgement)
+                self._emit(acknowledgement, from_model=False)
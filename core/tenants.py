@@ -0,0 +1,338 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from core import metrics
+from core.catalog import PRODUCTS_FILE, ProductCatalog
+
+logger = logging.getLogger(__name__)
+
+# Con MULTI_TENANT cada número de WhatsApp (el `To` del webhook) es un local distinto, con su
+# propia base de conocimientos, catálogo, prompt y claves de Redis (ver TENANTS_FILE).
+MULTI_TENANT = os.getenv("MULTI_TENANT", "false").lower() == "true"
+TENANTS_FILE = os.getenv("TENANTS_FILE", "data/tenants.json")
+# Memoria máxima estimada de los índices y catálogos cargados, y cuántos locales se mantienen a la vez.
+TENANT_CACHE_MAX_MB = float(os.getenv("TENANT_CACHE_MAX_MB", "512"))
+TENANT_CACHE_MAX_TENANTS = int(os.getenv("TENANT_CACHE_MAX_TENANTS", "20"))
+
+DEFAULT_TENANT_ID = "default"
+
+
+def normalize_number(number: Optional[str]) -> str:
+    """'whatsapp:+54 9 11...' y '+54911...' identifican al mismo número."""
+    if not number:
+        return ""
+    number = number.strip()
+    if number.startswith("whatsapp:"):
+        number = number[len("whatsapp:"):]
+    return "".join(c for c in number if c.isdigit() or c == "+")
+
+
+@dataclass(frozen=True)
+class Tenant:
+    id: str
+    name: str
+    whatsapp_number: Optional[str] = None
+    knowledge_base_dir: Optional[str] = None
+    index_dir: Optional[str] = None
+    products_file: Optional[str] = None
+    system_prompt: Optional[str] = None
+    human_contact_number: Optional[str] = None
+
+    @property
+    def is_default(self) -> bool:
+        return self.id == DEFAULT_TENANT_ID
+
+    @property
+    def key_prefix(self) -> str:
+        """
+        Prefijo de las claves de Redis del local. El local por defecto no lleva prefijo, así
+        los carritos y conversaciones guardados antes del modo multi-local siguen siendo suyos.
+        """
+        return "" if self.is_default else f"t:{self.id}:"
+
+
+# El local por defecto usa los recursos de siempre (data/knowledge_base, data/products.json,
+# el prompt de core/graph.py y TWILIO_WHATSAPP_NUMBER). BUSINESS_NAME es su nombre en los prompts.
+DEFAULT_TENANT = Tenant(
+    id=DEFAULT_TENANT_ID,
+    name=os.getenv("BUSINESS_NAME", "La Semilla Café"),
+    whatsapp_number=os.getenv("TWILIO_WHATSAPP_NUMBER"),
+    human_contact_number=os.getenv("HUMAN_CONTACT_NUMBER"),
+)
+
+# Local del mensaje en curso; lo fijan el webhook y los workers, igual que el trace ID.
+tenant_var: contextvars.ContextVar[Tenant] = contextvars.ContextVar("tenant", default=DEFAULT_TENANT)
+
+
+def get_tenant() -> Tenant:
+    return tenant_var.get()
+
+
+def set_tenant(tenant: Optional[Tenant]) -> contextvars.Token:
+    """Fija el local del contexto actual (hilo o tarea) y devuelve el token para restaurarlo."""
+    return tenant_var.set(tenant or DEFAULT_TENANT)
+
+
+def tenant_key(key: str) -> str:
+    """Clave de Redis dentro del espacio del local en curso."""
+    return get_tenant().key_prefix + key
+
+
+class TenantRegistry:
+    """
+    Locales declarados en TENANTS_FILE, indexados por id y por número de WhatsApp:
+
+        {"tenants": [{"id": "centro", "name": "Café Centro", "whatsapp_number": "whatsapp:+54...",
+                      "knowledge_base_dir": "data/tenants/centro/knowledge_base",
+                      "products_file": "data/tenants/centro/products.json",
+                      "system_prompt": "Eres ...", "human_contact_number": "whatsapp:+54..."}]}
+
+    Los campos omitidos toman el valor del local por defecto; `index_dir` por omisión es
+    `data/tenants/<id>/index`. Un mensaje a TWILIO_WHATSAPP_NUMBER es del local por defecto.
+    """
+    def __init__(self, path: str = TENANTS_FILE):
+        self.path = path
+        self._by_id: Dict[str, Tenant] = {DEFAULT_TENANT_ID: DEFAULT_TENANT}
+        self._by_number: Dict[str, Tenant] = {}
+        if DEFAULT_TENANT.whatsapp_number:
+            self._by_number[normalize_number(DEFAULT_TENANT.whatsapp_number)] = DEFAULT_TENANT
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logger.warning(f"No existe {self.path}: solo se atenderá al local por defecto.")
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)["tenants"]
+        except (json.JSONDecodeError, KeyError) as e:
+            logger.error(f"Error al leer o procesar {self.path}: {e}")
+            return
+        for entry in entries:
+            tenant_id = entry["id"]
+            tenant = Tenant(
+                id=tenant_id,
+                name=entry.get("name", tenant_id),
+                whatsapp_number=entry.get("whatsapp_number"),
+                knowledge_base_dir=entry.get("knowledge_base_dir"),
+                index_dir=entry.get("index_dir") or os.path.join("data", "tenants", tenant_id, "index"),
+                products_file=entry.get("products_file"),
+                system_prompt=entry.get("system_prompt"),
+                human_contact_number=entry.get("human_contact_number", DEFAULT_TENANT.human_contact_number),
+            )
+            self._by_id[tenant_id] = tenant
+            if tenant.whatsapp_number:
+                self._by_number[normalize_number(tenant.whatsapp_number)] = tenant
+        logger.info(f"{len(entries)} locales cargados desde '{self.path}'.")
+
+    def get(self, tenant_id: Optional[str]) -> Optional[Tenant]:
+        return self._by_id.get(tenant_id or DEFAULT_TENANT_ID)
+
+    def resolve(self, to_number: Optional[str]) -> Optional[Tenant]:
+        """Local dueño del número al que escribió el cliente, o None si no es de ninguno."""
+        return self._by_number.get(normalize_number(to_number))
+
+    def all(self) -> list:
+        return list(self._by_id.values())
+
+
+class TenantResources(NamedTuple):
+    knowledge_base: Any
+    catalog: ProductCatalog
+    size_bytes: int
+
+
+def _directory_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def estimate_bytes(manager, catalog: ProductCatalog) -> int:
+    """
+    Memoria aproximada de un local cargado. Con el backend numpy es la matriz más los textos;
+    con Chroma (que mantiene su índice HNSW y SQLite) se toma el tamaño del índice en disco.
+    El catálogo se estima por el largo de los nombres y alias.
+    """
+    backend = manager.backend
+    matrix = getattr(backend, "matrix", None)
+    if matrix is not None:
+        size = matrix.nbytes + sum(len(chunk.page_content.encode("utf-8")) for chunk in backend.chunks)
+    else:
+        size = _directory_bytes(manager.store.path(manager.active_version)) if manager.active_version else 0
+    size += sum(200 + len(p.name) + sum(len(a) for a in p.aliases) for p in catalog.products())
+    return size
+
+
+def tenant_manager(tenant: Tenant):
+    """RAGManager (sin cargar) con los documentos y el directorio de índices del local."""
+    from core.rag_manager import KNOWLEDGE_BASE_DIR, RAGManager
+
+    return RAGManager(knowledge_base_dir=tenant.knowledge_base_dir or KNOWLEDGE_BASE_DIR, index_dir=tenant.index_dir)
+
+
+def _load_resources(tenant: Tenant) -> TenantResources:
+    """
+    Abre el índice publicado y el catálogo del local. No construye índices: eso lo hace el build.
+    Un local sin índice publicado igual se carga (catálogo y carrito funcionan); su base de
+    conocimientos queda sin cargar hasta que el build publique una versión y `refresh` la tome.
+    """
+    manager = tenant_manager(tenant)
+    if not manager.load_vector_store():
+        metrics.inc("tenant_index_missing_total", tenant=tenant.id)
+        logger.warning(f"No hay un índice publicado para el local '{tenant.id}' en '{manager.store.root}'. Se atenderá sin base de conocimientos.")
+    catalog = ProductCatalog(tenant.products_file or PRODUCTS_FILE)
+    catalog.products()
+    return TenantResources(manager, catalog, estimate_bytes(manager, catalog))
+
+
+class TenantCache:
+    """
+    Índices y catálogos de los locales, cargados a demanda y retenidos en un LRU acotado por
+    memoria estimada (`max_bytes`) y cantidad (`max_tenants`). Los locales sin tráfico no
+    ocupan memoria y los más activos quedan cargados. Cada local se carga una sola vez aunque
+    lleguen varios mensajes juntos; un turno que ya tomó sus recursos los sigue usando aunque
+    el local se desaloje en el medio. Si un local se carga sin índice publicado se llama a
+    `on_missing_index(tenant)` (el reloader de core/kb_reload.py lanza el build).
+    """
+    def __init__(self, loader=_load_resources, max_bytes: int = int(TENANT_CACHE_MAX_MB * 1024 * 1024),
+                 max_tenants: int = TENANT_CACHE_MAX_TENANTS,
+                 on_missing_index: Optional[Callable[[Tenant], Any]] = None):
+        self.loader = loader
+        self.on_missing_index = on_missing_index
+        self.max_bytes = max_bytes
+        self.max_tenants = max(1, max_tenants)
+        self._entries: "OrderedDict[str, TenantResources]" = OrderedDict()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(entry.size_bytes for entry in self._entries.values())
+
+    def _hit(self, tenant_id: str) -> Optional[TenantResources]:
+        with self._lock:
+            entry = self._entries.get(tenant_id)
+            if entry is not None:
+                self._entries.move_to_end(tenant_id)
+            return entry
+
+    def get(self, tenant: Tenant) -> TenantResources:
+        entry = self._hit(tenant.id)
+        if entry is not None:
+            metrics.inc("tenant_cache_total", result="hit", tenant=tenant.id)
+            return entry
+
+        with self._lock:
+            loading = self._loading.setdefault(tenant.id, threading.Lock())
+        with loading:
+            # Otro hilo pudo haberlo cargado mientras se esperaba el lock.
+            entry = self._hit(tenant.id)
+            if entry is not None:
+                metrics.inc("tenant_cache_total", result="hit", tenant=tenant.id)
+                return entry
+            metrics.inc("tenant_cache_total", result="miss", tenant=tenant.id)
+            started = time.monotonic()
+            entry = self.loader(tenant)
+            metrics.observe("tenant_load_seconds", time.monotonic() - started, tenant=tenant.id)
+            logger.info(f"Local '{tenant.id}' cargado ({entry.size_bytes / 1024 / 1024:.1f} MB estimados).")
+            with self._lock:
+                self._entries[tenant.id] = entry
+                self._evict(keep=tenant.id)
+                self._publish_gauges()
+            if not entry.knowledge_base.is_loaded and self.on_missing_index is not None:
+                try:
+                    self.on_missing_index(tenant)
+                except Exception as e:
+                    logger.error(f"No se pudo iniciar el build del índice del local '{tenant.id}': {e}", exc_info=True)
+        return entry
+
+    def _evict(self, keep: str):
+        """Desaloja los locales menos usados hasta volver a los límites (nunca el recién cargado)."""
+        while len(self._entries) > 1 and (len(self._entries) > self.max_tenants or self.size_bytes > self.max_bytes):
+            tenant_id = next(iter(self._entries))
+            if tenant_id == keep:
+                self._entries.move_to_end(tenant_id)
+                continue
+            evicted = self._entries.pop(tenant_id)
+            metrics.inc("tenant_cache_total", result="eviction", tenant=tenant_id)
+            logger.info(f"Local '{tenant_id}' desalojado de memoria ({evicted.size_bytes / 1024 / 1024:.1f} MB).")
+
+    def _publish_gauges(self):
+        metrics.set_gauge("tenant_cache_bytes", self.size_bytes)
+        metrics.set_gauge("tenant_cache_loaded", len(self._entries))
+
+    def peek(self, tenant_id: str) -> Optional[TenantResources]:
+        """Recursos del local si ya están cargados, sin cargarlos ni contar un acceso."""
+        with self._lock:
+            return self._entries.get(tenant_id)
+
+    def refresh(self, tenant_id: str, version: Optional[str] = None) -> bool:
+        """
+        Si el local está cargado, pasa su índice a `version` (o a la que apunta CURRENT).
+        Un local que no está en memoria no hace nada: tomará CURRENT cuando se vuelva a cargar.
+        """
+        entry = self.peek(tenant_id)
+        if entry is None:
+            return False
+        manager = entry.knowledge_base
+        target = version or manager.stored_version()
+        if not target or target == manager.active_version:
+            return False
+        loaded = manager.load_vector_store(target)
+        metrics.inc("kb_reloads_total", result="ok" if loaded else "missing", tenant=tenant_id)
+        if loaded:
+            logger.info(f"Base de conocimientos del local '{tenant_id}' actualizada a la versión {target}.")
+            with self._lock:
+                if tenant_id in self._entries:
+                    self._entries[tenant_id] = entry._replace(size_bytes=estimate_bytes(manager, entry.catalog))
+                self._publish_gauges()
+        return loaded
+
+    def refresh_all(self):
+        """Revisa CURRENT de cada local cargado (respaldo por si se perdió un anuncio)."""
+        with self._lock:
+            tenant_ids = list(self._entries)
+        for tenant_id in tenant_ids:
+            try:
+                self.refresh(tenant_id)
+            except Exception as e:
+                logger.error(f"No se pudo actualizar el índice del local '{tenant_id}': {e}", exc_info=True)
+
+    def stats(self, tenants: Optional[list] = None) -> dict:
+        """Ocupación del LRU y, por local, aciertos, cargas, desalojos y latencia de los turnos."""
+        with self._lock:
+            loaded = {tenant_id: entry.size_bytes for tenant_id, entry in self._entries.items()}
+        ids = [tenant.id for tenant in tenants] if tenants is not None else list(loaded)
+        per_tenant = {}
+        for tenant_id in ids:
+            turns = metrics.registry.get_latency("tenant_turn_seconds", tenant=tenant_id)
+            per_tenant[tenant_id] = {
+                "loaded": tenant_id in loaded,
+                "size_mb": round(loaded.get(tenant_id, 0) / 1024 / 1024, 3),
+                **{result: metrics.registry.get_counter("tenant_cache_total", result=result, tenant=tenant_id)
+                   for result in ("hit", "miss", "eviction")},
+                "turns": turns.snapshot() if turns is not None else None,
+            }
+        return {
+            "loaded": len(loaded),
+            "size_mb": round(sum(loaded.values()) / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "max_tenants": self.max_tenants,
+            "tenants": per_tenant,
+        }
+
+
+tenant_cache = TenantCache()
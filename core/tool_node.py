@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, ToolCall, ToolMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import ensure_config, get_executor_for_config
+from langchain_core.tools import BaseTool
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+# Máximo de herramientas ejecutándose a la vez dentro de un mismo paso del agente.
+TOOL_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "4"))
+
+
+def _str_output(output: Any) -> str:
+    """Contenido del ToolMessage: el texto tal cual, o el resultado serializado como JSON."""
+    if isinstance(output, str):
+        return output
+    try:
+        return json.dumps(output, ensure_ascii=False)
+    except Exception:
+        return str(output)
+
+
+class ParallelToolNode(Runnable):
+    """
+    Nodo de herramientas que ejecuta en paralelo las llamadas independientes de un mismo
+    paso del agente, en un pool de hilos acotado. Recibe el estado del grafo (o la lista de
+    mensajes) y devuelve un ToolMessage por cada llamada del último AIMessage; solo usa la
+    interfaz pública de Runnable, así que no depende del ToolNode interno de LangGraph.
+
+    Las llamadas a herramientas de `serialized_tools` (las que leen o modifican el carrito)
+    se agrupan por `user_id` y se ejecutan en orden dentro de su grupo, para que, por ejemplo,
+    "agregar" y "pagar" del mismo usuario no se crucen. Los resultados se devuelven siempre en
+    el orden en que el modelo pidió las llamadas, y un error en una herramienta se informa al
+    modelo como resultado de esa llamada sin cancelar las demás.
+    """
+    def __init__(
+        self,
+        tools: Sequence[BaseTool],
+        *,
+        serialized_tools: Iterable[str] = (),
+        max_concurrency: int = TOOL_MAX_CONCURRENCY,
+        name: str = "tools",
+    ):
+        self.name = name
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.serialized_tools = set(serialized_tools)
+        self.max_concurrency = max_concurrency
+
+    def _group_key(self, position: int, call: ToolCall) -> Tuple[Any, ...]:
+        """Las llamadas con la misma clave se ejecutan en serie; el resto es independiente."""
+        if call["name"] in self.serialized_tools:
+            return ("serialized", call["args"].get("user_id"))
+        return ("independent", position)
+
+    def _run_call(self, call: ToolCall, config: RunnableConfig) -> ToolMessage:
+        started = time.monotonic()
+        tool = self.tools_by_name.get(call["name"])
+        try:
+            if tool is None:
+                raise ValueError(f"Herramienta desconocida: {call['name']}")
+            content = _str_output(tool.invoke(call["args"], config))
+            status = "ok"
+        except Exception as e:
+            logger.error(f"Error al ejecutar la herramienta {call['name']}: {e}", exc_info=True)
+            content = f"Error al ejecutar la herramienta {call['name']}: {e}"
+            status = "error"
+        metrics.observe("tool_call_seconds", time.monotonic() - started, tool=call["name"], status=status)
+        metrics.inc("tool_calls_total", tool=call["name"], status=status)
+        return ToolMessage(content=content, name=call["name"], tool_call_id=call["id"])
+
+    def _run_group(self, group: List[Tuple[int, ToolCall]], config: RunnableConfig) -> List[Tuple[int, ToolMessage]]:
+        return [(position, self._run_call(call, config)) for position, call in group]
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None) -> Any:
+        # Las herramientas del proyecto son síncronas: ainvoke (heredado de Runnable) corre este
+        # mismo método en el pool de hilos.
+        config = ensure_config(config)
+        if isinstance(input, list):
+            output_type = "list"
+            message = input[-1]
+        elif messages := input.get("messages", []):
+            output_type = "dict"
+            message = messages[-1]
+        else:
+            raise ValueError("No message found in input")
+
+        if not isinstance(message, AIMessage):
+            raise ValueError("Last message is not an AIMessage")
+
+        started = time.monotonic()
+        groups: Dict[Tuple[Any, ...], List[Tuple[int, ToolCall]]] = {}
+        for position, call in enumerate(message.tool_calls):
+            groups.setdefault(self._group_key(position, call), []).append((position, call))
+
+        outputs: List[Optional[ToolMessage]] = [None] * len(message.tool_calls)
+        if len(groups) <= 1:
+            for group in groups.values():
+                for position, result in self._run_group(group, config):
+                    outputs[position] = result
+        else:
+            # El executor de LangChain copia el contexto (callbacks, contextvars) a cada hilo.
+            executor_config = {**config, "max_concurrency": self.max_concurrency}
+            with get_executor_for_config(executor_config) as executor:
+                futures = [executor.submit(self._run_group, group, config) for group in groups.values()]
+                for future in futures:
+                    for position, result in future.result():
+                        outputs[position] = result
+
+        metrics.observe("stage_seconds", time.monotonic() - started, stage="tools")
+        if output_type == "list":
+            return outputs
+        return {"messages": outputs}
@@ -1,64 +1,142 @@
+import hashlib
 import logging
 import os
 import json
+import uuid
 import redis
+from typing import Any, Dict, List
 from langchain_core.tools import tool
+from core import metrics
+from core.catalog import ProductCatalog, catalog
 from core.rag_manager import RAGManager
-from services.payment_manager import create_payment_link
+from core.redis_pool import get_redis
+from core.startup import resource
+from core.tenants import get_tenant, tenant_cache, tenant_key
+from services.payment_manager import PAYMENT_LINK_TTL_SECONDS, create_payment_link
 from services.whatsapp_client import send_message
 
-redis_client = redis.from_url(os.getenv("REDIS_URL", "redis://redis:6379"))
+redis_client = get_redis()
+
+# Segundos de inactividad tras los cuales se descarta un carrito abandonado (0 = nunca).
+CART_TTL_SECONDS = int(os.getenv("CART_TTL_SECONDS", "0"))
+
+# El carrito es un hash de Redis con dos campos por producto (nombre oficial):
+# "q:<nombre>" con la cantidad y "p:<nombre>" con el precio unitario.
+_QTY_PREFIX = "q:"
+_PRICE_PREFIX = "p:"
+
+def _cart_key(user_id: str) -> str:
+    """Genera la clave de Redis del carrito de un usuario."""
+    return tenant_key(f"cart:{user_id}")
+
+def _migrate_legacy_cart(user_id: str):
+    """Convierte un carrito guardado con el formato anterior (lista JSON en un string) a hash."""
+    key = _cart_key(user_id)
+    cart_json = redis_client.get(key)
+    legacy_items = json.loads(cart_json) if cart_json else []
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(key)
+    for item in legacy_items:
+        product = current_catalog().lookup(item['item_name'], fuzzy=False)
+        name = product.name if product else item['item_name']
+        pipe.hincrby(key, _QTY_PREFIX + name, item['quantity'])
+        pipe.hset(key, _PRICE_PREFIX + name, item.get('price', 0))
+    pipe.execute()
+    logging.info("Carrito de %s migrado al formato hash.", user_id)
+
+def _with_legacy_migration(user_id: str, operation):
+    """Ejecuta una operación sobre el carrito, migrándolo antes si aún tiene el formato anterior."""
+    try:
+        return operation()
+    except redis.exceptions.ResponseError as e:
+        if "WRONGTYPE" not in str(e):
+            raise
+        _migrate_legacy_cart(user_id)
+        return operation()
 
 def _get_cart(user_id: str) -> list:
-    """Recupera el carrito de un usuario desde Redis."""
-    cart_json = redis_client.get(f"cart:{user_id}")
-    return json.loads(cart_json) if cart_json else []
+    """Recupera el carrito de un usuario desde Redis en un solo round trip (HGETALL)."""
+    raw = _with_legacy_migration(user_id, lambda: redis_client.hgetall(_cart_key(user_id)))
+    items = []
+    for field, value in raw.items():
+        if field.startswith(_QTY_PREFIX):
+            name = field[len(_QTY_PREFIX):]
+            items.append({"item_name": name, "quantity": int(value), "price": int(raw.get(_PRICE_PREFIX + name, 0))})
+    return sorted(items, key=lambda item: item['item_name'])
+
+def _add_to_cart(user_id: str, entries: list) -> list:
+    """
+    Suma cantidades al carrito de forma atómica (MULTI con HINCRBY) en un solo round trip.
+    `entries` es una lista de tuplas (Product, cantidad); devuelve la cantidad total resultante de cada una.
+    """
+    key = _cart_key(user_id)
 
-def _save_cart(user_id: str, cart: list):
-    """Guarda el carrito de un usuario en Redis."""
-    redis_client.set(f"cart:{user_id}", json.dumps(cart))
+    def operation():
+        pipe = redis_client.pipeline(transaction=True)
+        for product, quantity in entries:
+            pipe.hincrby(key, _QTY_PREFIX + product.name, quantity)
+            pipe.hset(key, _PRICE_PREFIX + product.name, product.price)
+        if CART_TTL_SECONDS:
+            pipe.expire(key, CART_TTL_SECONDS)
+        return pipe.execute()
+
+    results = _with_legacy_migration(user_id, operation)
+    return [results[2 * i] for i in range(len(entries))]
 
 def _delete_cart(user_id: str):
     """Elimina el carrito de un usuario de Redis."""
-    redis_client.delete(f"cart:{user_id}")
+    redis_client.delete(_cart_key(user_id))
 
 # --- RAG Manager --- 
-rag_manager = RAGManager()
-rag_manager.load_vector_store()
+def _load_knowledge_base() -> RAGManager:
+    """Abre el índice vectorial. Se ejecuta una vez por worker, al arrancar o en la primera consulta."""
+    manager = RAGManager()
+    if not manager.load_vector_store():
+        raise RuntimeError("No se pudo cargar el índice de la base de conocimientos.")
+    return manager
 
-def _get_product_price(item_name: str) -> int:
-    """Busca el precio de un producto en products.json por su nombre o alias."""
-    try:
-        with open('data/products.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        normalized_item_name = item_name.lower().strip()
-        
-        for product in data['productos']:
-            if normalized_item_name == product['nombre_oficial'].lower():
-                return product['precio']
-            for alias in product.get('alias', []):
-                if normalized_item_name == alias.lower():
-                    return product['precio']
-        
-        logging.warning(f"Producto '{item_name}' no encontrado en products.json")
-        return 0
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logging.error(f"Error al leer o procesar products.json: {e}")
-        return 0
+knowledge_base = resource("knowledge_base", _load_knowledge_base, check=lambda manager: manager.is_loaded)
+
+# Lo que recibe el agente si el local todavía no tiene índice publicado.
+KB_NOT_READY_NOTE = ("La base de conocimientos de este local todavía se está preparando. Responde con lo que "
+                     "sepas del catálogo y avisa al cliente que la información detallada estará disponible en unos minutos.")
+
+def current_knowledge_base() -> RAGManager:
+    """Base de conocimientos del local en curso (ver core/tenants.py)."""
+    tenant = get_tenant()
+    return knowledge_base.get() if tenant.is_default else tenant_cache.get(tenant).knowledge_base
+
+def current_catalog() -> ProductCatalog:
+    """Catálogo de productos del local en curso."""
+    tenant = get_tenant()
+    return catalog if tenant.is_default else tenant_cache.get(tenant).catalog
 
 @tool
 def get_knowledge_base_response(user_query: str) -> str:
     """Consulta la base de conocimientos para obtener contexto y responder preguntas del usuario.
-    Úsala para obtener información sobre el menú, horarios, o cualquier dato sobre La Semilla Café.
+    Úsala para obtener información sobre el menú, horarios, o cualquier dato sobre el local.
     Devuelve el texto relevante encontrado, que el agente usará para construir la respuesta final.
     """
-    logging.info(f"Ejecutando get_knowledge_base_response con la consulta: {user_query}")
+    logging.info("Ejecutando get_knowledge_base_response (%d caracteres).", len(user_query))
+    logging.debug("Consulta a la base de conocimientos: %r", user_query)
     try:
-        retriever = rag_manager.get_retriever()
-        relevant_docs = retriever.invoke(user_query)
-        context = "\n\n---\n\n".join([doc.page_content for doc in relevant_docs])
-        
+        manager = current_knowledge_base()
+        if manager.is_loaded:
+            relevant_docs = manager.get_retriever().invoke(user_query)
+            context = "\n\n---\n\n".join([doc.page_content for doc in relevant_docs])
+        else:
+            # Local sin índice publicado todavía (el build corre en segundo plano): se responde sin él.
+            metrics.inc("kb_not_ready_total", tenant=get_tenant().id)
+            context = ""
+
+        # Los precios del catálogo son la fuente de verdad para los productos mencionados.
+        mentioned = current_catalog().find_mentions(user_query)
+        if mentioned:
+            prices = "\n".join(f"- {product.name}: ${product.price}" for product in mentioned)
+            context = f"{context}\n\n---\n\nPrecios vigentes del catálogo:\n{prices}" if context else f"Precios vigentes del catálogo:\n{prices}"
+
+        if not manager.is_loaded:
+            return f"{KB_NOT_READY_NOTE}\n\n{context}" if context else KB_NOT_READY_NOTE
         if not context:
             return "No encontré información relevante sobre eso en mi base de conocimientos."
         
@@ -67,35 +145,77 @@ def get_knowledge_base_response(user_query: str) -> str:
         logging.error(f"Error en get_knowledge_base_response: {e}")
         return "Ocurrió un error al consultar la base de conocimientos."
 
+def _options(products: list) -> str:
+    """'A, B o C' con los nombres oficiales de los productos."""
+    names = [product.name for product in products]
+    return names[0] if len(names) == 1 else f"{', '.join(names[:-1])} o {names[-1]}"
+
 @tool
 def add_item_to_cart(user_id: str, item_name: str, quantity: int) -> str:
     """Añade un producto con su cantidad al carrito de compras del usuario.
     Usa esta herramienta cuando el usuario pida explícitamente agregar algo a su pedido.
     """
-    logging.info(f"Añadiendo {quantity} de '{item_name}' al carrito de {user_id}")
+    logging.info("Añadiendo %s de '%s' al carrito de %s", quantity, item_name, user_id)
 
-    price = _get_product_price(item_name)
-    if price == 0:
+    products = current_catalog().matches(item_name)
+    if not products:
+        logging.warning("Producto '%s' no encontrado en el catálogo", item_name)
         return f"Lo siento, no encontré el producto '{item_name}'. ¿Podrías verificar el nombre e intentarlo de nuevo?"
+    if len(products) > 1:
+        # No se elige por el cliente: el agente debe preguntarle cuál de las opciones quiere.
+        return f"'{item_name}' puede ser cualquiera de estos productos: {_options(products)}. ¿Cuál quieres agregar?"
+    product = products[0]
 
-    cart = _get_cart(user_id)
+    if quantity <= 0:
+        return "La cantidad debe ser mayor que cero."
 
-    for item in cart:
-        if item['item_name'].lower() == item_name.lower().strip():
-            item['quantity'] += quantity
-            _save_cart(user_id, cart)
-            return f"{quantity} x {item_name} más añadido(s). Ahora tienes {item['quantity']} en total."
+    # El carrito se indexa por el nombre oficial para que los alias no generen líneas duplicadas.
+    total_quantity = _add_to_cart(user_id, [(product, quantity)])[0]
+    if total_quantity > quantity:
+        return f"{quantity} x {product.name} más añadido(s). Ahora tienes {total_quantity} en total."
+    return f"{quantity} x {product.name} ha(n) sido añadido(s) a tu carrito."
 
-    cart.append({"item_name": item_name, "quantity": quantity, "price": price})
-    _save_cart(user_id, cart)
-    return f"{quantity} x {item_name} ha(n) sido añadido(s) a tu carrito."
+@tool
+def add_items_to_cart(user_id: str, items: List[Dict[str, Any]]) -> str:
+    """Añade varios productos al carrito del usuario en una sola operación.
+    Cada elemento de `items` debe tener las claves 'item_name' y 'quantity'.
+    Usa esta herramienta cuando el usuario pida agregar más de un producto distinto en el mismo mensaje.
+    """
+    logging.info("Añadiendo %d productos al carrito de %s", len(items), user_id)
+
+    entries = []
+    not_found = []
+    ambiguous = []
+    for item in items:
+        item_name = str(item.get('item_name', ''))
+        quantity = int(item.get('quantity', 1))
+        products = current_catalog().matches(item_name)
+        if not products or quantity <= 0:
+            not_found.append(item_name)
+            continue
+        if len(products) > 1:
+            ambiguous.append(f"'{item_name}' ({_options(products)})")
+            continue
+        entries.append((products[0], quantity))
+
+    response_lines = []
+    if entries:
+        totals = _add_to_cart(user_id, entries)
+        for (product, quantity), total_quantity in zip(entries, totals):
+            response_lines.append(f"- {quantity} x {product.name} (total en el carrito: {total_quantity})")
+        response_lines.insert(0, "Añadí a tu carrito:")
+    if not_found:
+        response_lines.append(f"No encontré estos productos o la cantidad no es válida: {', '.join(not_found)}.")
+    if ambiguous:
+        response_lines.append(f"No agregué estos porque hay más de una opción: {'; '.join(ambiguous)}. ¿Cuál quieres?")
+    return "\n".join(response_lines)
 
 @tool
 def view_cart(user_id: str) -> str:
     """Muestra el contenido actual del carrito de compras del usuario, incluyendo productos, cantidades y subtotal.
     Usa esta herramienta si el usuario pregunta qué hay en su carrito o cuál es el total hasta ahora.
     """
-    logging.info(f"Mostrando carrito para {user_id}")
+    logging.info("Mostrando carrito para %s", user_id)
     cart_items = _get_cart(user_id)
     if not cart_items:
         return "Tu carrito está vacío."
@@ -111,28 +231,81 @@ def view_cart(user_id: str) -> str:
     response_lines.append(f"\nTotal: ${total}")
     return "\n".join(response_lines)
 
+def _cart_fingerprint(user_id: str, cart_items: list) -> str:
+    """Huella estable del contenido del carrito: mismo usuario, productos, cantidades y precios."""
+    canonical = json.dumps([user_id, [[i['item_name'], i['quantity'], i.get('price', 0)] for i in cart_items]], ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _pending_order_key(user_id: str) -> str:
+    """Hash con el pedido en curso del usuario: id, huella del carrito y, una vez creado, el link."""
+    return tenant_key(f"order:pending:{user_id}")
+
+def _delivered_link_key(user_id: str) -> str:
+    """Último link de pago entregado al usuario; vence junto con la preferencia."""
+    return tenant_key(f"order:link:{user_id}")
+
+def _pending_order(user_id: str, fingerprint: str) -> dict:
+    """
+    Devuelve el pedido en curso si corresponde al mismo carrito (un reintento del mismo checkout),
+    o registra uno nuevo con un id único. Un carrito distinto siempre es un pedido distinto.
+    """
+    key = _pending_order_key(user_id)
+    pending = redis_client.hgetall(key)
+    if pending and pending.get("fingerprint") == fingerprint:
+        return pending
+    order = {"id": uuid.uuid4().hex, "fingerprint": fingerprint}
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(key)
+    pipe.hset(key, mapping=order)
+    pipe.expire(key, PAYMENT_LINK_TTL_SECONDS)
+    pipe.execute()
+    return order
+
 @tool
 def checkout(user_id: str) -> str:
     """Finaliza el pedido del usuario, genera un enlace de pago y vacía el carrito.
     Usa esta herramienta SOLO cuando el usuario confirme explícitamente que quiere pagar o finalizar su pedido.
     """
-    logging.info(f"Iniciando checkout para {user_id}")
+    logging.info("Iniciando checkout para %s", user_id)
     cart_items = _get_cart(user_id)
     if not cart_items:
+        # El carrito se vacía al entregar el link: si el usuario vuelve a pedir pagar (o el
+        # mensaje se reprocesa), se reenvía el link vigente en lugar de responder que está vacío.
+        delivered_link = redis_client.get(_delivered_link_key(user_id))
+        if delivered_link:
+            metrics.inc("checkout_total", result="redelivered")
+            return f"Tu pedido ya está listo. Aquí tienes tu enlace de pago: {delivered_link}"
         return "Tu carrito está vacío. No puedes finalizar un pedido sin productos."
 
-    cart_items_for_payment = []
-    for item in cart_items:
-        cart_items_for_payment.append({
-            "title": item['item_name'],
-            "quantity": item['quantity'],
-            "unit_price": item.get('price', 0)
-        })
+    # El pedido se identifica al iniciar el checkout. Solo un reintento del mismo pedido (mismo
+    # carrito, todavía sin vaciar) reutiliza su id y su link; cada pedido nuevo tiene su referencia.
+    order = _pending_order(user_id, _cart_fingerprint(user_id, cart_items))
+    order_key = _pending_order_key(user_id)
+    payment_link = order.get("link")
+    if payment_link:
+        metrics.inc("checkout_total", result="reused")
+    else:
+        cart_items_for_payment = []
+        for item in cart_items:
+            cart_items_for_payment.append({
+                "title": item['item_name'],
+                "quantity": item['quantity'],
+                "unit_price": item.get('price', 0)
+            })
+        external_reference = f"pedido_{order['id']}"
+        payment_link = create_payment_link(cart_items_for_payment, user_id, external_reference)
+        metrics.inc("checkout_total", result="created" if payment_link else "error")
+        if payment_link:
+            # Si algo falla antes de vaciar el carrito, el reintento devuelve este mismo link.
+            redis_client.hset(order_key, "link", payment_link)
 
-    payment_link = create_payment_link(cart_items_for_payment, user_id)
-    
     if payment_link:
-        _delete_cart(user_id)
+        # El pedido queda cerrado: el próximo checkout es un pedido nuevo.
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(_cart_key(user_id))
+        pipe.delete(order_key)
+        pipe.set(_delivered_link_key(user_id), payment_link, ex=PAYMENT_LINK_TTL_SECONDS)
+        pipe.execute()
         return f"Tu pedido está listo. Aquí tienes tu enlace de pago: {payment_link}"
     else:
         return "Tuvimos un problema al generar tu enlace de pago. Por favor, intenta de nuevo."
@@ -142,8 +315,8 @@ def talk_to_human(user_id: str, reason: str) -> str:
     """Transfiere la conversación a un agente humano cuando el usuario lo solicita o tiene un problema complejo.
     Usa esta herramienta si el usuario pide hablar con una persona o si sus preguntas están fuera de tu alcance.
     """
-    logging.info(f"Usuario {user_id} solicita hablar con un humano. Motivo: {reason}")
-    human_contact = os.getenv("HUMAN_CONTACT_NUMBER")
+    logging.info("Usuario %s solicita hablar con un humano. Motivo: %s", user_id, reason)
+    human_contact = get_tenant().human_contact_number
     if human_contact:
         notification_message = f"Atención: Cliente {user_id} necesita ayuda. Motivo: '{reason}'"
         send_message(to=human_contact, body=notification_message)
@@ -0,0 +1,44 @@
+import contextvars
+import logging
+import os
+import uuid
+from typing import Optional
+
+# Agrega un identificador por mensaje a cada línea de log para seguir un turno de punta a punta.
+TRACE_IDS_ENABLED = os.getenv("TRACE_IDS_ENABLED", "true").lower() == "true"
+
+trace_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("trace_id", default="-")
+# Usuario (número de WhatsApp) del mensaje en curso, para filtrar los logs de una conversación.
+user_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("user_id", default="-")
+
+
+def new_trace_id(seed: Optional[str] = None) -> str:
+    """Devuelve un trace ID: el `seed` (p. ej. el MessageSid de Twilio) o uno aleatorio."""
+    return seed or uuid.uuid4().hex[:16]
+
+
+def get_trace_id() -> str:
+    return trace_id_var.get()
+
+
+def set_trace_id(trace_id: Optional[str]) -> contextvars.Token:
+    """Fija el trace ID del contexto actual (hilo o tarea) y devuelve el token para restaurarlo."""
+    return trace_id_var.set(trace_id if TRACE_IDS_ENABLED and trace_id else "-")
+
+
+def set_user_id(user_id: Optional[str]) -> contextvars.Token:
+    """Fija el usuario del contexto actual y devuelve el token para restaurarlo."""
+    return user_id_var.set(user_id or "-")
+
+
+class TraceIdFilter(logging.Filter):
+    """
+    Copia el trace ID y el usuario del contexto a cada registro como `%(trace_id)s` y
+    `%(user_id)s`. Con logging en cola corre en el hilo que loguea; los handlers del hilo
+    de escritura conservan los valores ya copiados.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "trace_id"):
+            record.trace_id = trace_id_var.get()
+            record.user_id = user_id_var.get()
+        return True
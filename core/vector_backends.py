@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# "chroma" (ChromaDB persistente) o "numpy" (matriz float32 en memoria, mapeada desde disco).
+RAG_VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma").lower()
+VECTOR_STORE_DIR = "data/chroma_db"
+VECTOR_INDEX_DIR = "data/vector_index"
+
+
+class ChromaBackend:
+    """Almacena los chunks en una colección persistente de ChromaDB."""
+    def __init__(self, embeddings: Embeddings, directory: str = VECTOR_STORE_DIR):
+        self.embeddings = embeddings
+        self.directory = directory
+        self.vector_store = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.vector_store is not None
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.directory, "chroma.sqlite3"))
+
+    def _open(self):
+        from langchain_community.vectorstores import Chroma
+        return Chroma(persist_directory=self.directory, embedding_function=self.embeddings)
+
+    def load(self):
+        self.vector_store = self._open()
+
+    def existing(self) -> Dict[str, str]:
+        """IDs de los chunks indexados y el archivo de origen de cada uno."""
+        store = self.vector_store or self._open()
+        data = store.get(include=["metadatas"])
+        return dict(zip(data["ids"], [(m or {}).get("source", "") for m in data["metadatas"]]))
+
+    def documents(self) -> List[Document]:
+        """Todos los chunks indexados (para construir el índice léxico)."""
+        store = self.vector_store or self._open()
+        data = store.get(include=["documents", "metadatas"])
+        return [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(data["documents"], data["metadatas"])]
+
+    def apply(self, add_ids: List[str], add_documents: List[Document], remove_ids: List[str]):
+        """Borra y agrega chunks; los nuevos se embeben a través de `self.embeddings`."""
+        store = self.vector_store or self._open()
+        if remove_ids:
+            store.delete(ids=remove_ids)
+        if add_ids:
+            store.add_documents(add_documents, ids=add_ids)
+        self.vector_store = store
+
+    def search_by_vector(self, embedding: List[float], k: int) -> List[Document]:
+        return self.vector_store.similarity_search_by_vector(embedding, k=k)
+
+
+class NumpyBackend:
+    """
+    Índice compacto en proceso: una matriz float32 de embeddings normalizados guardada en
+    `vectors.npy` (leída con memory-map) y los textos en `chunks.json`. La búsqueda es un
+    producto punto vectorizado seguido de un top-k parcial.
+    """
+    def __init__(self, embeddings: Embeddings, directory: str = VECTOR_INDEX_DIR):
+        self.embeddings = embeddings
+        self.directory = directory
+        self.matrix = None
+        self.ids: List[str] = []
+        self.chunks: List[Document] = []
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.directory, "vectors.npy")
+
+    @property
+    def _chunks_path(self) -> str:
+        return os.path.join(self.directory, "chunks.json")
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.matrix is not None
+
+    def exists(self) -> bool:
+        return os.path.exists(self._vectors_path) and os.path.exists(self._chunks_path)
+
+    def load(self):
+        with open(self._chunks_path, "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        self.ids = [chunk["id"] for chunk in chunks]
+        self.chunks = [Document(page_content=chunk["text"], metadata=chunk["metadata"]) for chunk in chunks]
+        self.matrix = np.load(self._vectors_path, mmap_mode="r")
+
+    def existing(self) -> Dict[str, str]:
+        if not self.is_loaded and self.exists():
+            self.load()
+        return {chunk_id: doc.metadata.get("source", "") for chunk_id, doc in zip(self.ids, self.chunks)}
+
+    def documents(self) -> List[Document]:
+        if not self.is_loaded and self.exists():
+            self.load()
+        return list(self.chunks)
+
+    def apply(self, add_ids: List[str], add_documents: List[Document], remove_ids: List[str]):
+        """Reescribe el índice con los cambios y lo reemplaza de forma atómica en disco."""
+        if not self.is_loaded and self.exists():
+            self.load()
+        removed = set(remove_ids)
+        keep = [i for i, chunk_id in enumerate(self.ids) if chunk_id not in removed]
+
+        dim = None
+        parts = []
+        if self.matrix is not None and keep:
+            parts.append(np.asarray(self.matrix[keep], dtype=np.float32))
+            dim = parts[0].shape[1]
+        if add_documents:
+            new_vectors = np.asarray(self.embeddings.embed_documents([d.page_content for d in add_documents]), dtype=np.float32)
+            norms = np.linalg.norm(new_vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            parts.append(new_vectors / norms)
+            dim = new_vectors.shape[1]
+        matrix = np.concatenate(parts) if parts else np.zeros((0, dim or 1), dtype=np.float32)
+
+        ids = [self.ids[i] for i in keep] + list(add_ids)
+        documents = [self.chunks[i] for i in keep] + list(add_documents)
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_vectors = self._vectors_path + ".tmp.npy"
+        tmp_chunks = self._chunks_path + ".tmp"
+        np.save(tmp_vectors, matrix)
+        with open(tmp_chunks, "w", encoding="utf-8") as f:
+            json.dump(
+                [{"id": i, "text": d.page_content, "metadata": d.metadata} for i, d in zip(ids, documents)],
+                f, ensure_ascii=False,
+            )
+        os.replace(tmp_vectors, self._vectors_path)
+        os.replace(tmp_chunks, self._chunks_path)
+        self.load()
+
+    def search_by_vector(self, embedding: List[float], k: int) -> List[Document]:
+        if self.matrix is None or not len(self.ids):
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        scores = self.matrix @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.chunks[i] for i in top]
+
+
+def default_directory(kind: str = RAG_VECTOR_BACKEND) -> str:
+    """Directorio raíz por defecto del índice de cada backend."""
+    return VECTOR_INDEX_DIR if kind == "numpy" else VECTOR_STORE_DIR
+
+
+def create_backend(embeddings: Embeddings, kind: str = RAG_VECTOR_BACKEND, directory: Optional[str] = None):
+    """Construye el backend vectorial configurado, opcionalmente en un directorio distinto al por defecto."""
+    if kind == "numpy":
+        return NumpyBackend(embeddings, directory or default_directory(kind))
+    if kind != "chroma":
+        logger.warning(f"Backend vectorial desconocido '{kind}'. Se usará ChromaDB.")
+    return ChromaBackend(embeddings, directory or default_directory(kind))
@@ -1,14 +1,57 @@
+import time
+_boot_started = time.perf_counter()
+
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from api.endpoints import router as api_router
-from core.logging_config import configure_logging
+from fastapi.responses import JSONResponse, PlainTextResponse
+from api.endpoints import router as api_router, kb_reloader, pipeline
+from core.pipeline import WEBHOOK_MODE
+from core import metrics, redis_pool, startup
+from core.logging_config import configure_logging, queue_depth, stop_logging
+from services.whatsapp_client import outbound
+from services.payment_manager import payments
+from core.tools import knowledge_base
 
 configure_logging()
+startup.record_timing("imports", time.perf_counter() - _boot_started)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Arranque y apagado de cada worker. Los clientes y el índice se construyen aquí (después del
+    fork de uvicorn) y en paralelo; con STARTUP_MODE=lazy se construyen en el primer uso.
+    """
+    if startup.STARTUP_MODE == "eager":
+        await asyncio.to_thread(startup.warm_up)
+    logging.info(f"Arranque en frío (ms): {startup.cold_start_report()}")
+    kb_reloader.start()
+    if WEBHOOK_MODE == "queue":
+        await pipeline.start()
+
+    yield
+
+    if pipeline.running:
+        await pipeline.stop()
+    await asyncio.to_thread(kb_reloader.stop)
+    dispatcher = outbound.get() if outbound.loaded else None
+    if dispatcher and dispatcher.running:
+        await asyncio.to_thread(dispatcher.stop)
+    provider = payments.get() if payments.loaded else None
+    if provider:
+        await asyncio.to_thread(provider.close)
+    await redis_pool.aclose_pools()
+    redis_pool.close_pools()
+    stop_logging()
+
 
 app = FastAPI(
     title="Whatsapp Assistant",
     description="Un chatbot de IA para WhatsApp con base de conocimientos propia.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
 )
 
 app.include_router(api_router, prefix="/api/v1")
@@ -19,4 +62,28 @@ def health_check():
     Endpoint de "health check" para verificar que el servidor está funcionando.
     """
     logging.info("Health check endpoint fue invocado.")
-    return {"status": "ok", "message": "Whatsapp Assistant is running!"}
+    return {
+        "status": "ok",
+        "message": "Whatsapp Assistant is running!",
+        "knowledge_base_version": knowledge_base.get().active_version if knowledge_base.loaded else None,
+    }
+
+@app.get("/ready", tags=["Health Check"])
+async def readiness_check():
+    """
+    Readiness: estado de cada dependencia (Redis, base de conocimientos, LLM, Twilio, MercadoPago)
+    y el desglose del arranque en frío. Responde 503 mientras alguna dependencia requerida no esté lista.
+    """
+    report = await asyncio.to_thread(startup.readiness)
+    report["knowledge_base_version"] = knowledge_base.get().active_version if knowledge_base.loaded else None
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/metrics", tags=["Monitoring"], response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Métricas del proceso en formato Prometheus: contadores, gauges e histogramas de latencia
+    por etapa (Redis, recuperación, LLM, herramientas, MercadoPago y Twilio).
+    """
+    redis_pool.pool_stats()
+    queue_depth()
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,306 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Deque, Dict, List, Optional, Protocol, Tuple
+
+from core import metrics
+from core.redis_pool import get_redis
+from core.tracing import get_trace_id, set_trace_id, set_user_id
+
+logger = logging.getLogger(__name__)
+
+# Envíos por segundo permitidos por número de origen y ráfaga máxima acumulable.
+OUTBOUND_RATE_PER_SECOND = float(os.getenv("OUTBOUND_RATE_PER_SECOND", "10"))
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", "20"))
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "4"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "5"))
+OUTBOUND_BACKOFF_SECONDS = float(os.getenv("OUTBOUND_BACKOFF_SECONDS", "0.5"))
+OUTBOUND_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOUND_BACKOFF_MAX_SECONDS", "30"))
+OUTBOUND_DEAD_LETTER_KEY = "outbound:dead_letter"
+OUTBOUND_DEAD_LETTER_MAX = int(os.getenv("OUTBOUND_DEAD_LETTER_MAX", "1000"))
+
+
+class TransportError(Exception):
+    """Error de un transporte de salida. `retryable` indica si vale la pena reintentar."""
+    def __init__(self, message: str, retryable: bool, code: Optional[int] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.code = code
+
+
+class Transport(Protocol):
+    def send(self, from_: str, to: str, body: str) -> str:
+        """Envía un mensaje y devuelve su identificador; lanza TransportError si falla."""
+
+
+class TokenBucket:
+    """Limitador de tasa thread-safe: `rate` tokens por segundo hasta un máximo de `capacity`."""
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Bloquea hasta obtener un token. Devuelve los segundos esperados."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class _Shard:
+    """
+    Estado de un hilo de envío: su cola, los reintentos programados (heap por `next_attempt_at`)
+    y, por destinatario con un reintento pendiente, los mensajes que esperan detrás de él.
+    Solo lo modifica el hilo dueño.
+    """
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue()
+        self.delayed: List[Tuple[float, int, dict]] = []
+        self.held: Dict[str, Deque[dict]] = {}
+        self._sequence = itertools.count()
+
+    def schedule(self, message: dict):
+        heapq.heappush(self.delayed, (message["next_attempt_at"], next(self._sequence), message))
+
+
+class OutboundDispatcher:
+    """
+    Despacha los mensajes salientes en segundo plano. Cada destinatario se asigna siempre al
+    mismo hilo de envío, lo que preserva el orden de sus mensajes; los envíos de cada número de
+    origen pasan por un token bucket. Los errores reintentables (429, 5xx, fallas de red) se
+    reintentan con backoff exponencial sin bloquear el hilo: el mensaje pasa a una cola de
+    demora y, hasta su reintento, solo esperan los mensajes siguientes del mismo destinatario.
+    Los mensajes que no se pudieron entregar terminan en una lista de Redis (dead letter) para
+    revisarlos o reenviarlos.
+    """
+    def __init__(
+        self,
+        transport: Transport,
+        num_workers: int = OUTBOUND_WORKERS,
+        rate: float = OUTBOUND_RATE_PER_SECOND,
+        burst: int = OUTBOUND_BURST,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+        backoff: float = OUTBOUND_BACKOFF_SECONDS,
+        max_backoff: float = OUTBOUND_BACKOFF_MAX_SECONDS,
+        dead_letter_key: str = OUTBOUND_DEAD_LETTER_KEY,
+    ):
+        self.transport = transport
+        self.num_workers = max(1, num_workers)
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.dead_letter_key = dead_letter_key
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._shards: List[_Shard] = []
+        self._threads: List[threading.Thread] = []
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def start(self):
+        with self._lock:
+            self._stopped = False
+            self._start_locked()
+
+    def _start_locked(self):
+        if self._threads:
+            return
+        self._shards = [_Shard() for _ in range(self.num_workers)]
+        for index, shard in enumerate(self._shards):
+            thread = threading.Thread(target=self._worker, args=(shard,), name=f"outbound-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Dispatcher de mensajes salientes iniciado con %d hilos.", self.num_workers)
+
+    def stop(self, timeout: float = 10.0):
+        """Espera a que se envíe lo pendiente (hasta `timeout` segundos) y detiene los hilos."""
+        with self._lock:
+            threads, shards = self._threads, self._shards
+            self._threads, self._shards = [], []
+            self._stopped = True
+        for shard in shards:
+            shard.queue.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        if threads:
+            logger.info("Dispatcher de mensajes salientes detenido.")
+
+    def submit(self, from_: str, to: str, body: str):
+        """Encola un mensaje para `to`. No bloquea. Con el dispatcher detenido va a la dead letter."""
+        message = {"from_": from_, "to": to, "body": body, "enqueued_at": time.time(), "trace_id": get_trace_id()}
+        with self._lock:
+            if not self._stopped:
+                self._start_locked()
+                self._shards[zlib.crc32(to.encode("utf-8")) % len(self._shards)].queue.put(message)
+                return
+        metrics.inc("outbound_messages_total", result="dropped")
+        logger.error("Mensaje a %s recibido con el dispatcher detenido. Se guarda en '%s'.", to, self.dead_letter_key)
+        self._dead_letter(from_, to, body, TransportError("Dispatcher detenido", retryable=False))
+
+    def _bucket(self, from_: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(from_)
+            if bucket is None:
+                bucket = self._buckets[from_] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def _worker(self, shard: _Shard):
+        stopping = False
+        while not (stopping and not shard.delayed):
+            # Primero los reintentos vencidos; después se espera un mensaje nuevo hasta el próximo.
+            while shard.delayed and shard.delayed[0][0] <= time.monotonic():
+                self._process(shard, heapq.heappop(shard.delayed)[2])
+            timeout = max(0.0, shard.delayed[0][0] - time.monotonic()) if shard.delayed else None
+            try:
+                message = shard.queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            if message is None:
+                stopping = True
+                continue
+            metrics.observe("outbound_queue_wait_seconds", time.time() - message["enqueued_at"])
+            waiting = shard.held.get(message["to"])
+            if waiting is not None:
+                # El destinatario tiene un reintento pendiente: este mensaje sale después.
+                waiting.append(message)
+                continue
+            self._process(shard, message)
+
+    def _process(self, shard: _Shard, message: dict):
+        """
+        Intenta enviar `message`. Si queda programado para reintento, el destinatario queda
+        retenido; si se resolvió (enviado o dead letter), siguen los mensajes que lo esperaban.
+        """
+        to = message["to"]
+        while message is not None:
+            set_trace_id(message["trace_id"])
+            set_user_id(to)
+            if not self._attempt(message):
+                shard.held.setdefault(to, deque())
+                shard.schedule(message)
+                return
+            waiting = shard.held.get(to)
+            message = waiting.popleft() if waiting else None
+            if message is None:
+                shard.held.pop(to, None)
+
+    def _attempt(self, message: dict) -> bool:
+        """Un intento de envío desde el dispatcher. False si se programó un reintento."""
+        from_, to, body = message["from_"], message["to"], message["body"]
+        attempt = message.get("attempt", 0)
+        try:
+            self._send(from_, to, body)
+            return True
+        except TransportError as e:
+            if not self._should_retry(e, attempt):
+                self._fail(from_, to, body, e)
+                return True
+            delay = self._delay(attempt)
+            message["attempt"] = attempt + 1
+            message["next_attempt_at"] = time.monotonic() + delay
+            logger.warning("Envío a %s fallido (%s); reintento %d en %.1fs.", to, e, attempt + 1, delay)
+            return False
+        except Exception as e:
+            logger.error("Error inesperado en el dispatcher al enviar a %s: %s", to, e, exc_info=True)
+            return True
+
+    def _send(self, from_: str, to: str, body: str) -> str:
+        """Un envío respetando el rate limit del número de origen. Lanza TransportError si falla."""
+        throttled = self._bucket(from_).acquire()
+        if throttled:
+            metrics.observe("outbound_throttled_seconds", throttled)
+        try:
+            with metrics.span("twilio_send"):
+                sid = self.transport.send(from_, to, body)
+        except TransportError:
+            metrics.inc("outbound_attempts_total", result="error")
+            raise
+        metrics.inc("outbound_attempts_total", result="ok")
+        metrics.inc("outbound_messages_total", result="sent")
+        logger.info("Mensaje enviado a %s con SID: %s", to, sid)
+        return sid
+
+    def _should_retry(self, error: TransportError, attempt: int) -> bool:
+        return error.retryable and attempt < self.max_retries
+
+    def _delay(self, attempt: int) -> float:
+        return min(self.max_backoff, self.backoff * 2 ** attempt)
+
+    def _fail(self, from_: str, to: str, body: str, error: Optional[TransportError]):
+        metrics.inc("outbound_messages_total", result="dead_letter")
+        logger.error("No se pudo entregar el mensaje a %s: %s. Se guarda en '%s'.", to, error, self.dead_letter_key)
+        self._dead_letter(from_, to, body, error)
+
+    def deliver(self, from_: str, to: str, body: str) -> Optional[str]:
+        """
+        Envía un mensaje en el hilo que llama (OUTBOUND_ASYNC=false), respetando el rate limit y
+        con reintentos: acá el backoff sí espera, porque solo bloquea a quien envía. Devuelve el SID o None.
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._send(from_, to, body)
+            except TransportError as e:
+                error = e
+                if not self._should_retry(e, attempt):
+                    break
+                delay = self._delay(attempt)
+                logger.warning("Envío a %s fallido (%s); reintento %d en %.1fs.", to, e, attempt + 1, delay)
+                time.sleep(delay)
+        self._fail(from_, to, body, error)
+        return None
+
+    def _dead_letter(self, from_: str, to: str, body: str, error: Optional[TransportError]):
+        entry = json.dumps({
+            "from": from_,
+            "to": to,
+            "body": body,
+            "error": str(error),
+            "code": getattr(error, "code", None),
+            "failed_at": time.time(),
+        }, ensure_ascii=False)
+        try:
+            with get_redis().pipeline(transaction=False) as pipe:
+                pipe.rpush(self.dead_letter_key, entry)
+                pipe.ltrim(self.dead_letter_key, -OUTBOUND_DEAD_LETTER_MAX, -1)
+                pipe.execute()
+        except Exception as e:
+            logger.error(f"No se pudo guardar el mensaje en la dead letter de Redis: {e}")
+
+    def stats(self) -> dict:
+        shards = list(self._shards)
+        pending = sum(shard.queue.qsize() + sum(len(w) for w in list(shard.held.values())) for shard in shards)
+        retrying = sum(len(shard.delayed) for shard in shards)
+        metrics.set_gauge("outbound_queue_depth", pending)
+        metrics.set_gauge("outbound_retrying", retrying)
+        return {
+            "running": self.running,
+            "workers": self.num_workers,
+            "pending": pending,
+            "retrying": retrying,
+            "rate_per_second": self.rate,
+        }
@@ -1,54 +1,138 @@
 import os
 import logging
-import mercadopago
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Protocol
+
+import httpx
+
+from core import metrics
+from core.startup import resource
 
 MERCADOPAGO_ACCESS_TOKEN = os.getenv("MERCADOPAGO_ACCESS_TOKEN")
+# "mercadopago" (API REST) o "fake" (links locales, sin red; para pruebas y mediciones de carga).
+PAYMENT_PROVIDER = os.getenv("PAYMENT_PROVIDER", "mercadopago").lower()
+MERCADOPAGO_API_URL = os.getenv("MERCADOPAGO_API_URL", "https://api.mercadopago.com")
+PAYMENT_TIMEOUT_SECONDS = float(os.getenv("PAYMENT_TIMEOUT_SECONDS", "8"))
+PAYMENT_MAX_RETRIES = int(os.getenv("PAYMENT_MAX_RETRIES", "2"))
+# Vigencia de cada link de pago y del pedido en curso que lo generó.
+PAYMENT_LINK_TTL_SECONDS = int(os.getenv("PAYMENT_LINK_TTL_SECONDS", "3600"))
 
-sdk = None
-if MERCADOPAGO_ACCESS_TOKEN:
-    try:
-        sdk = mercadopago.SDK(MERCADOPAGO_ACCESS_TOKEN)
-        logging.info("SDK de MercadoPago inicializado correctamente.")
-    except Exception as e:
-        logging.error(f"Error al inicializar el SDK de MercadoPago: {e}")
-else:
-    logging.warning("La credencial MERCADOPAGO_ACCESS_TOKEN no está configurada. La creación de pagos está deshabilitada.")
 
-def create_payment_link(cart_items: list, user_id: str) -> str | None:
+class PaymentProvider(Protocol):
+    def create_preference(self, cart_items: list, user_id: str, external_reference: str, expires_at: datetime) -> Optional[str]:
+        """Crea una preferencia de pago y devuelve su link, o None si falla."""
+
+
+class MercadoPagoProvider:
+    """
+    Crea preferencias con la API REST de MercadoPago sobre un httpx.Client con conexiones
+    reutilizables y timeout acotado. Los errores transitorios (429, 5xx, red) se reintentan con
+    backoff, y `external_reference` viaja como X-Idempotency-Key para que un reintento no cree
+    una segunda preferencia. El cliente es thread-safe: lo comparten los hilos que ejecutan herramientas.
+    """
+    def __init__(self, access_token: str, base_url: str = MERCADOPAGO_API_URL,
+                 timeout: float = PAYMENT_TIMEOUT_SECONDS, max_retries: int = PAYMENT_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.client = httpx.Client(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+
+    def _create(self, payload: dict, idempotency_key: str) -> dict:
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.client.post(
+                    "/checkout/preferences", json=payload, headers={"X-Idempotency-Key": idempotency_key},
+                )
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response.json()
+                error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                error = str(e) or type(e).__name__
+            if attempt < self.max_retries:
+                delay = 0.5 * 2 ** attempt
+                logging.warning(f"MercadoPago no respondió ({error}); reintento {attempt + 1} en {delay:.1f}s.")
+                time.sleep(delay)
+        raise RuntimeError(f"MercadoPago no respondió tras {self.max_retries + 1} intentos: {error}")
+
+    def create_preference(self, cart_items: list, user_id: str, external_reference: str, expires_at: datetime) -> Optional[str]:
+        payload = {
+            "items": cart_items,
+            "payer": {"name": user_id},
+            "auto_return": "approved", # Redirige automáticamente al cliente tras el pago
+            "external_reference": external_reference,
+            "expires": True,
+            "expiration_date_to": expires_at.isoformat(timespec="milliseconds"),
+        }
+        preference = self._create(payload, external_reference)
+        return preference["init_point"]
+
+    def close(self):
+        self.client.close()
+
+
+class FakePaymentProvider:
+    """Genera links locales y registra las preferencias creadas, sin llamar a MercadoPago."""
+    def __init__(self):
+        self.preferences: List[dict] = []
+
+    def create_preference(self, cart_items: list, user_id: str, external_reference: str, expires_at: datetime) -> Optional[str]:
+        self.preferences.append({"items": cart_items, "user_id": user_id, "external_reference": external_reference})
+        return f"https://pagos.local/checkout/{external_reference}"
+
+    def close(self):
+        pass
+
+
+def build_provider(kind: str = PAYMENT_PROVIDER):
+    """Construye el proveedor de pagos configurado, o None si MercadoPago no tiene credenciales."""
+    if kind == "fake":
+        return FakePaymentProvider()
+    if not MERCADOPAGO_ACCESS_TOKEN:
+        logging.warning("La credencial MERCADOPAGO_ACCESS_TOKEN no está configurada. La creación de pagos está deshabilitada.")
+        return None
+    logging.info("Proveedor de pagos de MercadoPago inicializado correctamente.")
+    return MercadoPagoProvider(MERCADOPAGO_ACCESS_TOKEN)
+
+
+payments = resource("payments", build_provider, required=False)
+
+
+def create_payment_link(cart_items: list, user_id: str, external_reference: str,
+                        expires_in: int = PAYMENT_LINK_TTL_SECONDS) -> str | None:
     """
-    Crea una preferencia de pago en MercadoPago y devuelve el link de pago.
+    Crea una preferencia de pago y devuelve el link de pago.
 
     Args:
         cart_items (list): Una lista de diccionarios, donde cada diccionario representa un item.
                            Ej: [{'title': 'Brownie', 'quantity': 2, 'unit_price': 50}]
         user_id (str): El identificador del usuario para asociarlo al pago.
+        external_reference (str): Referencia única del pedido en nuestro sistema; un reintento del
+                                  mismo pedido la repite y no genera una preferencia duplicada.
+        expires_in (int): Segundos de vigencia de la preferencia.
 
     Returns:
         str | None: La URL de pago (init_point) si es exitoso, o None si falla.
     """
-    if not sdk:
-        logging.error("Intento de crear un pago fallido: el SDK de MercadoPago no está inicializado.")
+    provider = payments.get()
+    if not provider:
+        logging.error("Intento de crear un pago fallido: el proveedor de pagos no está inicializado.")
         return None
 
     try:
-        preference_data = {
-            "items": cart_items,
-            "payer": {
-                "name": user_id
-            },
-            "auto_return": "approved", # Redirige automáticamente al cliente tras el pago
-            "external_reference": f"pedido_{user_id}_{os.urandom(4).hex()}" # Referencia única para nuestro sistema
-        }
-
-        logging.info(f"Creando preferencia de pago para {user_id} con items: {cart_items}")
-        preference_response = sdk.preference().create(preference_data)
-        preference = preference_response["response"]
-
-        payment_link = preference["init_point"]
-        logging.info(f"Link de pago generado para {user_id}: {payment_link}")
-        
+        logging.info("Creando preferencia de pago %s para %s (%d productos).", external_reference, user_id, len(cart_items))
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+        with metrics.span("payment_provider"):
+            payment_link = provider.create_preference(cart_items, user_id, external_reference, expires_at)
+        metrics.inc("payment_preferences_total", result="created")
+        logging.info("Link de pago generado para %s: %s", user_id, payment_link)
         return payment_link
 
     except Exception as e:
-        logging.error(f"Error al crear la preferencia de pago en MercadoPago para {user_id}: {e}", exc_info=True)
+        metrics.inc("payment_preferences_total", result="error")
+        logging.error(f"Error al crear la preferencia de pago para {user_id}: {e}", exc_info=True)
         return None
@@ -1,45 +1,130 @@
 import os
 import logging
+import threading
+from typing import List, Optional, Tuple
 from twilio.rest import Client
 from twilio.base.exceptions import TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
+from requests.exceptions import RequestException
+from core.startup import resource
+from core.tenants import get_tenant
+from services.outbound import OutboundDispatcher, TransportError
 
 ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER")
+# "twilio" o "fake" (guarda los mensajes en memoria; para pruebas y desarrollo local).
+WHATSAPP_TRANSPORT = os.getenv("WHATSAPP_TRANSPORT", "twilio").lower()
+# "true": send_message encola y vuelve de inmediato; "false": envía en el hilo que llama.
+OUTBOUND_ASYNC = os.getenv("OUTBOUND_ASYNC", "true").lower() == "true"
+TWILIO_HTTP_TIMEOUT = float(os.getenv("TWILIO_HTTP_TIMEOUT", "10"))
 
-try:
-    if ACCOUNT_SID and AUTH_TOKEN:
-        client = Client(ACCOUNT_SID, AUTH_TOKEN)
-    else:
-        client = None
+# Códigos de Twilio que indican un límite transitorio y pueden reintentarse.
+RETRYABLE_TWILIO_CODES = {20429}
+# Longitud máxima del cuerpo de un mensaje de WhatsApp aceptada por Twilio.
+WHATSAPP_MAX_LENGTH = 1600
+
+
+def split_message(body: str, limit: int = WHATSAPP_MAX_LENGTH) -> list[str]:
+    """
+    Divide un texto en partes de hasta `limit` caracteres, cortando preferentemente
+    entre párrafos, luego entre oraciones y por último entre palabras.
+    """
+    parts = []
+    remaining = body.strip()
+    while len(remaining) > limit:
+        window = remaining[:limit]
+        cut = -1
+        for separator in ("\n\n", "\n", ". ", "! ", "? ", " "):
+            index = window.rfind(separator)
+            if index > limit // 2:
+                cut = index + len(separator)
+                break
+        if cut == -1:
+            cut = limit
+        parts.append(remaining[:cut].strip())
+        remaining = remaining[cut:].strip()
+    if remaining:
+        parts.append(remaining)
+    return parts
+
+
+class TwilioTransport:
+    """Envía mensajes con la API REST de Twilio reutilizando conexiones HTTP (keep-alive)."""
+    def __init__(self, account_sid: str, auth_token: str, timeout: float = TWILIO_HTTP_TIMEOUT):
+        self.client = Client(account_sid, auth_token, http_client=TwilioHttpClient(pool_connections=True, timeout=timeout))
+
+    def send(self, from_: str, to: str, body: str) -> str:
+        try:
+            return self.client.messages.create(from_=from_, body=body, to=to).sid
+        except TwilioRestException as e:
+            if e.code == 63038:
+                logging.error(
+                    "Error de Twilio: Límite de mensajes de la cuenta de prueba superado. "
+                    "Para seguir enviando mensajes, actualiza tu cuenta de Twilio a una versión de pago."
+                )
+            retryable = e.status == 429 or e.status >= 500 or e.code in RETRYABLE_TWILIO_CODES
+            raise TransportError(f"Error de la API de Twilio ({e.status}/{e.code}): {e.msg}", retryable, e.code) from e
+        except RequestException as e:
+            raise TransportError(f"Error de red al contactar a Twilio: {e}", retryable=True) from e
+
+
+class FakeTransport:
+    """
+    Transporte local que guarda los mensajes en memoria en lugar de enviarlos.
+    `failures` permite simular errores: se lanzan en orden antes de aceptar envíos.
+    """
+    def __init__(self, failures: Optional[List[TransportError]] = None):
+        self.sent: List[Tuple[str, str, str]] = []
+        self.failures = list(failures or [])
+        self._lock = threading.Lock()
+
+    def send(self, from_: str, to: str, body: str) -> str:
+        with self._lock:
+            if self.failures:
+                raise self.failures.pop(0)
+            self.sent.append((from_, to, body))
+            return f"FAKE{len(self.sent):08d}"
+
+
+def build_transport(kind: str = WHATSAPP_TRANSPORT):
+    """Construye el transporte configurado, o None si Twilio no tiene credenciales."""
+    if kind == "fake":
+        return FakeTransport()
+    if not (ACCOUNT_SID and AUTH_TOKEN):
         logging.warning("Las credenciales de Twilio (ACCOUNT_SID, AUTH_TOKEN) no están configuradas. El envío de mensajes está deshabilitado.")
-except Exception as e:
-    client = None
-    logging.error(f"Error al inicializar el cliente de Twilio: {e}")
+        return None
+    try:
+        return TwilioTransport(ACCOUNT_SID, AUTH_TOKEN)
+    except Exception as e:
+        logging.error(f"Error al inicializar el cliente de Twilio: {e}")
+        return None
+
+
+def _build_dispatcher() -> Optional[OutboundDispatcher]:
+    transport = build_transport()
+    return OutboundDispatcher(transport) if transport else None
 
-def send_message(to: str, body: str):
+
+# El cliente HTTP de Twilio se crea por worker, después del fork, y no al importar.
+outbound = resource("whatsapp", _build_dispatcher, required=False)
+
+
+def send_message(to: str, body: str, from_: Optional[str] = None):
     """
-    Envía un mensaje de WhatsApp utilizando la API de Twilio.
+    Envía un mensaje de WhatsApp. Los textos largos se dividen en varios mensajes dentro del
+    límite de WhatsApp. Con OUTBOUND_ASYNC el envío lo hace el dispatcher en segundo plano
+    (con rate limit, reintentos y dead letter); si no, se hace en el hilo actual con la misma política.
+    Sin `from_` se envía desde el número del local en curso (TWILIO_WHATSAPP_NUMBER por defecto).
     """
-    if not client or not TWILIO_NUMBER:
+    from_ = from_ or get_tenant().whatsapp_number or TWILIO_NUMBER
+    dispatcher = outbound.get()
+    if not dispatcher or not from_:
         logging.error(f"Intento de envío a {to} fallido: El cliente de Twilio o el número de origen no están configurados.")
         return
 
-    try:
-        logging.info(f"Enviando mensaje a {to}...")
-        message = client.messages.create(
-            from_=TWILIO_NUMBER,
-            body=body,
-            to=to
-        )
-        logging.info(f"Mensaje enviado a {to} con SID: {message.sid}")
-    except TwilioRestException as e:
-        if e.code == 63038:
-            logging.error(
-                "Error de Twilio: Límite de mensajes de la cuenta de prueba superado. "
-                "Para seguir enviando mensajes, actualiza tu cuenta de Twilio a una versión de pago."
-            )
+    for part in split_message(body):
+        if OUTBOUND_ASYNC:
+            dispatcher.submit(from_, to, part)
         else:
-            logging.error(f"Error de la API de Twilio al enviar a {to}: {e}", exc_info=True)
-    except Exception as e:
-        logging.error(f"Error inesperado al enviar el mensaje a {to}: {e}", exc_info=True)
\ No newline at end of file
+            dispatcher.deliver(from_, to, part)
@@ -0,0 +1,49 @@
+import os
+
+# Los módulos leen su configuración al importarse: las pruebas nunca llaman a Twilio ni a MercadoPago.
+os.environ["WHATSAPP_TRANSPORT"] = "fake"
+os.environ["PAYMENT_PROVIDER"] = "fake"
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+
+import fakeredis
+import pytest
+
+from core import redis_pool
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Redis en memoria (fakeredis) para get_redis(), get_async_redis() y el cliente de core.tools."""
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    redis_pool.use_clients(client, fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    from core import tools
+    monkeypatch.setattr(tools, "redis_client", client)
+    yield client
+    redis_pool.use_clients(None)
+
+
+KNOWLEDGE_BASE = {
+    "horarios.txt": "Abrimos de lunes a viernes de 8 a 20 horas. Los sábados abrimos de 9 a 14.",
+    "envios.txt": "Hacemos envíos a domicilio dentro de Palermo con un costo fijo de 500 pesos.",
+    "menu.txt": "Tenemos opciones veganas y sin TACC: brownie vegano y budín de limón.",
+}
+
+
+@pytest.fixture
+def rag_manager(tmp_path, monkeypatch):
+    """RAGManager híbrido sin red: embeddings por hashing e índice NumPy en un directorio temporal."""
+    from core import rag_manager as rag_module
+
+    knowledge_base = tmp_path / "knowledge_base"
+    knowledge_base.mkdir()
+    for name, text in KNOWLEDGE_BASE.items():
+        (knowledge_base / name).write_text(text, encoding="utf-8")
+    monkeypatch.setattr(rag_module, "EMBEDDING_CACHE_DIR", str(tmp_path / "embedding_cache"))
+    return rag_module.RAGManager(
+        embeddings_kind="hashing",
+        backend_kind="numpy",
+        retrieval_mode="hybrid",
+        knowledge_base_dir=str(knowledge_base),
+        index_dir=str(tmp_path / "index"),
+    )
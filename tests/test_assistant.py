@@ -0,0 +1,52 @@
+import functools
+from typing import List, Optional
+
+import fakeredis
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import core.assistant
+import core.graph
+from core.graph import BUDGET_EXCEEDED_REPLY
+from core.llm_governor import TurnBudget
+
+
+class LoopingChatModel(BaseChatModel):
+    """Anuncia lo que va a hacer (en streaming) y vuelve a pedir la misma herramienta en cada vuelta."""
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "looping"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        text = "Déjame revisar tu carrito."
+        if run_manager is not None:
+            run_manager.on_llm_new_token(text)
+        tool_call = {"name": "view_cart", "args": {"user_id": "ana"}, "id": f"call_{self.calls}"}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, tool_calls=[tool_call]))])
+
+
+def test_budget_notice_is_sent_after_streamed_text(fake_redis, monkeypatch):
+    model = LoopingChatModel()
+    core.graph.llm.set(model)
+    monkeypatch.setattr(core.assistant, "TurnBudget", functools.partial(TurnBudget, max_iterations=2))
+    assistant = core.assistant.WhatsappAssistant()
+    assistant.router = None
+    assistant.memory.redis_client = fakeredis.FakeRedis()
+    sent = []
+
+    try:
+        reply = assistant.get_response("ana", "¿qué tengo en el carrito?", on_partial=sent.append)
+    finally:
+        core.graph.llm.reset()
+
+    assert model.calls == 2
+    assert "Déjame revisar tu carrito." in sent
+    assert reply == BUDGET_EXCEEDED_REPLY
+    assert sent[-1] == BUDGET_EXCEEDED_REPLY
@@ -0,0 +1,86 @@
+from core import tools
+from services.payment_manager import payments
+
+
+def test_aliases_are_added_to_the_same_cart_line(fake_redis):
+    tools.add_item_to_cart.invoke({"user_id": "ana", "item_name": "latte", "quantity": 1})
+    reply = tools.add_item_to_cart.invoke({"user_id": "ana", "item_name": "Café con leche", "quantity": 2})
+
+    assert reply == "2 x Café con leche más añadido(s). Ahora tienes 3 en total."
+    assert tools._get_cart("ana") == [{"item_name": "Café con leche", "quantity": 3, "price": 50}]
+
+
+def test_add_items_reports_unknown_products_and_keeps_the_rest(fake_redis):
+    reply = tools.add_items_to_cart.invoke({"user_id": "ana", "items": [
+        {"item_name": "espresso", "quantity": 2},
+        {"item_name": "pizza de anchoas", "quantity": 1},
+        {"item_name": "latte", "quantity": 0},
+    ]})
+
+    assert "- 2 x Espresso doble (total en el carrito: 2)" in reply
+    assert "pizza de anchoas, latte" in reply
+    assert tools.view_cart.invoke({"user_id": "ana"}) == "Este es tu carrito:\n- 2 x Espresso doble: $100\n\nTotal: $100"
+
+
+def test_checkout_with_an_empty_cart_does_not_create_a_payment(fake_redis):
+    before = len(payments.get().preferences)
+
+    reply = tools.checkout.invoke({"user_id": "ana"})
+
+    assert "vacío" in reply
+    assert len(payments.get().preferences) == before
+
+
+def test_separate_orders_with_the_same_items_get_their_own_payment_link(fake_redis):
+    links = []
+    for _ in range(2):
+        tools.add_item_to_cart.invoke({"user_id": "ana", "item_name": "espresso", "quantity": 1})
+        reply = tools.checkout.invoke({"user_id": "ana"})
+        links.append(reply.rsplit(" ", 1)[-1])
+
+    references = [p["external_reference"] for p in payments.get().preferences[-2:]]
+    assert links[0] != links[1]
+    assert references[0] != references[1]
+    assert tools._get_cart("ana") == []
+    assert fake_redis.keys("*") == [tools._delivered_link_key("ana")]
+
+
+def test_checkout_after_delivery_resends_the_link_until_it_expires(fake_redis):
+    tools.add_item_to_cart.invoke({"user_id": "ana", "item_name": "espresso", "quantity": 1})
+    link = tools.checkout.invoke({"user_id": "ana"}).rsplit(" ", 1)[-1]
+    before = len(payments.get().preferences)
+
+    again = tools.checkout.invoke({"user_id": "ana"})
+
+    assert again.endswith(link)
+    assert len(payments.get().preferences) == before
+    assert 0 < fake_redis.ttl(tools._delivered_link_key("ana")) <= tools.PAYMENT_LINK_TTL_SECONDS
+    fake_redis.delete(tools._delivered_link_key("ana"))
+    assert "vacío" in tools.checkout.invoke({"user_id": "ana"})
+
+
+def test_a_retried_checkout_of_the_same_order_reuses_its_link(fake_redis):
+    tools.add_item_to_cart.invoke({"user_id": "ana", "item_name": "espresso", "quantity": 1})
+    fingerprint = tools._cart_fingerprint("ana", tools._get_cart("ana"))
+    # El primer intento creó el link pero el proceso murió antes de vaciar el carrito.
+    order = tools._pending_order("ana", fingerprint)
+    fake_redis.hset(tools._pending_order_key("ana"), "link", "https://pagos.local/checkout/anterior")
+    before = len(payments.get().preferences)
+
+    reply = tools.checkout.invoke({"user_id": "ana"})
+
+    assert reply.endswith("https://pagos.local/checkout/anterior")
+    assert len(payments.get().preferences) == before
+    assert tools._pending_order("ana", fingerprint)["id"] != order["id"]
+
+
+def test_ambiguous_product_names_are_not_guessed(fake_redis):
+    reply = tools.add_item_to_cart.invoke({"user_id": "ana", "item_name": "medialuna", "quantity": 2})
+    batch = tools.add_items_to_cart.invoke({"user_id": "ana", "items": [
+        {"item_name": "medialunas", "quantity": 1},
+        {"item_name": "brownie", "quantity": 1},
+    ]})
+
+    assert "Medialunas de manteca o Medialunas de grasa" in reply
+    assert "¿Cuál quieres" in batch
+    assert tools._get_cart("ana") == [{"item_name": "Brownie vegano", "quantity": 1, "price": 50}]
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from core.catalog import ProductCatalog, singularize
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    path = tmp_path / "products.json"
+    path.write_text(json.dumps({"productos": [
+        {"nombre_oficial": "Capuchino", "alias": ["cappuccino"], "precio": 55},
+        {"nombre_oficial": "Medialuna de manteca", "alias": ["medialuna"], "precio": 20},
+        {"nombre_oficial": "Medialuna de grasa", "alias": ["medialuna"], "precio": 18},
+        {"nombre_oficial": "Jugo de naranja", "precio": 45},
+        {"nombre_oficial": "Jugo de manzana", "precio": 45},
+    ]}), encoding="utf-8")
+    return ProductCatalog(str(path))
+
+
+def test_exact_prefix_and_fuzzy_matches(catalog):
+    assert [p.name for p in catalog.matches("Cappuccinos")] == ["Capuchino"]
+    assert [p.name for p in catalog.matches("capuchinno")] == ["Capuchino"]
+    assert catalog.lookup("pizza") is None
+
+
+def test_ambiguous_names_return_every_option(catalog):
+    assert {p.name for p in catalog.matches("medialuna")} == {"Medialuna de manteca", "Medialuna de grasa"}
+    assert {p.name for p in catalog.matches("medialuna de")} == {"Medialuna de manteca", "Medialuna de grasa"}
+    # "marana" está igual de cerca de los dos jugos: no se elige ninguno al azar.
+    assert {p.name for p in catalog.matches("jugo de marana")} == {"Jugo de naranja", "Jugo de manzana"}
+    assert [p.name for p in catalog.matches("jugo de naranjo")] == ["Jugo de naranja"]
+    assert catalog.lookup("medialuna") is None
+
+
+def test_fuzzy_pool_skips_keys_that_cannot_reach_the_cutoff(catalog):
+    index = catalog._current()
+
+    pool = index.fuzzy_pool("capuchinno", 0.8)
+
+    assert "capuchino" in pool
+    assert "medialuna de manteca" not in pool
+
+
+@pytest.mark.parametrize("plural, singular", [
+    ("capuchinos", "capuchino"),
+    ("cafes", "cafe"),
+    ("panes", "pan"),
+    ("alfajores", "alfajor"),
+    ("medialunas de manteca", "medialuna de manteca"),
+    ("te", "te"),
+])
+def test_singularize(plural, singular):
+    assert singularize(plural) == singular
@@ -0,0 +1,75 @@
+import json
+
+import fakeredis
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage, messages_to_dict
+
+from core import metrics, redis_pool
+from core.history_codec import FLAG_ZLIB, SCHEMA_VERSION, JsonCodec, MsgpackCodec, decode_message, is_legacy
+from core.memory import ConversationManager
+
+MESSAGES = [
+    HumanMessage(content="¿Tienen medialunas?"),
+    AIMessage(content="", tool_calls=[{"id": "call_1", "name": "view_cart", "args": {"user_id": "ana"}}]),
+    ToolMessage(content="Tu carrito está vacío.", tool_call_id="call_1", name="view_cart"),
+    SystemMessage(content="Resumen de la conversación anterior."),
+]
+
+
+def _same(decoded, original):
+    assert type(decoded) is type(original)
+    assert decoded.content == original.content
+    assert getattr(decoded, "tool_call_id", None) == getattr(original, "tool_call_id", None)
+    assert [(c["id"], c["name"], c["args"]) for c in getattr(decoded, "tool_calls", [])] == \
+        [(c["id"], c["name"], c["args"]) for c in getattr(original, "tool_calls", [])]
+
+
+@pytest.mark.parametrize("codec", [JsonCodec(), MsgpackCodec()], ids=["json", "msgpack"])
+@pytest.mark.parametrize("message", MESSAGES, ids=["human", "ai_tool_calls", "tool", "system"])
+def test_round_trip(codec, message):
+    raw = codec.encode(message)
+
+    _same(codec.decode(raw), message)
+    _same(decode_message(raw), message)
+    assert is_legacy(raw) is (codec.name == "json")
+
+
+def test_entries_are_compressed_only_above_the_threshold():
+    codec = MsgpackCodec(compress_min_bytes=512)
+    short = codec.encode(HumanMessage(content="hola"))
+    long = codec.encode(HumanMessage(content="un café con leche, por favor. " * 50))
+
+    assert short[0] == SCHEMA_VERSION << 4
+    assert long[0] == SCHEMA_VERSION << 4 | FLAG_ZLIB
+    assert len(long) < len("un café con leche, por favor. " * 50)
+    assert decode_message(long).content == "un café con leche, por favor. " * 50
+    assert MsgpackCodec(compress_min_bytes=0).encode(HumanMessage(content="x" * 2000))[0] == SCHEMA_VERSION << 4
+
+
+def test_unknown_schema_version_is_rejected():
+    raw = MsgpackCodec().encode(HumanMessage(content="hola"))
+
+    with pytest.raises(ValueError, match="Versión de esquema"):
+        decode_message(bytes([(SCHEMA_VERSION + 1) << 4]) + raw[1:])
+
+
+@pytest.fixture
+def binary_redis():
+    client = fakeredis.FakeRedis()
+    redis_pool.use_clients(client)
+    yield client
+    redis_pool.use_clients(None)
+
+
+def test_legacy_json_history_is_read_and_rewritten_once(binary_redis):
+    legacy = [HumanMessage(content="hola"), AIMessage(content="¡Hola! ¿Qué vas a pedir?")]
+    binary_redis.rpush("conversation:ana", *[json.dumps(entry) for entry in messages_to_dict(legacy)])
+    manager = ConversationManager(max_messages=0, max_tokens=0, codec=MsgpackCodec(), background=False)
+    before = metrics.registry.get_counter("history_migrated_entries_total")
+
+    first = manager.get_history("ana")
+    second = manager.get_history("ana")
+
+    assert [m.content for m in first] == [m.content for m in second] == ["hola", "¡Hola! ¿Qué vas a pedir?"]
+    assert metrics.registry.get_counter("history_migrated_entries_total") - before == 2
+    assert all(entry[0] == SCHEMA_VERSION << 4 for entry in binary_redis.lrange("conversation:ana", 0, -1))
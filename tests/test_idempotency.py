@@ -0,0 +1,37 @@
+import asyncio
+
+from core.idempotency import WebhookDeduplicator
+
+
+def test_duplicate_message_sid_is_ignored(fake_redis):
+    deduplicator = WebhookDeduplicator()
+
+    async def deliveries():
+        first = await deduplicator.claim("SM1")
+        retry_while_processing = await deduplicator.claim("SM1")
+        deduplicator.complete(["SM1"])
+        retry_after_reply = await deduplicator.claim("SM1")
+        other = await deduplicator.claim("SM2")
+        return first, retry_while_processing, retry_after_reply, other
+
+    assert asyncio.run(deliveries()) == (True, False, False, True)
+    assert fake_redis.get("webhook:sid:SM1") == "done"
+
+
+def test_released_claim_lets_the_retry_through(fake_redis):
+    deduplicator = WebhookDeduplicator()
+
+    async def deliveries():
+        await deduplicator.claim("SM1")
+        # La cola estaba llena: el webhook respondió con error y Twilio reintentará.
+        await deduplicator.release("SM1")
+        return await deduplicator.claim("SM1")
+
+    assert asyncio.run(deliveries()) is True
+
+
+def test_messages_without_sid_are_always_processed(fake_redis):
+    deduplicator = WebhookDeduplicator()
+
+    assert asyncio.run(deduplicator.claim(None)) is True
+    assert asyncio.run(deduplicator.claim(None)) is True
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from core import metrics
+from core.catalog import ProductCatalog
+from core.intent_router import IntentRouter
+
+
+@pytest.fixture
+def router(tmp_path):
+    path = tmp_path / "products.json"
+    path.write_text(json.dumps({"productos": [
+        {"nombre_oficial": "Capuchino", "alias": ["cappuccino"], "precio": 50},
+        {"nombre_oficial": "Brownie", "precio": 40},
+        {"nombre_oficial": "Medialuna de manteca", "alias": ["medialuna"], "precio": 20},
+        {"nombre_oficial": "Medialuna de grasa", "alias": ["medialuna"], "precio": 18},
+    ]}), encoding="utf-8")
+    return IntentRouter(ProductCatalog(str(path)))
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Ver carrito
+    ("Quiero ver mi carrito", ("view_cart", None)),
+    ("¿Qué tengo en el carrito?", ("view_cart", None)),
+    ("¿Cuánto es el total?", ("view_cart", None)),
+    ("cuanto va en el carrito", ("view_cart", None)),
+    # Un "cuánto es" a secas suele ser una pregunta de precio: la responde el agente.
+    ("¿Cuánto es?", None),
+    ("cuanto va", None),
+    ("¿Cuánto es el capuchino?", None),
+    # Pagar
+    ("Quiero pagar", ("checkout", None)),
+    ("pasame el link de pago por favor", ("checkout", None)),
+    # Hablar con una persona
+    ("Quiero hablar con una persona", ("talk_to_human", None)),
+    # Agregar
+    ("Agregame dos capuchinos y un brownie al carrito", ("add_to_cart", [("Capuchino", 2), ("Brownie", 1)])),
+    ("Quiero 3 cappuccinos, gracias", ("add_to_cart", [("Capuchino", 3)])),
+    ("dame un brownie porfa", ("add_to_cart", [("Brownie", 1)])),
+    ("quiero 50 capuchinos", ("add_to_cart", [("Capuchino", 50)])),
+    # Ambiguos, desconocidos o fuera de rango: siguen por el agente.
+    ("Quiero una medialuna", None),
+    ("quiero un capuchino y una medialuna", None),
+    ("quiero una pizza", None),
+    ("quiero 51 capuchinos", None),
+    ("quiero 0 capuchinos", None),
+    ("quiero capuchinos", None),
+    ("hola\nquiero pagar", None),
+])
+def test_match(router, text, expected):
+    assert router.match(text) == expected
+
+
+def test_route_runs_the_tool_and_counts_fallbacks(router, fake_redis):
+    before = metrics.registry.get_counter("intent_router_total", intent="fallback")
+
+    added = router.route("ana", "quiero 2 capuchinos por favor")
+    cart = router.route("ana", "mi carrito")
+    fallback = router.route("ana", "¿Tienen opciones sin TACC?")
+
+    assert added.intent == "add_to_cart"
+    assert cart.reply == "Este es tu carrito:\n- 2 x Capuchino: $100\n\nTotal: $100"
+    assert fallback is None
+    assert metrics.registry.get_counter("intent_router_total", intent="fallback") - before == 1
@@ -0,0 +1,85 @@
+import time
+
+from langchain_core.documents import Document
+
+from core import metrics
+from core.kb_cache import KnowledgeCache
+
+HORARIOS = [Document(page_content="Abrimos de 8 a 20.")]
+ENVIOS = [Document(page_content="Hacemos envíos en Palermo.")]
+
+
+def _requests() -> dict:
+    return {
+        result: metrics.registry.get_counter("kb_cache_requests_total", result=result)
+        for result in ("exact_hit", "similar_hit", "miss")
+    }
+
+
+def _delta(before: dict) -> dict:
+    return {result: count - before[result] for result, count in _requests().items()}
+
+
+def test_exact_and_semantic_hits():
+    cache = KnowledgeCache(max_entries=4, ttl_seconds=60, similarity_threshold=0.9)
+    cache.put("¿A qué hora abren?", HORARIOS, [1.0, 0.0, 0.0], version=1)
+    before = _requests()
+
+    assert cache.get_exact("a que hora abren", version=1) is HORARIOS
+    assert cache.get_exact("¿Hacen envíos?", version=1) is None
+    assert cache.get_similar([0.99, 0.1, 0.0], version=1) is HORARIOS
+    assert cache.get_similar([0.0, 1.0, 0.0], version=1) is None
+
+    # Los fallos los registra quien busca, una sola vez por consulta.
+    assert _delta(before) == {"exact_hit": 1, "similar_hit": 1, "miss": 0}
+
+
+def test_entries_expire_after_the_ttl():
+    cache = KnowledgeCache(max_entries=4, ttl_seconds=0.05)
+    cache.put("horarios", HORARIOS, [1.0, 0.0], version=1)
+
+    time.sleep(0.1)
+
+    assert cache.get_exact("horarios", version=1) is None
+    assert cache.get_similar([1.0, 0.0], version=1) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = KnowledgeCache(max_entries=2, ttl_seconds=60)
+    cache.put("horarios", HORARIOS, None, version=1)
+    cache.put("envios", ENVIOS, None, version=1)
+    cache.get_exact("horarios", version=1)
+    before = metrics.registry.get_counter("kb_cache_evictions_total")
+
+    cache.put("menu", [], None, version=1)
+
+    assert metrics.registry.get_counter("kb_cache_evictions_total") - before == 1
+    assert cache.get_exact("envios", version=1) is None
+    assert cache.get_exact("horarios", version=1) is HORARIOS
+
+
+def test_a_new_index_version_invalidates_the_cache():
+    cache = KnowledgeCache(max_entries=4, ttl_seconds=60)
+    cache.put("horarios", HORARIOS, [1.0, 0.0], version=1)
+
+    assert cache.get_exact("horarios", version=2) is None
+    assert cache.get_similar([1.0, 0.0], version=2) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_search_counts_one_miss_per_query_on_every_path(rag_manager):
+    rag_manager.create_and_save_vector_store()
+    before = _requests()
+    embedded = rag_manager.counting_embeddings.embedded_queries
+
+    # Camino léxico: BM25 decide sin calcular el embedding.
+    lexical = rag_manager.search("costo de envios a domicilio en Palermo")
+    # Camino vectorial: ninguna palabra de la consulta está en el índice léxico.
+    rag_manager.search("hola")
+    rag_manager.search("costo de envios a domicilio en Palermo")
+    rag_manager.search("hola")
+
+    assert rag_manager.counting_embeddings.embedded_queries - embedded == 1
+    assert lexical[0].page_content.startswith("Hacemos envíos")
+    assert _delta(before) == {"exact_hit": 2, "similar_hit": 0, "miss": 2}
+    assert rag_manager.cache.stats()["hit_rate"] > 0
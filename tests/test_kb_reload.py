@@ -0,0 +1,16 @@
+import pytest
+
+from core.kb_reload import KB_REBUILD_LOCK_KEY, KnowledgeBaseReloader
+
+# fakeredis ejecuta scripts Lua solo con el paquete opcional lupa.
+pytest.importorskip("lupa")
+
+
+def test_rebuild_lock_is_released_only_by_its_owner(fake_redis):
+    fake_redis.set(KB_REBUILD_LOCK_KEY, "otro-worker")
+
+    assert not KnowledgeBaseReloader.release_lock(fake_redis, KB_REBUILD_LOCK_KEY, "este-worker")
+    assert fake_redis.get(KB_REBUILD_LOCK_KEY) == "otro-worker"
+
+    assert KnowledgeBaseReloader.release_lock(fake_redis, KB_REBUILD_LOCK_KEY, "otro-worker")
+    assert fake_redis.get(KB_REBUILD_LOCK_KEY) is None
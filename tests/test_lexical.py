@@ -0,0 +1,50 @@
+import pytest
+from langchain_core.documents import Document
+
+from core.lexical import BM25Index, is_decisive, reciprocal_rank_fusion, tokenize
+
+HORARIOS = Document(page_content="Abrimos de lunes a viernes de 8 a 20 horas.", metadata={"source": "horarios.txt"})
+ENVIOS = Document(page_content="Hacemos envíos a domicilio en Palermo. El envío cuesta 500 pesos.", metadata={"source": "envios.txt"})
+MENU = Document(page_content="Tenemos opciones veganas: brownie vegano y budín de limón.", metadata={"source": "menu.txt"})
+
+
+def test_tokenize_normalizes_and_drops_stopwords():
+    assert tokenize("¿Tienen envíos a DOMICILIO?") == ["envio", "domicilio"]
+
+
+def test_bm25_ranks_by_term_relevance():
+    index = BM25Index([HORARIOS, ENVIOS, MENU])
+
+    results = index.search("¿Cuánto cuesta el envío?", k=3)
+
+    assert [document for document, _ in results] == [ENVIOS]
+    assert results[0][1] > 0
+    both = index.search("horas de envio", k=3)
+    assert {d.metadata["source"] for d, _ in both} == {"horarios.txt", "envios.txt"}
+    assert [score for _, score in both] == sorted((score for _, score in both), reverse=True)
+    assert len(index.search("horas de envio", k=1)) == 1
+    assert index.search("pizza", k=3) == []
+    assert BM25Index([]).search("envio", k=3) == []
+
+
+@pytest.mark.parametrize("scores, decisive", [
+    ([], False),
+    ([2.9], False),
+    ([3.0], True),
+    ([4.5, 3.0], True),
+    ([4.4, 3.0], False),
+])
+def test_is_decisive(scores, decisive):
+    results = [(HORARIOS, score) for score in scores]
+
+    assert is_decisive(results, min_score=3.0, margin=1.5) is decisive
+
+
+def test_reciprocal_rank_fusion_rewards_documents_in_both_rankings():
+    # El mismo chunk llega como dos objetos distintos: se identifica por origen y contenido.
+    envios_copy = Document(page_content=ENVIOS.page_content, metadata={"source": "envios.txt"})
+
+    fused = reciprocal_rank_fusion([[HORARIOS, ENVIOS], [envios_copy, MENU]], k=3)
+
+    assert fused == [ENVIOS, HORARIOS, MENU]
+    assert reciprocal_rank_fusion([[HORARIOS, ENVIOS, MENU]], k=2) == [HORARIOS, ENVIOS]
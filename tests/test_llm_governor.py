@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from core.llm_governor import LLMGovernor, LLMOverloaded, TurnBudget
+
+
+def test_governor_sheds_when_the_wait_queue_is_full():
+    governor = LLMGovernor(max_concurrency=1, global_max_concurrency=0, max_queue=0, queue_timeout=1)
+
+    with governor.slot():
+        with pytest.raises(LLMOverloaded) as error:
+            with governor.slot():
+                pass
+
+    assert error.value.reason == "queue_full"
+    assert governor.stats()["in_flight"] == 0
+
+
+def test_governor_sheds_when_the_wait_times_out():
+    governor = LLMGovernor(max_concurrency=1, global_max_concurrency=0, max_queue=1, queue_timeout=0.05)
+    held, done = threading.Event(), threading.Event()
+
+    def hold():
+        with governor.slot():
+            held.set()
+            done.wait(5)
+
+    worker = threading.Thread(target=hold)
+    worker.start()
+    held.wait(5)
+    try:
+        with pytest.raises(LLMOverloaded) as error:
+            with governor.slot():
+                pass
+    finally:
+        done.set()
+        worker.join()
+
+    assert error.value.reason == "timeout"
+    # Al liberarse el lugar, la siguiente llamada pasa.
+    with governor.slot():
+        assert governor.stats()["in_flight"] == 1
+
+
+def test_global_limit_is_shared_through_redis(fake_redis):
+    first = LLMGovernor(max_concurrency=2, global_max_concurrency=1, queue_timeout=0.05, key="llm:test")
+    second = LLMGovernor(max_concurrency=2, global_max_concurrency=1, queue_timeout=0.05, key="llm:test")
+
+    with first.slot():
+        with pytest.raises(LLMOverloaded) as error:
+            with second.slot():
+                pass
+    with second.slot():
+        pass
+
+    assert error.value.reason == "global_timeout"
+    assert fake_redis.zcard("llm:test") == 0
+
+
+def test_global_lease_is_refreshed_while_the_call_runs(fake_redis):
+    first = LLMGovernor(max_concurrency=1, global_max_concurrency=1, queue_timeout=0.05, lease_seconds=0.3, key="llm:test")
+    second = LLMGovernor(max_concurrency=1, global_max_concurrency=1, queue_timeout=0.05, lease_seconds=0.3, key="llm:test")
+
+    with first.slot():
+        time.sleep(0.6)
+        # El lease vence a los 0.3 s, pero el heartbeat lo renovó con la hora de Redis.
+        seconds, micros = fake_redis.time()
+        assert seconds + micros / 1e6 - fake_redis.zrange("llm:test", 0, 0, withscores=True)[0][1] < 0.3
+        with pytest.raises(LLMOverloaded):
+            with second.slot():
+                pass
+
+    assert fake_redis.zcard("llm:test") == 0
+
+
+def test_turn_budget_stops_after_max_iterations():
+    budget = TurnBudget(max_iterations=2, deadline_seconds=60)
+
+    assert budget.exceeded() is None
+    budget.iterations = 2
+    assert budget.exceeded() == "iterations"
+
+
+def test_turn_budget_stops_at_the_deadline():
+    budget = TurnBudget(max_iterations=10, deadline_seconds=0)
+
+    assert budget.remaining() == 0
+    assert budget.exceeded() == "deadline"
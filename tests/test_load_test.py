@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _runtime_files():
+    """Archivos que la aplicación genera en el repositorio al ejecutarse."""
+    cache_dir = os.path.join(ROOT, "data", "embedding_cache")
+    files = set(os.listdir(cache_dir)) if os.path.isdir(cache_dir) else set()
+    log_path = os.path.join(ROOT, "app.log")
+    return files, os.path.getmtime(log_path) if os.path.exists(log_path) else None
+
+
+def _run_load_test(tmp_path, *args) -> dict:
+    output = tmp_path / "report.json"
+    env = {k: v for k, v in os.environ.items() if k not in ("EMBEDDING_CACHE_DIR", "LOG_FILE")}
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.load_test", "--repeat", "1", "--llm-latency", "0",
+         "--output", str(output), *args],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    return json.loads(output.read_text(encoding="utf-8"))
+
+
+def test_sync_load_test_answers_every_message_without_touching_the_repo(tmp_path):
+    before = _runtime_files()
+    report = _run_load_test(tmp_path, "--mode", "sync")
+
+    assert report["messages"] > 0
+    assert report["messages_sent"] >= report["messages"]
+    assert report["llm_calls"] > 0
+    assert not report["llm_shed"]
+    assert _runtime_files() == before
+
+
+def test_queue_load_test_drains_the_pipeline(tmp_path):
+    report = _run_load_test(tmp_path, "--mode", "queue")
+
+    assert report["messages_sent"] > 0
+    assert report["llm_calls_per_message"] < 2
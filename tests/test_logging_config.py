@@ -0,0 +1,49 @@
+import logging
+import queue
+import time
+
+from core import metrics
+from core.logging_config import DroppingQueueHandler, InfoRateLimitFilter
+
+
+def _record(msg: str, *args, level: int = logging.INFO, name: str = "core.prueba") -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_info_rate_limit_is_per_template():
+    rate_limit = InfoRateLimitFilter(rate=0.001, burst=2)
+    before = metrics.registry.get_counter("log_records_suppressed_total", logger="core.prueba")
+
+    # Mismo mensaje con distintos argumentos: comparten el cupo de la plantilla.
+    same_template = [rate_limit.filter(_record("Mensaje de %s resuelto.", user)) for user in ("ana", "beto", "carla")]
+    other_template = rate_limit.filter(_record("Pipeline iniciado con %s workers.", 4))
+    warning = rate_limit.filter(_record("Mensaje de %s resuelto.", "dario", level=logging.WARNING))
+
+    assert same_template == [True, True, False]
+    assert other_template is True
+    assert warning is True
+    assert metrics.registry.get_counter("log_records_suppressed_total", logger="core.prueba") - before == 1
+
+
+def test_info_rate_limit_refills_over_time():
+    rate_limit = InfoRateLimitFilter(rate=100, burst=1)
+
+    assert rate_limit.filter(_record("hola %s", 1))
+    assert not rate_limit.filter(_record("hola %s", 2))
+    time.sleep(0.02)
+    assert rate_limit.filter(_record("hola %s", 3))
+
+
+def test_queue_handler_drops_records_when_the_queue_is_full():
+    log_queue = queue.Queue(maxsize=1)
+    handler = DroppingQueueHandler(log_queue)
+    before = metrics.registry.get_counter("log_records_dropped_total")
+
+    handler.handle(_record("primero %s", 1))
+    handler.handle(_record("segundo %s", 2))
+
+    assert metrics.registry.get_counter("log_records_dropped_total") - before == 1
+    queued = log_queue.get_nowait()
+    # El mensaje se arma recién en el hilo de escritura.
+    assert (queued.msg, queued.args) == ("primero %s", (1,))
+    assert log_queue.empty()
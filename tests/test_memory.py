@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from benchmarks.fakes import InMemoryRedis
+from core import redis_pool
+from core.history_codec import build_codec
+from core.memory import ConversationManager, LLMSummarizer, TruncatingSummarizer, estimate_tokens
+
+
+@pytest.fixture
+def memory_redis():
+    """El historial usa un cliente binario: el Redis en memoria de los benchmarks conserva los bytes."""
+    client = InMemoryRedis()
+    redis_pool.use_clients(client)
+    yield client
+    redis_pool.use_clients(None)
+
+
+def _turns(count: int, text: str = "mensaje"):
+    messages = []
+    for index in range(count):
+        messages += [HumanMessage(content=f"{text} {index}"), AIMessage(content=f"respuesta {index}")]
+    return messages
+
+
+@pytest.mark.parametrize("codec", ["json", "msgpack"])
+def test_history_is_trimmed_to_max_messages(memory_redis, codec):
+    manager = ConversationManager(max_messages=4, max_tokens=0, summary_batch=2,
+                                  summarizer=TruncatingSummarizer(), codec=build_codec(codec), background=False)
+    for message in _turns(5):
+        manager.add_message("ana", message)
+
+    history = manager.get_history("ana")
+    summary, recent = history[0], history[1:]
+
+    assert memory_redis.llen("conversation:ana") <= 4 + 2
+    assert isinstance(summary, SystemMessage)
+    assert "mensaje 0" in summary.content
+    assert [m.content for m in recent][-2:] == ["mensaje 4", "respuesta 4"]
+    assert len(recent) <= 4 + 2
+
+
+def test_history_is_trimmed_to_max_tokens(memory_redis):
+    manager = ConversationManager(max_messages=0, max_tokens=200, summarizer=TruncatingSummarizer(), background=False)
+    for index in range(10):
+        manager.add_messages("ana", [HumanMessage(content=f"pregunta {index} " + "x" * 120), AIMessage(content="ok")])
+
+    recent = [m for m in manager.get_history("ana") if not isinstance(m, SystemMessage)]
+
+    assert sum(estimate_tokens(m) for m in recent) <= 200
+    assert recent[-1].content == "ok"
+    assert recent[-2].content.startswith("pregunta 9 ")
+
+
+def test_history_without_summarizer_only_drops_old_turns(memory_redis):
+    manager = ConversationManager(max_messages=2, max_tokens=0, summary_batch=1, background=False)
+    manager.summarizer = None
+    manager.add_messages("ana", _turns(3))
+
+    history = manager.get_history("ana")
+
+    assert [m.content for m in history] == ["mensaje 2", "respuesta 2"]
+    assert memory_redis.get("conversation:ana:summary") is None
+
+
+def test_background_fold_does_not_delay_add_messages(memory_redis):
+    release = threading.Event()
+    calls = []
+
+    def slow_summarizer(previous_summary, messages):
+        calls.append(len(messages))
+        release.wait(5)
+        return "resumen"
+
+    manager = ConversationManager(max_messages=2, max_tokens=0, summary_batch=1, summarizer=slow_summarizer)
+    manager.add_messages("ana", _turns(3))
+    # Mientras el resumen está en curso, un turno nuevo no lanza otro resumen de la misma conversación.
+    manager.add_messages("ana", _turns(1, "otro"))
+    assert memory_redis.llen("conversation:ana") == 8
+
+    release.set()
+    manager.wait_for_folds(timeout=5)
+
+    assert calls == [4]
+    assert memory_redis.get("conversation:ana:summary") == "resumen"
+    assert memory_redis.llen("conversation:ana") == 4
+
+
+def test_llm_summarizer_goes_through_the_governor(monkeypatch):
+    from core import memory
+    from core.llm_governor import LLMGovernor, LLMOverloaded
+
+    class Model:
+        def invoke(self, prompt):
+            raise AssertionError("no debería llamarse sin capacidad")
+
+    monkeypatch.setattr(memory, "governor", LLMGovernor(max_concurrency=1, max_queue=0))
+    summarizer = LLMSummarizer(model=Model(), timeout=0.05)
+    with memory.governor.slot():
+        with pytest.raises(LLMOverloaded):
+            summarizer("", _turns(1))
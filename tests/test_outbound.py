@@ -0,0 +1,148 @@
+import json
+import time
+
+import pytest
+from twilio.base.exceptions import TwilioRestException
+
+from core import metrics
+from services import outbound, whatsapp_client
+from services.outbound import OutboundDispatcher, TokenBucket, TransportError
+from services.whatsapp_client import FakeTransport, TwilioTransport, split_message
+
+FROM = "whatsapp:+10000000000"
+
+
+def _dispatcher(transport, **kwargs) -> OutboundDispatcher:
+    options = {"num_workers": 1, "rate": 1000, "burst": 1000, "max_retries": 2, "backoff": 0.01, "max_backoff": 0.05}
+    return OutboundDispatcher(transport, **{**options, **kwargs})
+
+
+def _retryable():
+    return TransportError("429", retryable=True, code=20429)
+
+
+def _wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "la condición no se cumplió a tiempo"
+        time.sleep(0.005)
+
+
+def test_long_messages_are_split_at_the_whatsapp_limit(fake_redis, monkeypatch):
+    transport = FakeTransport()
+    monkeypatch.setattr(whatsapp_client, "OUTBOUND_ASYNC", False)
+    whatsapp_client.outbound.set(_dispatcher(transport))
+    body = " ".join(["palabra"] * 500)
+    try:
+        whatsapp_client.send_message("whatsapp:+1111", body, from_=FROM)
+    finally:
+        whatsapp_client.outbound.reset()
+
+    parts = [sent_body for _, _, sent_body in transport.sent]
+    assert len(parts) == 3
+    assert all(len(part) <= 1600 for part in parts)
+    assert " ".join(parts) == body
+    assert split_message("a" * 3500) == ["a" * 1600, "a" * 1600, "a" * 300]
+
+
+@pytest.mark.parametrize("status, code, retryable", [
+    (429, None, True),
+    (500, None, True),
+    (503, None, True),
+    (400, 20429, True),
+    (400, 21211, False),
+    (404, None, False),
+])
+def test_twilio_errors_are_classified_as_retryable_or_not(status, code, retryable):
+    transport = TwilioTransport("AC" + "0" * 32, "token")
+
+    def create(**kwargs):
+        raise TwilioRestException(status, "/Messages", "falla", code)
+
+    transport.client.messages.create = create
+    with pytest.raises(TransportError) as error:
+        transport.send(FROM, "whatsapp:+1111", "hola")
+
+    assert error.value.retryable is retryable
+
+
+def test_retryable_errors_are_retried_until_sent(fake_redis):
+    transport = FakeTransport(failures=[_retryable(), TransportError("503", retryable=True)])
+
+    sid = _dispatcher(transport).deliver(FROM, "whatsapp:+1111", "hola")
+
+    assert sid == "FAKE00000001"
+    assert transport.sent == [(FROM, "whatsapp:+1111", "hola")]
+    assert fake_redis.llen(outbound.OUTBOUND_DEAD_LETTER_KEY) == 0
+
+
+def test_non_retryable_errors_go_straight_to_the_dead_letter(fake_redis):
+    transport = FakeTransport(failures=[TransportError("número inválido", retryable=False, code=21211), _retryable()])
+
+    sid = _dispatcher(transport).deliver(FROM, "whatsapp:+1111", "hola")
+
+    assert sid is None
+    # El segundo error no se consumió: no hubo reintento.
+    assert len(transport.failures) == 1
+    entry = json.loads(fake_redis.lindex(outbound.OUTBOUND_DEAD_LETTER_KEY, 0))
+    assert entry["to"] == "whatsapp:+1111"
+    assert entry["body"] == "hola"
+    assert entry["code"] == 21211
+
+
+def test_dead_letter_keeps_only_the_latest_entries(fake_redis, monkeypatch):
+    monkeypatch.setattr(outbound, "OUTBOUND_DEAD_LETTER_MAX", 2)
+    transport = FakeTransport(failures=[_retryable() for _ in range(9)])
+    dispatcher = _dispatcher(transport)
+
+    for index in range(3):
+        dispatcher.deliver(FROM, "whatsapp:+1111", f"mensaje {index}")
+
+    entries = [json.loads(e)["body"] for e in fake_redis.lrange(outbound.OUTBOUND_DEAD_LETTER_KEY, 0, -1)]
+    assert entries == ["mensaje 1", "mensaje 2"]
+
+
+def test_a_retrying_recipient_keeps_its_order_without_blocking_others(fake_redis):
+    transport = FakeTransport(failures=[_retryable()])
+    dispatcher = _dispatcher(transport, backoff=0.1)
+
+    dispatcher.submit(FROM, "whatsapp:+1111", "ana 1")
+    _wait_for(lambda: not transport.failures)
+    dispatcher.submit(FROM, "whatsapp:+1111", "ana 2")
+    dispatcher.submit(FROM, "whatsapp:+2222", "beto 1")
+    _wait_for(lambda: len(transport.sent) == 3)
+    dispatcher.stop()
+
+    # Los dos destinatarios comparten hilo: "beto 1" no espera el backoff de "ana 1".
+    assert [body for _, _, body in transport.sent] == ["beto 1", "ana 1", "ana 2"]
+
+
+def test_messages_submitted_after_stop_are_dead_lettered(fake_redis):
+    transport = FakeTransport()
+    dispatcher = _dispatcher(transport)
+    dispatcher.start()
+    dispatcher.stop()
+
+    dispatcher.submit(FROM, "whatsapp:+1111", "tarde")
+
+    assert transport.sent == []
+    assert json.loads(fake_redis.lindex(outbound.OUTBOUND_DEAD_LETTER_KEY, 0))["body"] == "tarde"
+
+
+def test_token_bucket_throttles_sends_per_origin(fake_redis):
+    bucket = TokenBucket(rate=20, capacity=2)
+    started = time.monotonic()
+    waits = [bucket.acquire() for _ in range(4)]
+
+    assert waits[:2] == [0.0, 0.0]
+    assert time.monotonic() - started >= 0.09
+
+    transport = FakeTransport()
+    before = metrics.registry.get_latency("outbound_throttled_seconds")
+    before_count = before.count if before is not None else 0
+    dispatcher = _dispatcher(transport, rate=50, burst=1)
+    for index in range(3):
+        dispatcher.deliver(FROM, "whatsapp:+1111", f"mensaje {index}")
+
+    assert len(transport.sent) == 3
+    assert metrics.registry.get_latency("outbound_throttled_seconds").count - before_count == 2
@@ -0,0 +1,84 @@
+import asyncio
+import threading
+
+import pytest
+
+from core.pipeline import InMemoryQueue, QueueFullError, WebhookPipeline
+from core.scheduler import ConversationLocks, UserScheduler
+
+
+def test_full_scheduler_stops_workers_from_draining_the_queue():
+    async def scenario():
+        release = threading.Event()
+        handled = []
+
+        def handler(job):
+            release.wait(5)
+            handled.append(job["body"])
+
+        scheduler = UserScheduler(handler=handler, max_concurrency=2, window=0, max_pending=2)
+        pipeline = WebhookPipeline(handler=handler, queue=InMemoryQueue(maxsize=3), num_workers=2, scheduler=scheduler)
+        await pipeline.start()
+        rejected = 0
+        for index in range(10):
+            try:
+                await pipeline.enqueue(f"user-{index}", f"mensaje {index}")
+            except QueueFullError:
+                rejected += 1
+            await asyncio.sleep(0.01)
+
+        stats = await pipeline.stats()
+        scheduler_stats = scheduler.stats()
+        release.set()
+        while len(handled) < 10 - rejected:
+            await asyncio.sleep(0.01)
+        await pipeline.stop()
+        return rejected, stats, scheduler_stats, handled
+
+    rejected, stats, scheduler_stats, handled = asyncio.run(scenario())
+
+    # Dos mensajes en el scheduler y tres en la cola: el resto se rechaza para que Twilio reintente.
+    assert rejected == 5
+    assert scheduler_stats["accepted_messages"] == 2
+    assert stats["queue_depth"] == 3
+    assert stats["workers_busy"] == 2
+    assert len(handled) == 5
+
+
+@pytest.mark.parametrize("window", [0, 0.05])
+def test_scheduler_releases_slots_after_coalesced_turns(window):
+    async def scenario():
+        handled = []
+        scheduler = UserScheduler(handler=lambda job: handled.append(job["body"]), max_concurrency=1,
+                                  window=window, max_pending=3)
+        for body in ("hola", "quiero un café", "y un brownie"):
+            await scheduler.acquire_slot()
+            await scheduler.submit({"user_id": "user", "body": body})
+        await scheduler.wait_idle()
+        return handled, scheduler.stats()
+
+    handled, stats = asyncio.run(scenario())
+
+    assert stats["accepted_messages"] == 0
+    assert "\n".join(handled) == "hola\nquiero un café\ny un brownie"
+
+
+def test_conversation_locks_serialize_the_same_user_only():
+    async def scenario():
+        locks = ConversationLocks()
+        events = []
+
+        async def turn(key, name):
+            async with locks.hold(key):
+                events.append(f"{name}:start")
+                await asyncio.sleep(0.02)
+                events.append(f"{name}:end")
+
+        await asyncio.gather(turn(("t", "ana"), "a1"), turn(("t", "ana"), "a2"), turn(("t", "beto"), "b1"))
+        return events, locks.stats()
+
+    events, stats = asyncio.run(scenario())
+
+    assert events.index("a1:end") < events.index("a2:start")
+    assert events.index("b1:start") < events.index("a1:end")
+    assert stats["active_conversations"] == 0
@@ -0,0 +1,43 @@
+import os
+
+from langchain_core.documents import Document
+
+from core.rag_manager import assign_chunk_ids
+
+
+def test_chunk_ids_are_stable_and_unique():
+    chunks = [
+        Document(page_content="Abrimos a las 8.", metadata={"source": "horarios.txt"}),
+        Document(page_content="Abrimos a las 8.", metadata={"source": "horarios.txt"}),
+        Document(page_content="Abrimos a las 8.", metadata={"source": "otro.txt"}),
+    ]
+
+    ids = assign_chunk_ids(chunks)
+
+    assert ids == assign_chunk_ids(chunks)
+    assert ids[1] == f"{ids[0]}-1"
+    assert len(set(ids)) == 3
+    assert assign_chunk_ids(chunks[2:]) == ids[2:]
+
+
+def test_rebuild_only_embeds_new_and_changed_chunks(rag_manager):
+    knowledge_base = rag_manager.knowledge_base_dir
+
+    first = rag_manager.create_and_save_vector_store()
+    unchanged = rag_manager.create_and_save_vector_store()
+    with open(os.path.join(knowledge_base, "horarios.txt"), "w", encoding="utf-8") as f:
+        f.write("Abrimos todos los días de 7 a 22 horas.")
+    os.remove(os.path.join(knowledge_base, "menu.txt"))
+    with open(os.path.join(knowledge_base, "pagos.txt"), "w", encoding="utf-8") as f:
+        f.write("Aceptamos efectivo, tarjetas y MercadoPago.")
+    edited = rag_manager.create_and_save_vector_store()
+
+    assert (first["added"], first["removed"], first["unchanged"], first["embedded"]) == (3, 0, 0, 3)
+    assert (unchanged["added"], unchanged["removed"], unchanged["unchanged"], unchanged["embedded"]) == (0, 0, 3, 0)
+    assert unchanged["changed_files"] == []
+    assert (edited["added"], edited["removed"], edited["unchanged"], edited["embedded"]) == (2, 2, 1, 2)
+    assert [os.path.basename(path) for path in edited["changed_files"]] == ["horarios.txt", "menu.txt", "pagos.txt"]
+    assert rag_manager.active_version == edited["version"] == rag_manager.stored_version()
+    assert sorted(d.metadata["source"] for d in rag_manager.backend.documents()) == sorted(
+        os.path.join(knowledge_base, name) for name in ("envios.txt", "horarios.txt", "pagos.txt")
+    )
@@ -0,0 +1,35 @@
+from core import tools
+from core.tenants import Tenant, TenantCache, _load_resources, set_tenant, tenant_var
+
+
+def _tenant(tmp_path) -> Tenant:
+    return Tenant(id="nuevo", name="Café Nuevo", index_dir=str(tmp_path / "index"))
+
+
+def test_tenant_without_published_index_is_served_and_builds_it(tmp_path):
+    builds = []
+    cache = TenantCache(loader=_load_resources, on_missing_index=builds.append)
+    tenant = _tenant(tmp_path)
+
+    entry = cache.get(tenant)
+    cache.get(tenant)
+
+    assert not entry.knowledge_base.is_loaded
+    assert entry.catalog.lookup("latte").name == "Café con leche"
+    assert builds == [tenant]
+
+
+def test_knowledge_base_tool_answers_while_the_index_is_being_built(tmp_path, fake_redis, monkeypatch):
+    cache = TenantCache(loader=_load_resources)
+    monkeypatch.setattr(tools, "tenant_cache", cache)
+    token = set_tenant(_tenant(tmp_path))
+    try:
+        reply = tools.get_knowledge_base_response.invoke({"user_query": "¿cuánto sale un latte?"})
+        added = tools.add_item_to_cart.invoke({"user_id": "ana", "item_name": "latte", "quantity": 1})
+    finally:
+        tenant_var.reset(token)
+
+    assert reply.startswith(tools.KB_NOT_READY_NOTE)
+    assert "Café con leche: $50" in reply
+    assert added == "1 x Café con leche ha(n) sido añadido(s) a tu carrito."
+    assert fake_redis.keys("*") == ["t:nuevo:cart:ana"]
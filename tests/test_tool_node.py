@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+from typing import Annotated, Sequence, TypedDict
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.tools import tool
+from langgraph.graph import END, StateGraph
+from langgraph.graph.message import add_messages
+
+from core.tool_node import ParallelToolNode
+
+events = []
+events_lock = threading.Lock()
+
+
+def _record(event: str):
+    with events_lock:
+        events.append(event)
+
+
+@tool
+def slow_lookup(query: str) -> str:
+    """Consulta lenta e independiente."""
+    _record(f"lookup:{query}:start")
+    time.sleep(0.05)
+    _record(f"lookup:{query}:end")
+    return f"resultado de {query}"
+
+
+@tool
+def add_to_cart(user_id: str, item: str) -> dict:
+    """Modifica el carrito del usuario."""
+    _record(f"cart:{user_id}:{item}:start")
+    time.sleep(0.02)
+    _record(f"cart:{user_id}:{item}:end")
+    return {"user_id": user_id, "item": item}
+
+
+@tool
+def broken(user_id: str) -> str:
+    """Siempre falla."""
+    raise RuntimeError("sin conexión")
+
+
+def _calls(*calls):
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{i}"} for i, (name, args) in enumerate(calls)])
+
+
+def _node():
+    return ParallelToolNode([slow_lookup, add_to_cart, broken], serialized_tools={"add_to_cart"}, max_concurrency=4)
+
+
+def test_results_keep_the_order_of_the_calls_and_errors_stay_local():
+    message = _calls(("slow_lookup", {"query": "menú"}), ("broken", {"user_id": "ana"}), ("add_to_cart", {"user_id": "ana", "item": "latte"}))
+
+    result = _node().invoke({"messages": [message]})
+
+    outputs = result["messages"]
+    assert [m.tool_call_id for m in outputs] == ["call_0", "call_1", "call_2"]
+    assert outputs[0].content == "resultado de menú"
+    assert "sin conexión" in outputs[1].content
+    assert outputs[2].content == '{"user_id": "ana", "item": "latte"}'
+
+
+def test_independent_calls_overlap_and_cart_calls_of_a_user_run_in_order():
+    events.clear()
+    message = _calls(
+        ("add_to_cart", {"user_id": "ana", "item": "latte"}),
+        ("slow_lookup", {"query": "a"}),
+        ("slow_lookup", {"query": "b"}),
+        ("add_to_cart", {"user_id": "ana", "item": "brownie"}),
+    )
+
+    _node().invoke([message])
+
+    assert events.index("lookup:b:start") < events.index("lookup:a:end")
+    assert events.index("cart:ana:latte:end") < events.index("cart:ana:brownie:start")
+
+
+def test_node_runs_inside_a_langgraph_state_graph():
+    """Falla si LangGraph deja de aceptar el nodo por su interfaz pública (Runnable)."""
+    class State(TypedDict):
+        messages: Annotated[Sequence[BaseMessage], add_messages]
+
+    workflow = StateGraph(State)
+    workflow.add_node("action", _node())
+    workflow.set_entry_point("action")
+    workflow.add_edge("action", END)
+    app = workflow.compile()
+    message = _calls(("slow_lookup", {"query": "horarios"}))
+
+    result = app.invoke({"messages": [message]})
+    async_result = asyncio.run(app.ainvoke({"messages": [message]}))
+
+    for state in (result, async_result):
+        assert isinstance(state["messages"][-1], ToolMessage)
+        assert state["messages"][-1].content == "resultado de horarios"
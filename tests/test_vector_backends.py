@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from core.embeddings import HashingEmbeddings
+from core.vector_backends import NumpyBackend
+
+VECTORS = {
+    "horarios": [1.0, 0.0, 0.0],
+    "envios": [0.6, 0.8, 0.0],
+    "menu": [0.0, 0.0, 2.0],
+    "pagos": [0.8, 0.6, 0.0],
+}
+
+
+class FixedEmbeddings(Embeddings):
+    """Embeddings de prueba: un vector conocido por texto, para controlar el orden del ranking."""
+    def embed_documents(self, texts):
+        return [VECTORS[text] for text in texts]
+
+    def embed_query(self, text):
+        return VECTORS[text]
+
+
+def _documents(*names):
+    return [Document(page_content=name, metadata={"source": f"{name}.txt"}) for name in names]
+
+
+def test_hashing_embeddings_are_deterministic_and_normalized():
+    first, second = HashingEmbeddings(dim=64), HashingEmbeddings(dim=64)
+
+    vector = first.embed_query("¿Hacen envíos a domicilio?")
+
+    assert vector == second.embed_query("¿Hacen envios a domicilio?")
+    assert first.embed_documents(["¿Hacen envíos a domicilio?"]) == [vector]
+    assert len(vector) == 64
+    assert np.isclose(np.linalg.norm(vector), 1.0)
+    assert vector != first.embed_query("¿A qué hora abren?")
+
+
+def test_numpy_backend_returns_the_top_k_in_order(tmp_path):
+    backend = NumpyBackend(FixedEmbeddings(), str(tmp_path))
+    backend.apply(["h", "e", "m", "p"], _documents("horarios", "envios", "menu", "pagos"), [])
+
+    top = backend.search_by_vector([1.0, 0.1, 0.0], k=2)
+    everything = backend.search_by_vector([1.0, 0.1, 0.0], k=10)
+
+    assert [d.page_content for d in top] == ["horarios", "pagos"]
+    # Con k mayor que la cantidad de chunks se devuelven todos, igual de ordenados.
+    assert [d.page_content for d in everything] == ["horarios", "pagos", "envios", "menu"]
+    assert NumpyBackend(FixedEmbeddings(), str(tmp_path / "vacio")).search_by_vector([1.0, 0.0, 0.0], k=3) == []
+
+
+def test_numpy_backend_saves_atomically_and_loads_with_mmap(tmp_path):
+    backend = NumpyBackend(FixedEmbeddings(), str(tmp_path))
+    backend.apply(["h", "e", "m"], _documents("horarios", "envios", "menu"), [])
+    backend.apply(["p"], _documents("pagos"), ["e"])
+
+    assert sorted(os.listdir(tmp_path)) == ["chunks.json", "vectors.npy"]
+    reopened = NumpyBackend(FixedEmbeddings(), str(tmp_path))
+    assert reopened.exists()
+    reopened.load()
+
+    assert isinstance(reopened.matrix, np.memmap)
+    assert reopened.existing() == {"h": "horarios.txt", "m": "menu.txt", "p": "pagos.txt"}
+    # Los vectores se guardan normalizados.
+    assert np.allclose(np.linalg.norm(reopened.matrix, axis=1), 1.0)
+    assert [d.page_content for d in reopened.search_by_vector([0.0, 0.0, 1.0], k=1)] == ["menu"]